@@ -0,0 +1,166 @@
+"""Helpers shared by the benchmarks."""
+
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+
+from aiohttp import web
+
+# Import cogtiler the same way as when running from src/cogtiler
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "cogtiler"))
+# The COGs are built the same way as in the tests
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from cogs import write_cog  # noqa: E402
+
+
+def per_call(fn, number, repeat=3):
+    """Returns the best mean number of seconds of `fn()` over `repeat` runs of
+    `number` calls"""
+    fn()
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+def make_cog(width, height, tile=512, levels=6, bigtiff=False, tile_bytes=10):
+    """Returns a synthetic COG with the header layout of GDAL (see `write_cog`). Tiles
+    are `tile_bytes` zero bytes, which is enough for benchmarks of reading the header
+    and locating tiles"""
+    data = bytes(tile_bytes)
+    sizes = [
+        (max(width >> level, 1), max(height >> level, 1)) for level in range(levels)
+    ]
+    return write_cog(
+        [(w, h, [data] * (-(-w // tile) * -(-h // tile)), None) for w, h in sizes],
+        tile,
+        bigtiff,
+    )
+
+
+class MemoryReader:
+    """Reads a file held in memory and counts the reads and bytes read"""
+
+    def __init__(self, data, latency=0):
+        self.data = data
+        self.latency = latency
+        self.reads = 0
+        self.bytes = 0
+
+    async def read(self, offset, length):
+        self.reads += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        data = self.data[offset : offset + length]
+        self.bytes += len(data)
+        return data
+
+
+class Upstream:
+    """A http server of files in a thread, answering range requests. Responses start
+    after `latency` seconds and are sent in chunks at `bandwidth` bytes per second (0 is
+    unlimited)"""
+
+    chunk_size = 16 * 1024
+
+    def __init__(self, files, latency=0.0, bandwidth=0):
+        self.files = files
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = 0
+        self.url = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        app = web.Application()
+        app.router.add_get("/{name}", self._handle)
+        self._runner = web.AppRunner(app)
+        self._thread.start()
+        self._call(self._runner.setup())
+        self._call(web.TCPSite(self._runner, "127.0.0.1", 0).start())
+        self.url = f"http://127.0.0.1:{self._runner.addresses[0][1]}"
+        return self
+
+    def __exit__(self, *exc_info):
+        self._call(self._runner.cleanup())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _handle(self, request):
+        self.requests += 1
+        data = self.files[request.match_info["name"]]
+        start, stop = re.fullmatch(
+            r"bytes=(\d+)-(\d+)", request.headers["Range"]
+        ).groups()
+        body = data[int(start) : int(stop) + 1]
+        response = web.StreamResponse(
+            status=206,
+            headers={
+                "Content-Length": str(len(body)),
+                "Content-Range": f"bytes {start}-{int(start) + len(body) - 1}/{len(data)}",
+                "ETag": f'"{len(data)}"',
+            },
+        )
+        await response.prepare(request)
+        await asyncio.sleep(self.latency)
+        for i in range(0, len(body), self.chunk_size):
+            await response.write(body[i : i + self.chunk_size])
+            if self.bandwidth:
+                await asyncio.sleep(self.chunk_size / self.bandwidth)
+        await response.write_eof()
+        return response
+
+
+async def asgi_get(app, path, query="", headers=()):
+    """Sends a GET request to an ASGI app. Returns the status, the response headers,
+    the seconds until the first body bytes, the seconds until the whole response and
+    the number of body bytes"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(b"host", b"benchmark")] + list(headers),
+        "server": ("benchmark", 80),
+        "client": ("127.0.0.1", 1),
+    }
+    started = time.perf_counter()
+    result = {"status": None, "headers": [], "first": None, "size": 0}
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if requested:
+            # The client never disconnects
+            await asyncio.Event().wait()
+        requested = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+            result["headers"] = message["headers"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            if result["first"] is None:
+                result["first"] = time.perf_counter() - started
+            result["size"] += len(message["body"])
+
+    await app(scope, receive, send)
+    total = time.perf_counter() - started
+    return result["status"], result["headers"], result["first"], total, result["size"]
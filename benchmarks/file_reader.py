@@ -0,0 +1,84 @@
+"""Reads random full resolution tiles of a local COG with concurrent requests, through
+the pooled file reader with pread and with mmap, and through a reader which opens the
+file and reads all of it for each read, like the file reader did before the pool."""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from common import make_cog
+from aiocogdumper.cog_tiles import COGTiff
+from aiocogdumper.filedumper import FilePool, Reader
+
+WIDTH, HEIGHT, TILE = 13470, 8670, 512
+
+
+class WholeFileReader:
+    """Opens the file and reads all of it before seeking to the range"""
+
+    def __init__(self, path):
+        self.path = path
+
+    async def read(self, offset, length):
+        def read():
+            with open(self.path, "rb") as f:
+                f.read()
+                f.seek(offset)
+                return f.read(length)
+
+        return await asyncio.to_thread(read)
+
+
+async def read_tiles(reader, tiles, concurrency):
+    cog = COGTiff(reader.read)
+    await cog.read_header()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get_tile(x, y):
+        async with semaphore:
+            await cog.get_tile(x, y, 0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(get_tile(x, y) for x, y in tiles))
+    return len(tiles) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tiles", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--tile-bytes", type=int, default=30000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    data = make_cog(WIDTH, HEIGHT, TILE, tile_bytes=args.tile_bytes)
+    # Edge tiles are left out, they are masked or cropped
+    nx, ny = WIDTH // TILE, HEIGHT // TILE
+    random.seed(0)
+    tiles = [(random.randrange(nx), random.randrange(ny)) for _ in range(args.tiles)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cog.tif")
+        with open(path, "wb") as f:
+            f.write(data)
+        print(
+            f"{args.tiles} random tiles of {len(data) / 1e6:.0f} MB local COG, "
+            f"{args.concurrency} concurrent requests"
+        )
+        readers = [
+            ("whole file", lambda: WholeFileReader(path)),
+            ("pread", lambda: Reader(path, FilePool(64))),
+            ("mmap", lambda: Reader(path, FilePool(64, use_mmap=True))),
+        ]
+        for name, reader in readers:
+            rate = max(
+                asyncio.run(read_tiles(reader(), tiles, args.concurrency))
+                for _ in range(args.rounds)
+            )
+            print(f"  {name:10s} {rate:8.0f} tiles/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Parses the headers of synthetic COGs with many tiles from memory, so only the time
+of parsing is measured."""
+
+import argparse
+import asyncio
+
+from common import MemoryReader, make_cog, per_call
+from aiocogdumper.cog_tiles import COGTiff
+
+COGS = [(13470, 8670, 1024), (100000, 80000, 512)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    for bigtiff in (False, True):
+        for width, height, tile in COGS:
+            data = make_cog(width, height, tile, bigtiff=bigtiff)
+
+            async def parse():
+                reader = MemoryReader(data)
+                cog = COGTiff(reader.read)
+                await cog.read_header()
+                return cog
+
+            cog = asyncio.run(parse())
+            seconds = per_call(lambda: asyncio.run(parse()), args.number)
+            print(
+                f"{'BigTIFF' if bigtiff else 'TIFF':7s} {width}x{height} "
+                f"{len(cog._image_ifds[0].offsets):6d} tiles: {seconds * 1000:6.2f} ms "
+                f"({cog.header_reads} reads, {cog.header_bytes_read} bytes)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Masks the right and bottom edge of synthetic 4:2:0 tiles in the DCT domain and by
+decoding, masking and encoding the pixels. Reports the time per tile and the error of
+the kept pixels."""
+
+import argparse
+
+import numpy as np
+from turbojpeg import TJSAMP_420
+
+from common import per_call
+from aiocogdumper.cog_tiles import (
+    get_turbojpeg,
+    mask_padded_jpeg,
+    mask_padded_jpeg_dct,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 512, 1024])
+    parser.add_argument("--number", type=int, default=30)
+    args = parser.parse_args()
+
+    tj = get_turbojpeg()
+    rng = np.random.default_rng(1)
+    for size in args.sizes:
+        y, x = np.mgrid[0:size, 0:size]
+        pixels = np.stack([x * 3 % 256, y * 2 % 256, (x + y) % 256], -1)
+        pixels = np.clip(pixels + rng.integers(-20, 20, pixels.shape), 0, 255)
+        jpeg = tj.encode(pixels.astype(np.uint8), quality=90, jpeg_subsample=TJSAMP_420)
+        original = tj.decode(jpeg).astype(int)
+        # Edges inside a block, like most edge tiles
+        from_row, from_col = size - 57, size - 23
+        print(f"{size}x{size} tile")
+        for name, mask in [("pixel", mask_padded_jpeg), ("dct", mask_padded_jpeg_dct)]:
+
+            def run():
+                return mask(jpeg, size, size, from_row, from_col)
+
+            seconds = per_call(run, args.number)
+            kept = tj.decode(run()).astype(int)[:from_row, :from_col]
+            error = np.abs(kept - original[:from_row, :from_col])
+            print(
+                f"  {name:5s} {seconds * 1000:7.2f} ms/tile, kept pixels mean error "
+                f"{error.mean():.3f} max {error.max()}"
+            )
+        copy = per_call(lambda: tj.crop(jpeg, 0, 0, size, size), args.number)
+        print(f"  lossless copy {copy * 1000:.2f} ms/tile")
+
+
+if __name__ == "__main__":
+    main()
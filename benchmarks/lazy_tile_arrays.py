@@ -0,0 +1,55 @@
+"""Counts the reads and bytes read to open synthetic COGs with the header layout of GDAL
+and to read a tile of the smallest overview and of the full resolution image, with the
+tile arrays read when the header is parsed and read on demand."""
+
+import argparse
+import asyncio
+
+from common import MemoryReader, make_cog
+from aiocogdumper.cog_tiles import COGTiff
+
+COGS = [(13470, 8670, 1024), (100000, 80000, 512)]
+
+
+async def read(data, lazy, latency):
+    reader = MemoryReader(data, latency)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    cog = COGTiff(reader.read, lazy_tile_arrays=lazy)
+    steps = []
+    await cog.read_header()
+    steps.append(("open", reader.reads, reader.bytes, loop.time() - started))
+    await cog.get_tile(0, 0, len(cog._image_ifds) - 1)
+    steps.append(("overview tile", reader.reads, reader.bytes, loop.time() - started))
+    await cog.get_tile(7, 5, 0)
+    steps.append(("full tile", reader.reads, reader.bytes, loop.time() - started))
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.02,
+        help="Seconds per read, like a round trip",
+    )
+    args = parser.parse_args()
+
+    for bigtiff in (False, True):
+        for width, height, tile in COGS:
+            data = make_cog(width, height, tile, bigtiff=bigtiff)
+            print(f"{'BigTIFF' if bigtiff else 'TIFF'} {width}x{height}")
+            for lazy in (False, True):
+                steps = asyncio.run(read(data, lazy, args.latency))
+                print(
+                    f"  {'lazy' if lazy else 'eager':5s} "
+                    + ", ".join(
+                        f"{name}: {reads} reads {size / 1000:.0f} KB {seconds * 1000:.0f} ms"
+                        for name, reads, size, seconds in steps
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Requests a tile served from the tile cache through the app with many concurrent
+clients. For comparison the app is also wrapped in two pass-through middlewares based
+on Starlette's BaseHTTPMiddleware, like the ones the app used before."""
+
+import argparse
+import asyncio
+import time
+
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from common import Upstream, asgi_get, make_cog
+import main
+
+
+async def pass_through(request, call_next):
+    return await call_next(request)
+
+
+async def requests_per_second(app, url, number, concurrency):
+    async def client():
+        for _ in range(number // concurrency):
+            status, *_ = await asgi_get(app, "/tiles/3/1/1.jpg", f"url={url}")
+            assert status == 200, status
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return number / (time.perf_counter() - started)
+
+
+def benchmark():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    files = {"cog.tif": make_cog(4096, 4096, 512, levels=4, tile_bytes=20_000)}
+    wrapped = BaseHTTPMiddleware(
+        BaseHTTPMiddleware(main.app, dispatch=pass_through), dispatch=pass_through
+    )
+    with Upstream(files) as upstream:
+        url = f"{upstream.url}/cog.tif"
+
+        async def run():
+            main.cog_client.start()
+            try:
+                # Fill the tile cache
+                await asgi_get(main.app, "/tiles/3/1/1.jpg", f"url={url}")
+                for name, app in [("app", main.app), ("BaseHTTPMiddleware", wrapped)]:
+                    for _ in range(args.repeat):
+                        rate = await requests_per_second(
+                            app, url, args.number, args.concurrency
+                        )
+                        print(f"{name:18s} {rate:6.0f} req/s")
+            finally:
+                await main.cog_client.stop()
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    benchmark()
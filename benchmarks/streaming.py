@@ -0,0 +1,65 @@
+"""Requests uncached tiles of about 0.8 MB from a throttled upstream server through the
+app, with tiles streamed to the client and buffered. Reports the time to the first byte
+and to the whole tile, and the peak of memory allocated by Python per request."""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tracemalloc
+
+from common import Upstream, asgi_get, make_cog
+
+os.environ["COGTILER_TILE_CACHE_SIZE"] = "0"
+os.environ["COGTILER_EDGE_TILE_CACHE_SIZE"] = "0"
+import main  # noqa: E402
+
+
+async def request_tiles(url, stream, rounds):
+    main.cog_client.stream_tiles = stream
+    first, total, peaks = [], [], []
+    for _ in range(rounds):
+        for x in range(4):
+            for y in range(2):
+                tracemalloc.start()
+                status, _, ttfb, seconds, _ = await asgi_get(
+                    main.app, f"/tiles/0/{x}/{y}.jpg", f"url={url}&overflow=pad"
+                )
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+                assert status == 200, status
+                first.append(ttfb)
+                total.append(seconds)
+    return statistics.median(first), statistics.median(total), statistics.median(peaks)
+
+
+def benchmark():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--bandwidth", type=float, default=50e6)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    files = {"cog.tif": make_cog(4096, 2048, 1024, levels=1, tile_bytes=800_000)}
+    with Upstream(files, args.latency, args.bandwidth) as upstream:
+        url = f"{upstream.url}/cog.tif"
+
+        async def run():
+            main.cog_client.start()
+            try:
+                await asgi_get(main.app, "/info", f"url={url}")
+                for stream in (False, True):
+                    first, total, peak = await request_tiles(url, stream, args.rounds)
+                    print(
+                        f"{'streamed' if stream else 'buffered':8s} first byte "
+                        f"{first * 1000:5.1f} ms, whole tile {total * 1000:5.1f} ms, "
+                        f"peak allocation {peak / 1e6:.2f} MB"
+                    )
+            finally:
+                await main.cog_client.stop()
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,40 @@
+"""Crops an edge tile with a new TurboJPEG instance per tile, like crop_padded_jpeg
+did before it used get_turbojpeg, and with the instance of the thread."""
+
+import argparse
+
+import numpy as np
+
+from common import per_call
+from aiocogdumper.cog_tiles import LIBTURBOJPEG, crop_padded_jpeg, get_turbojpeg
+from turbojpeg import TurboJPEG
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tile-size", type=int, default=256)
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    size = args.tile_size
+    pixels = np.random.default_rng(0).integers(0, 256, (size, size, 3), np.uint8)
+    jpeg = get_turbojpeg().encode(pixels)
+    keep = size * 4 // 10
+
+    def new_instance():
+        TurboJPEG(LIBTURBOJPEG).crop(jpeg, 0, 0, keep, keep)
+
+    def thread_instance():
+        crop_padded_jpeg(jpeg, size, size, keep + 1, keep + 1)
+
+    construct = per_call(lambda: TurboJPEG(LIBTURBOJPEG), args.number)
+    print(f"TurboJPEG()             {construct * 1e6:8.0f} us")
+    for name, fn in [
+        ("new instance", new_instance),
+        ("thread instance", thread_instance),
+    ]:
+        print(f"crop, {name:17s} {per_call(fn, args.number) * 1e6:8.0f} us/tile")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,53 @@
 """Function for extracting tiff tiles."""
 
+import asyncio
 from dataclasses import dataclass
 from enum import Enum
+import io
+import json
 import os
 
 from abc import abstractmethod
 from math import ceil
 import struct
+import zipfile
 
-from aiocogdumper.errors import TIFFError
-from aiocogdumper.jpegreader import insert_tables
+import numpy as np
+
+from aiocogdumper.errors import JPEGError, TIFFError
+from aiocogdumper.jpegmask import mask_jpeg_coefficients
+from aiocogdumper.jpegreader import SOI, insert_tables
+from aiocogdumper.ranges import plan_ranges, read_ranges
 from aiocogdumper.tifftags import compression as CompressionType
 from aiocogdumper.tifftags import sizes as TIFFSizes
 from aiocogdumper.tifftags import tags as TIFFTags
 
+# Version of the format written by COGTiff.dump_header
+HEADER_DUMP_FORMAT = 2
+
+# Number of bytes of a lazily loaded TileOffsets or TileByteCounts array read at a time
+TILE_ARRAY_CHUNK_BYTES = int(os.environ.get("COG_TILE_ARRAY_CHUNK_BYTES", "4096"))
+
+# Max number of bytes read beyond the needed part of the header
+MAX_HEADER_READ_AHEAD = 1024 * 1024
+
 
 class AbstractReader:  # pragma: no cover
     @abstractmethod
-    async def read(offset, len):
+    async def read(self, offset, length):
+        """Returns `length` bytes at `offset`"""
         pass
 
+    async def read_many(self, ranges, max_gap=0, max_merged_bytes=0):
+        """Returns the bytes of each (offset, length) in `ranges`. Readers which can read
+        a batch of ranges faster than one at a time should override this"""
+        return await read_ranges(self.read, ranges, max_gap, max_merged_bytes)
+
+    async def stream(self, offset, length):
+        """Yields the bytes of a range in chunks. Readers which can return data before
+        the whole range is read should override this"""
+        yield await self.read(offset, length)
+
 
 from enum import Enum
 
@@ -42,6 +70,113 @@ class TiffInfo:
     compression: str
 
 
+class IFD:
+    """Parsed image file directory of a single resolution (or mask) in a COG.
+
+    Tile offsets and byte counts are kept in numpy arrays of the integer size used by
+    the file (32 bit for TIFF, 64 bit for BigTIFF), or in a TileArray if they are
+    read on demand."""
+
+    __slots__ = (
+        "image_width",
+        "image_height",
+        "compression",
+        "tile_width",
+        "tile_height",
+        "offsets",
+        "byte_counts",
+        "jpeg_tables",
+        "nx_tiles",
+        "ny_tiles",
+    )
+
+    def __init__(
+        self,
+        image_width,
+        image_height,
+        compression,
+        tile_width,
+        tile_height,
+        offsets,
+        byte_counts,
+        jpeg_tables,
+    ):
+        self.image_width = image_width
+        self.image_height = image_height
+        self.compression = compression
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.offsets = offsets
+        self.byte_counts = byte_counts
+        self.jpeg_tables = jpeg_tables
+        self.nx_tiles = ceil(image_width / float(tile_width))
+        self.ny_tiles = ceil(image_height / float(tile_height))
+
+    async def tile_location(self, idx):
+        """Returns (offset, byte count) of the tile with index `idx`"""
+        if isinstance(self.offsets, TileArray) or isinstance(
+            self.byte_counts, TileArray
+        ):
+            offset, byte_count = await asyncio.gather(
+                _array_item(self.offsets, idx), _array_item(self.byte_counts, idx)
+            )
+            return offset, byte_count
+        return int(self.offsets[idx]), int(self.byte_counts[idx])
+
+
+async def _array_item(values, idx):
+    if isinstance(values, TileArray):
+        return await values.get(idx)
+    return int(values[idx])
+
+
+class TileArray:
+    """TileOffsets or TileByteCounts array which is read from the file on demand.
+
+    The array is read in chunks of `chunk_bytes` so a tile request only fetches the
+    part of the array around its own index. Loaded chunks are kept."""
+
+    __slots__ = ("read", "offset", "count", "dtype", "chunk_len", "_chunks")
+
+    def __init__(self, read, offset, count, dtype, chunk_bytes=TILE_ARRAY_CHUNK_BYTES):
+        self.read = read
+        self.offset = offset
+        self.count = count
+        self.dtype = np.dtype(dtype)
+        self.chunk_len = max(chunk_bytes // self.dtype.itemsize, 1)
+        self._chunks = {}
+
+    def __len__(self):
+        return self.count
+
+    async def get(self, idx):
+        if not 0 <= idx < self.count:
+            raise TIFFError(f"Tile index {idx} is out of bounds")
+        chunk = idx // self.chunk_len
+        values = self._chunks.get(chunk)
+        if values is None:
+            # Concurrent requests for the same chunk share one read
+            values = asyncio.ensure_future(self._load(chunk))
+            self._chunks[chunk] = values
+        if isinstance(values, asyncio.Future):
+            try:
+                values = await asyncio.shield(values)
+            except Exception:
+                self._chunks.pop(chunk, None)
+                raise
+            self._chunks[chunk] = values
+        return int(values[idx - chunk * self.chunk_len])
+
+    async def _load(self, chunk):
+        start = chunk * self.chunk_len
+        count = min(self.chunk_len, self.count - start)
+        itemsize = self.dtype.itemsize
+        data = await self.read(self.offset + start * itemsize, count * itemsize)
+        if len(data) < count * itemsize:
+            raise TIFFError(f"Unexpected end of file reading tile array at {start}")
+        return np.frombuffer(data, self.dtype, count=count)
+
+
 class COGTiff:
     """
     Cloud Optimised GeoTIFF
@@ -60,193 +195,220 @@ class COGTiff:
         Tile content of full resolution image.
     """
 
-    def __init__(self, reader):
+    def __init__(
+        self,
+        reader,
+        source=None,
+        worker_pool=None,
+        dct_mask=False,
+        edge_tile_cache=None,
+        lazy_tile_arrays=False,
+        header_bytes=None,
+        max_range_gap=0,
+        max_merged_bytes=0,
+        stream=None,
+    ):
         """Parses a (Big)TIFF for image tiles.
         Parameters
         ----------
         reader:
             A reader that implements the cogdumper.cog_tiles.AbstractReader methods
+        source:
+            Optional identifier of the tiff (eg. its url). Used as key when caching tiles
+        worker_pool:
+            Optional aiocogdumper.workerpool.WorkerPool used for jpeg manipulation.
+            If not given jpeg manipulation is done in the event loop
+        dct_mask:
+            Mask edge tiles in the DCT domain instead of decoding and encoding them
+        edge_tile_cache:
+            Optional cache (with `get(key)` and `put(key, bytes)` methods) storing masked and
+            cropped edge tiles. Requires `source` as it is part of the cache key
+        lazy_tile_arrays:
+            Do not read the TileOffsets and TileByteCounts arrays with the header. Instead
+            the part of an array needed for a tile is read when the tile is requested.
+            Arrays which are already within the bytes read for the header are still
+            decoded right away
+        header_bytes:
+            Number of bytes read from the start of the file when the header is parsed.
+            By default the value of the environment variable COG_INGESTED_BYTES_AT_OPEN
+            or 16384
+        max_range_gap:
+            Reads of a tile and its mask which are at most this many bytes apart are
+            merged into a single read
+        max_merged_bytes:
+            Max number of bytes of a single read of merged tiles. 0 is no limit
+        stream:
+            Optional `stream(offset, length)` async generator yielding the bytes of a
+            range in chunks (like `AbstractReader.stream`). Required by `stream_tile`
         """
+        self.source = source
+        self._worker_pool = worker_pool
+        self._mask_jpeg = mask_padded_jpeg_dct if dct_mask else mask_padded_jpeg
+        self._edge_tile_cache = edge_tile_cache if source is not None else None
+        self._lazy_tile_arrays = lazy_tile_arrays
+        self._header_bytes = header_bytes
+        self._max_range_gap = max_range_gap
+        self._max_merged_bytes = max_merged_bytes
         self._endian = "<"
         self._version = 42
         self.read = reader
+        self.stream = stream
         self._big_tiff = False
-        self.header = ""
+        self.header = bytearray()
         self._offset = 0
         self._image_ifds = []
         self._mask_ifds = []
         self._header_is_parsed = False
+        # Number of reads and bytes used for parsing the header, and the number of bytes
+        # of the header which were actually needed
+        self.header_reads = 0
+        self.header_bytes_read = 0
+        self.header_size = 0
+        # Validators of the file (like the ETag and Last-Modified headers of a http
+        # response) set by the caller. They are kept in header dumps
+        self.etag = None
+        self.last_modified = None
 
         # self.read_header()
 
+    async def _ensure_header(self, end):
+        """Makes sure the header buffer holds the bytes up to `end`.
+
+        The buffer is grown in place. The missing bytes are read and, to limit the number
+        of round trips, as far again as `end` ahead of them but at most
+        MAX_HEADER_READ_AHEAD bytes."""
+        self.header_size = max(self.header_size, end)
+        start = len(self.header)
+        if end <= start:
+            return
+        missing = end - start
+        data = await self.read(start, missing + min(end, MAX_HEADER_READ_AHEAD))
+        self.header_reads += 1
+        self.header_bytes_read += len(data)
+        self.header.extend(data)
+        if len(self.header) < end:
+            raise TIFFError(f"Unexpected end of file reading TIFF header at {end}")
+
+    def _unpack(self, fmt, offset):
+        """Unpacks a single value from the header buffer"""
+        return struct.unpack_from(f"{self._endian}{fmt}", self.header, offset)[0]
+
     async def _ifds(self):
-        """Reads TIFF image file directories from a COG recursively.
-        Parameters
-        -----------
-        offset:
-            number, offset into the tiff stream to read from, this is only
-            required for the first image file directory
-        overview:
-            number, an identifier that is the overview level in the COG
-            image pyramid
+        """Reads TIFF image file directories from a COG.
+
+        The tag table of each IFD is decoded in one go using a structured numpy dtype.
+        Values stored outside the tag table (like TileOffsets and TileByteCounts) are
+        decoded into numpy arrays, inline values into tuples. Byte valued tags (like
+        JPEGTables) are returned as bytes. With lazy tile arrays TileOffsets and
+        TileByteCounts outside of the bytes read so far are returned as TileArray.
+
         Yield
         --------
-        dict: Image File Directory for the next IFD
+        dict: tag code -> tag values of the next IFD
         """
-        while self._offset != 0:
-            next_offset = 0
-            pos = 0
-            tags = []
-
-            fallback_size = 4096 if self._big_tiff else 1024
-            if self._offset > len(self.header):
-                byte_starts = len(self.header)
-                byte_ends = byte_starts + self._offset + fallback_size
-                self.header += await self.read(byte_starts, byte_ends)
-
-            if self._big_tiff:
-                bytes = self.header[self._offset : self._offset + 8]
-                num_tags = struct.unpack(f"{self._endian}Q", bytes)[0]
-
-                byte_starts = self._offset + 8
-                byte_ends = (num_tags * 20) + 8 + byte_starts
-                if byte_ends > len(self.header):
-                    s = len(self.header)
-                    self.header += await self.read(s, byte_ends)
-
-                bytes = self.header[byte_starts:byte_ends]
-
-                for t in range(0, num_tags):
-                    code = struct.unpack(f"{self._endian}H", bytes[pos : pos + 2])[0]
-
-                    if code in TIFFTags:
-                        dtype = struct.unpack(
-                            f"{self._endian}H", bytes[pos + 2 : pos + 4]
-                        )[0]
-
-                        if dtype not in TIFFSizes:  # pragma: no cover
-                            raise TIFFError(f"Unrecognised data type {dtype}")
-
-                        num_values = struct.unpack(
-                            f"{self._endian}Q", bytes[pos + 4 : pos + 12]
-                        )[0]
-                        tag_len = num_values * TIFFSizes[dtype]["size"]
-                        if tag_len <= 8:
-                            data = bytes[pos + 12 : pos + 12 + tag_len]
-                        else:  # pragma: no cover
-                            data_offset = struct.unpack(
-                                f"{self._endian}Q", bytes[pos + 12 : pos + 20]
-                            )[0]
-
-                            byte_starts = data_offset
-                            byte_ends = byte_starts + tag_len
-                            if byte_ends > len(self.header):
-                                s = len(self.header)
-                                self.header += await self.read(s, byte_ends)
-
-                            data = self.header[byte_starts:byte_ends]
-
-                        tags.append(
-                            {
-                                "code": code,
-                                "dtype": TIFFSizes[dtype],
-                                "num_values": num_values,
-                                "data": data,
-                            }
-                        )
-
-                    pos = pos + 20
+        if self._big_tiff:
+            count_fmt, count_size, value_fmt, value_size = "Q", 8, "Q", 8
+        else:
+            count_fmt, count_size, value_fmt, value_size = "H", 2, "L", 4
+        entry_dtype = np.dtype(
+            [
+                ("code", f"{self._endian}u2"),
+                ("dtype", f"{self._endian}u2"),
+                ("num_values", f"{self._endian}u{value_size}"),
+                ("value", f"V{value_size}"),
+            ]
+        )
+        value_field = entry_dtype.fields["value"][1]
 
-                self._offset = self._offset + 8 + pos
-                next_offset = struct.unpack(
-                    f"{self._endian}Q", self.header[self._offset : self._offset + 8]
-                )[0]
-            else:
-                bytes = self.header[self._offset : self._offset + 2]
-                num_tags = struct.unpack(f"{self._endian}H", bytes)[0]
-
-                byte_starts = self._offset + 2
-                byte_ends = (num_tags * 12) + 2 + byte_starts
-                if byte_ends > len(self.header):
-                    s = len(self.header)
-                    self.header += await self.read(s, byte_ends)
-
-                bytes = self.header[byte_starts:byte_ends]
-
-                for t in range(0, num_tags):
-                    code = struct.unpack(f"{self._endian}H", bytes[pos : pos + 2])[0]
-
-                    if code in TIFFTags:
-                        dtype = struct.unpack(
-                            f"{self._endian}H", bytes[pos + 2 : pos + 4]
-                        )[0]
-
-                        if dtype not in TIFFSizes:  # pragma: no cover
-                            raise TIFFError(f"Unrecognised data type {dtype}")
-
-                        num_values = struct.unpack(
-                            f"{self._endian}L", bytes[pos + 4 : pos + 8]
-                        )[0]
-                        tag_len = num_values * TIFFSizes[dtype]["size"]
-                        if tag_len <= 4:
-                            data = bytes[pos + 8 : pos + 8 + tag_len]
-                        else:
-                            data_offset = struct.unpack(
-                                f"{self._endian}L", bytes[pos + 8 : pos + 12]
-                            )[0]
-
-                            byte_starts = data_offset
-                            byte_ends = byte_starts + tag_len
-                            if byte_ends > len(self.header):
-                                s = len(self.header)
-                                self.header += await self.read(s, byte_ends)
-                            data = self.header[byte_starts:byte_ends]
-
-                        tags.append(
-                            {
-                                "code": code,
-                                "dtype": TIFFSizes[dtype],
-                                "num_values": num_values,
-                                "data": data,
-                            }
+        while self._offset != 0:
+            await self._ensure_header(self._offset + count_size)
+            num_tags = self._unpack(count_fmt, self._offset)
+            table_start = self._offset + count_size
+            table_end = table_start + num_tags * entry_dtype.itemsize
+            # Include the offset to the next IFD following the tag table
+            await self._ensure_header(table_end + value_size)
+            entries = np.frombuffer(
+                self.header, entry_dtype, count=num_tags, offset=table_start
+            )
+            codes = entries["code"].tolist()
+            dtypes = entries["dtype"].tolist()
+            counts = entries["num_values"].tolist()
+            # Release the view so the header buffer can grow
+            del entries
+            next_offset = self._unpack(value_fmt, table_end)
+
+            tags = {}
+            for i, code in enumerate(codes):
+                if code not in TIFFTags:
+                    continue
+                if dtypes[i] not in TIFFSizes:  # pragma: no cover
+                    raise TIFFError(f"Unrecognised data type {dtypes[i]}")
+                tiff_type = TIFFSizes[dtypes[i]]
+                num_values = counts[i]
+                tag_len = num_values * tiff_type["size"]
+                data_offset = table_start + i * entry_dtype.itemsize + value_field
+                if tag_len <= value_size:
+                    values = struct.unpack_from(
+                        f"{self._endian}{num_values}{tiff_type['format']}",
+                        self.header,
+                        data_offset,
+                    )
+                else:
+                    data_offset = self._unpack(value_fmt, data_offset)
+                    if (
+                        self._lazy_tile_arrays
+                        and code in (324, 325)
+                        and data_offset + tag_len > len(self.header)
+                    ):
+                        tags[code] = TileArray(
+                            self.read,
+                            data_offset,
+                            num_values,
+                            f"{self._endian}{tiff_type['dtype']}",
                         )
-
-                    pos = pos + 12
-
-                self._offset = self._offset + 2 + pos
-                next_offset = struct.unpack(
-                    f"{self._endian}L", self.header[self._offset : self._offset + 4]
-                )[0]
+                        continue
+                    await self._ensure_header(data_offset + tag_len)
+                    values = np.frombuffer(
+                        self.header,
+                        f"{self._endian}{tiff_type['dtype']}",
+                        count=num_values,
+                        offset=data_offset,
+                    ).copy()
+                if tiff_type["size"] == 1:
+                    values = bytes(self.header[data_offset : data_offset + tag_len])
+                tags[code] = values
 
             self._offset = next_offset
-
-            yield {"tags": tags, "next_offset": next_offset}
+            yield tags
 
     async def read_header(self):
         """Read and parse COG header."""
         if self._header_is_parsed:
             return
-        buff_size = int(os.environ.get("COG_INGESTED_BYTES_AT_OPEN", "16384"))
-        self.header = await self.read(0, buff_size)
+        buff_size = self._header_bytes or int(
+            os.environ.get("COG_INGESTED_BYTES_AT_OPEN", "16384")
+        )
+        self.header_reads = 1
+        self.header_bytes_read = buff_size
+        self.header = bytearray(await self.read(0, buff_size))
 
         # read first 4 bytes to determine tiff or bigtiff and byte order
         if self.header[:2] == b"MM":
             self._endian = ">"
 
-        self._version = struct.unpack(f"{self._endian}H", self.header[2:4])[0]
+        self._version = self._unpack("H", 2)
 
         if self._version == 42:
             # TIFF
             self._big_tiff = False
             # read offset to first IFD
-            self._offset = struct.unpack(f"{self._endian}L", self.header[4:8])[0]
+            self._offset = self._unpack("L", 4)
         elif self._version == 43:
             # BIGTIFF
             self._big_tiff = True
-            bytes = self.header[4:16]
-            bytesize = struct.unpack(f"{self._endian}H", bytes[0:2])[0]
-            w = struct.unpack(f"{self._endian}H", bytes[2:4])[0]
-            self._offset = struct.unpack(f"{self._endian}Q", bytes[4:])[0]
+            bytesize = self._unpack("H", 4)
+            w = self._unpack("H", 6)
+            self._offset = self._unpack("Q", 8)
             if bytesize != 8 or w != 0:  # pragma: no cover
                 raise TIFFError(
                     f"Invalid BigTIFF with bytesize {bytesize} and word {w}"
@@ -256,71 +418,39 @@ class COGTiff:
 
         self._init = True
 
+        offset_dtype = np.uint64 if self._big_tiff else np.uint32
         # for JPEG we need to read all IFDs, they are at the front of the file
-        async for ifd in self._ifds():
-            mime_type = "image/jpeg"
+        async for tags in self._ifds():
             # tile offsets are an extension but if they aren't in the file then
             # you can't get a tile back!
-            offsets = []
-            byte_counts = []
-            image_width = 0
-            image_height = 0
-            tile_width = 0
-            tile_height = 0
-            jpeg_tables = None
-
-            for t in ifd["tags"]:
-                code = t["code"]
-                fmt = t["dtype"]["format"]
-                if code == 256:
-                    # image width
-                    image_width = struct.unpack(f"{self._endian}{fmt}", t["data"])[0]
-                elif code == 257:
-                    # image height
-                    image_height = struct.unpack(f"{self._endian}{fmt}", t["data"])[0]
-                elif code == 259:
-                    # compression
-                    val = struct.unpack(f"{self._endian}{fmt}", t["data"])[0]
-                    if val in CompressionType:
-                        mime_type = CompressionType[val]
-                    else:
-                        mime_type = "application/octet-stream"
-                elif code == 322:
-                    # tile width
-                    tile_width = struct.unpack(f"{self._endian}{fmt}", t["data"])[0]
-                elif code == 323:
-                    # tile height
-                    tile_height = struct.unpack(f"{self._endian}{fmt}", t["data"])[0]
-                elif code == 324:
-                    # tile offsets
-                    offsets = struct.unpack(
-                        f'{self._endian}{t["num_values"]}{fmt}', t["data"]
-                    )
-                elif code == 325:
-                    # tile byte counts
-                    byte_counts = struct.unpack(
-                        f'{self._endian}{t["num_values"]}{fmt}', t["data"]
-                    )
-                elif code == 347:
-                    # JPEG Tables
-                    jpeg_tables = t["data"]
-
-            if len(offsets) == 0:
-                raise TIFFError("TIFF Tiles are not found in IFD {z}")
-
-            ifd["image_width"] = image_width
-            ifd["image_height"] = image_height
-            ifd["compression"] = mime_type
-            ifd["tile_width"] = tile_width
-            ifd["tile_height"] = tile_height
-            ifd["offsets"] = offsets
-            ifd["byte_counts"] = byte_counts
-            ifd["jpeg_tables"] = jpeg_tables
-
-            ifd["nx_tiles"] = ceil(image_width / float(tile_width))
-            ifd["ny_tiles"] = ceil(image_height / float(tile_height))
-
-            if ifd["compression"] == "deflate":
+            if 324 not in tags:
+                raise TIFFError("TIFF Tiles are not found in IFD")
+
+            compression = int(tags[259][0]) if 259 in tags else None
+            if compression is None:
+                mime_type = "image/jpeg"
+            elif compression in CompressionType:
+                mime_type = CompressionType[compression]
+            else:
+                mime_type = "application/octet-stream"
+
+            image_width = int(tags[256][0]) if 256 in tags else 0
+            image_height = int(tags[257][0]) if 257 in tags else 0
+            tile_width = int(tags[322][0]) if 322 in tags else 0
+            tile_height = int(tags[323][0]) if 323 in tags else 0
+
+            ifd = IFD(
+                image_width=image_width,
+                image_height=image_height,
+                compression=mime_type,
+                tile_width=tile_width,
+                tile_height=tile_height,
+                offsets=_tile_array(tags[324], offset_dtype),
+                byte_counts=_tile_array(tags.get(325, ()), offset_dtype),
+                jpeg_tables=tags.get(347),
+            )
+
+            if ifd.compression == "deflate":
                 self._mask_ifds.append(ifd)
             else:
                 self._image_ifds.append(ifd)
@@ -329,99 +459,423 @@ class COGTiff:
             self._image_ifds = self._mask_ifds
             self._mask_ifds = []
 
-        # Done parsing header. Dont spend time parsing it again.
+        # Done parsing header. Dont spend time parsing it again. Everything needed is in
+        # the parsed IFDs, so release the raw header bytes.
+        self._header_is_parsed = True
+        self.header = bytearray()
+
+    def dump_header(self):
+        """Serializes the parsed header so it can be loaded with `load_header` instead of
+        reading and parsing it again.
+
+        The dump is a numpy .npz archive (no pickled objects) holding the tile offsets,
+        byte counts and JPEG tables of each IFD and json metadata. Tile arrays read on
+        demand are stored as their location in the file.
+
+        Returns
+        -------
+        bytes
+            The serialized header
+        """
+        if not self._header_is_parsed:
+            raise TIFFError("Header must be parsed before it can be dumped")
+        meta = {
+            "format": HEADER_DUMP_FORMAT,
+            "version": self._version,
+            "big_tiff": self._big_tiff,
+            "endian": self._endian,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "ifds": [],
+        }
+        arrays = {}
+        for kind, ifds in (("image", self._image_ifds), ("mask", self._mask_ifds)):
+            for ifd in ifds:
+                name = f"ifd{len(meta['ifds'])}"
+                ifd_meta = {
+                    "kind": kind,
+                    "image_width": ifd.image_width,
+                    "image_height": ifd.image_height,
+                    "compression": ifd.compression,
+                    "tile_width": ifd.tile_width,
+                    "tile_height": ifd.tile_height,
+                }
+                for field in ("offsets", "byte_counts"):
+                    values = getattr(ifd, field)
+                    if isinstance(values, TileArray):
+                        ifd_meta[field] = [
+                            values.offset,
+                            values.count,
+                            values.dtype.str,
+                        ]
+                    else:
+                        arrays[f"{name}_{field}"] = values
+                if ifd.jpeg_tables is not None:
+                    arrays[f"{name}_jpeg_tables"] = np.frombuffer(
+                        ifd.jpeg_tables, np.uint8
+                    )
+                meta["ifds"].append(ifd_meta)
+        arrays["meta"] = np.frombuffer(json.dumps(meta).encode(), np.uint8)
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+    def load_header(self, data):
+        """Loads a header serialized with `dump_header` instead of reading the header
+
+        Parameters
+        ----------
+        data:
+            The bytes returned by `dump_header`
+        """
+        try:
+            with np.load(io.BytesIO(data), allow_pickle=False) as arrays:
+                meta = json.loads(arrays["meta"].tobytes())
+                if meta.get("format") != HEADER_DUMP_FORMAT:
+                    raise TIFFError(f"Unsupported header format {meta.get('format')}")
+                image_ifds, mask_ifds = [], []
+                for n, ifd_meta in enumerate(meta["ifds"]):
+                    name = f"ifd{n}"
+                    tile_arrays = {}
+                    for field in ("offsets", "byte_counts"):
+                        if field in ifd_meta:
+                            offset, count, dtype = ifd_meta[field]
+                            tile_arrays[field] = TileArray(
+                                self.read, offset, count, dtype
+                            )
+                        else:
+                            tile_arrays[field] = arrays[f"{name}_{field}"]
+                    jpeg_tables = None
+                    if f"{name}_jpeg_tables" in arrays:
+                        jpeg_tables = arrays[f"{name}_jpeg_tables"].tobytes()
+                    ifd = IFD(
+                        image_width=ifd_meta["image_width"],
+                        image_height=ifd_meta["image_height"],
+                        compression=ifd_meta["compression"],
+                        tile_width=ifd_meta["tile_width"],
+                        tile_height=ifd_meta["tile_height"],
+                        jpeg_tables=jpeg_tables,
+                        **tile_arrays,
+                    )
+                    if ifd_meta["kind"] == "mask":
+                        mask_ifds.append(ifd)
+                    else:
+                        image_ifds.append(ifd)
+        except (OSError, ValueError, KeyError, TypeError, zipfile.BadZipFile) as e:
+            raise TIFFError(f"Invalid header dump: {e}")
+        self._version = meta["version"]
+        self._big_tiff = meta["big_tiff"]
+        self._endian = meta["endian"]
+        self.etag = meta.get("etag")
+        self.last_modified = meta.get("last_modified")
+        self._image_ifds = image_ifds
+        self._mask_ifds = mask_ifds
         self._header_is_parsed = True
 
     async def get_info(self, z=0):
         await self.read_header()
         image_ifd = self._image_ifds[z]
         return TiffInfo(
-            width=image_ifd["image_width"],
-            height=image_ifd["image_height"],
-            tile_width=image_ifd["tile_width"],
-            tile_height=image_ifd["tile_height"],
-            tile_cols=image_ifd["nx_tiles"],
-            tile_rows=image_ifd["ny_tiles"],
-            compression=image_ifd["compression"],
+            width=image_ifd.image_width,
+            height=image_ifd.image_height,
+            tile_width=image_ifd.tile_width,
+            tile_height=image_ifd.tile_height,
+            tile_cols=image_ifd.nx_tiles,
+            tile_rows=image_ifd.ny_tiles,
+            compression=image_ifd.compression,
             # Should this be a list of overviews?
             overviews=len(self._image_ifds) - z - 1,
         )
 
     async def get_tile(self, x: int, y: int, z: int, overflow: Overflow = Overflow.Pad):
         """Read tile data."""
+        tiles = [tile async for tile in await self.get_tiles([(x, y, z, overflow)])]
+        _, mime_type, tile = tiles[0]
+        return mime_type, tile
+
+    async def get_tiles(self, tiles):
+        """Read a number of tiles, merging reads of tiles which are close in the file.
+
+        All tiles are checked and located before this returns, so invalid tiles raise
+        TIFFError here and not while iterating.
+
+        Parameters
+        ----------
+        tiles:
+            List of (x, y, z, overflow)
+
+        Returns
+        -------
+        async iterator
+            Yields (index, mime type, tile bytes) of each tile as soon as it has been
+            read. `index` is the position of the tile in `tiles`
+        """
+        await self.read_header()
+        done = []
+        pending = []
+        for i, (x, y, z, overflow) in enumerate(tiles):
+            ifds, idx, process_edge = self._find_tile(x, y, z, overflow)
+            if process_edge and self._edge_tile_cache is not None:
+                tile = self._edge_tile_cache.get((self.source, z, x, y, overflow))
+                if tile is not None:
+                    done.append((i, ifds[0].compression, tile))
+                    continue
+            pending.append((i, x, y, z, overflow, process_edge, ifds, idx))
+        ranges = await asyncio.gather(
+            *(ifd.tile_location(idx) for *_, ifds, idx in pending for ifd in ifds)
+        )
+        return self._read_tiles(done, pending, ranges)
+
+    async def stream_tile(
+        self, x: int, y: int, z: int, overflow: Overflow = Overflow.Pad
+    ):
+        """Stream tile data.
+
+        Only tiles which need no processing can be streamed, that is tiles which are
+        not in the last tile row or col or which are requested with Overflow.Pad. Tiles
+        whose mask is close enough to be read in the same request (see
+        `max_range_gap`) are not streamed either, as `get_tile` reads them with a
+        single request.
+
+        Returns
+        -------
+        tuple or None
+            (mime type, number of bytes, async iterator of the tile bytes in chunks), or
+            None if the tile cannot be streamed. Invalid tiles raise TIFFError
+        """
+        await self.read_header()
+        ifds, idx, process_edge = self._find_tile(x, y, z, overflow)
+        if process_edge or self.stream is None:
+            return None
+        ranges = await asyncio.gather(*(ifd.tile_location(idx) for ifd in ifds))
+        ranges_read = [r for r in ranges if r[1] > 0]
+        merged = plan_ranges(ranges_read, self._max_range_gap, self._max_merged_bytes)
+        if len(merged) < len(ranges_read):
+            return None
+        image_ifd = ifds[0]
+        tables = None
+        if image_ifd.compression == "image/jpeg" and image_ifd.jpeg_tables:
+            tables = image_ifd.jpeg_tables[2:-2]
+        size = sum(length for _, length in ranges) + len(tables or b"")
+        return image_ifd.compression, size, self._stream_tile(ranges, tables)
+
+    async def _stream_tile(self, ranges, tables):
+        (offset, length), *mask_ranges = ranges
+        # The masks are small and read while the tile is streamed
+        mask_reads = [
+            asyncio.ensure_future(self.read(*mask_range))
+            for mask_range in mask_ranges
+            if mask_range[1] > 0
+        ]
+        try:
+            head = b""
+            if length > 0:
+                async for chunk in self.stream(offset, length):
+                    if tables is not None:
+                        # Insert the tables after the SOI marker (see insert_tables)
+                        head += chunk
+                        if len(head) < 2:
+                            continue
+                        if head[0] != 0xFF or head[1] != SOI:
+                            raise JPEGError("Missing SOI marker for JPEG tile")
+                        yield head[:2]
+                        yield tables
+                        chunk = head[2:]
+                        tables = None
+                    if chunk:
+                        yield chunk
+            if tables is not None:
+                raise JPEGError("Missing SOI marker for JPEG tile")
+            for mask_read in mask_reads:
+                yield await mask_read
+        finally:
+            for task in mask_reads:
+                if not task.cancel() and not task.cancelled():
+                    # Mark exception as retrieved when the iteration was stopped early
+                    task.exception()
+
+    def _find_tile(self, x, y, z, overflow):
+        """Returns the IFDs holding the tile (and its mask), the index of the tile in
+        them and whether the tile needs processing of its padded area"""
+        if z >= len(self._image_ifds):
+            raise TIFFError(f"Overview {z} is out of bounds.")
+        image_ifd = self._image_ifds[z]
+        if y >= image_ifd.ny_tiles or x >= image_ifd.nx_tiles:
+            raise TIFFError(f"Tile {x} {y} is out of bounds for overview {z}")
+        # TODO: Handle different block orders!
+        idx = (y * image_ifd.nx_tiles) + x
+        if idx > len(image_ifd.offsets):
+            raise TIFFError(f"Tile {x} {y} {z} does not exist")
+        # Tiles in the last tile row or col may need processing of the padded area
+        process_edge = overflow != Overflow.Pad and (
+            x == image_ifd.nx_tiles - 1 or y == image_ifd.ny_tiles - 1
+        )
+        # look for a bit mask file
+        ifds = [image_ifd]
+        if image_ifd.compression == "image/jpeg" and z < len(self._mask_ifds):
+            ifds.append(self._mask_ifds[z])
+        return ifds, idx, process_edge
+
+    async def _read_tiles(self, done, pending, ranges):
+        for tile in done:
+            yield tile
+        if not pending:
+            return
+        # Pending tile of each range, and the positions in `ranges` of the tile and mask
+        # ranges of each pending tile
+        range_tiles = [n for n, (*_, ifds, _) in enumerate(pending) for _ in ifds]
+        tile_ranges = [[] for _ in pending]
+        for r, n in enumerate(range_tiles):
+            tile_ranges[n].append(r)
+        # Empty ranges are not read
+        datas = [b"" if length == 0 else None for _, length in ranges]
+        remaining = [sum(datas[r] is None for r in rs) for rs in tile_ranges]
+        for n, count in enumerate(remaining):
+            if count == 0:
+                yield await self._finish_tile(
+                    pending[n], [datas[r] for r in tile_ranges[n]]
+                )
+
+        async def read(offset, length, indices):
+            return offset, indices, await self.read(offset, length)
+
+        # Close tiles (and masks) are read together and all reads run concurrently
+        reads = [
+            asyncio.ensure_future(read(*planned))
+            for planned in plan_ranges(
+                ranges, self._max_range_gap, self._max_merged_bytes
+            )
+        ]
+        try:
+            for next_read in asyncio.as_completed(reads):
+                start, indices, data = await next_read
+                for r in indices:
+                    offset, length = ranges[r]
+                    datas[r] = data[offset - start : offset - start + length]
+                    n = range_tiles[r]
+                    remaining[n] -= 1
+                    if remaining[n] == 0:
+                        yield await self._finish_tile(
+                            pending[n], [datas[k] for k in tile_ranges[n]]
+                        )
+        finally:
+            for task in reads:
+                if not task.cancel() and not task.cancelled():
+                    # Mark exception as retrieved when the iteration was stopped early
+                    task.exception()
+
+    async def _finish_tile(self, pending_tile, datas):
+        i, x, y, z, overflow, process_edge, ifds, _ = pending_tile
+        image_ifd = ifds[0]
+        tile, *mask_tiles = datas
+        if image_ifd.compression == "image/jpeg":
+            # fix up jpeg tile with missing quantization tables
+            tile = insert_tables(tile, image_ifd.jpeg_tables)
+            for mask_tile in mask_tiles:
+                tile = tile + mask_tile
+            # If we are at the last tile row or col we may have to do somethong about the padded area
+            if process_edge:
+                tile = await self._process_edge_tile(tile, image_ifd, x, y, overflow)
+                if self._edge_tile_cache is not None:
+                    self._edge_tile_cache.put((self.source, z, x, y, overflow), tile)
+        return i, image_ifd.compression, tile
+
+    async def warm_edge_tiles(
+        self, levels: int = 1, overflows=(Overflow.Mask, Overflow.Crop)
+    ):
+        """Processes the edge tiles of the `levels` lowest resolution overviews into the
+        edge tile cache."""
         await self.read_header()
-        if z < len(self._image_ifds):
+        if self._edge_tile_cache is None:
+            return
+        for z in range(max(len(self._image_ifds) - levels, 0), len(self._image_ifds)):
             image_ifd = self._image_ifds[z]
-            if y >= image_ifd["ny_tiles"] or x >= image_ifd["nx_tiles"]:
-                raise TIFFError(f"Tile {x} {y} is out of bounds for overview {z}")
-            # TODO: Handle different block orders!
-            idx = (y * image_ifd["nx_tiles"]) + x
-            if idx > len(image_ifd["offsets"]):
-                raise TIFFError(f"Tile {x} {y} {z} does not exist")
-            offset = image_ifd["offsets"][idx]
-            byte_count = image_ifd["byte_counts"][idx]
-            tile = await self.read(offset, byte_count)
-            if image_ifd["compression"] == "image/jpeg":
-                # fix up jpeg tile with missing quantization tables
-                tile = insert_tables(tile, image_ifd["jpeg_tables"])
-                # look for a bit mask file
-                if z < len(self._mask_ifds):
-                    mask_ifd = self._mask_ifds[z]
-                    mask_offset = mask_ifd["offsets"][idx]
-                    mask_byte_count = mask_ifd["byte_counts"][idx]
-                    mask_tile = await self.read(mask_offset, mask_byte_count)
-                    tile = tile + mask_tile
-                # If we are at the last tile row or col we may have to do somethong about the padded area
-                if overflow != Overflow.Pad and (
-                    x == image_ifd["nx_tiles"] - 1 or y == image_ifd["ny_tiles"] - 1
-                ):
-                    from_col = (
-                        image_ifd["image_width"] - image_ifd["tile_width"] * x + 1
+            nx, ny = image_ifd.nx_tiles, image_ifd.ny_tiles
+            edges = [(nx - 1, y) for y in range(ny)] + [
+                (x, ny - 1) for x in range(nx - 1)
+            ]
+            for x, y in edges:
+                # Read the tile once and process it for every overflow
+                _, tile = await self.get_tile(x, y, z, Overflow.Pad)
+                if image_ifd.compression != "image/jpeg":
+                    continue
+                for overflow in overflows:
+                    if overflow == Overflow.Pad:
+                        continue
+                    processed = await self._process_edge_tile(
+                        tile, image_ifd, x, y, overflow
                     )
-                    from_row = (
-                        image_ifd["image_height"] - image_ifd["tile_height"] * y + 1
+                    self._edge_tile_cache.put(
+                        (self.source, z, x, y, overflow), processed
                     )
-                    if overflow == Overflow.Mask:
-                        tile = mask_padded_jpeg(
-                            tile,
-                            image_ifd["tile_height"],
-                            image_ifd["tile_width"],
-                            from_row,
-                            from_col,
-                        )
-                    elif overflow == Overflow.Crop:
-                        tile = crop_padded_jpeg(
-                            tile,
-                            image_ifd["tile_height"],
-                            image_ifd["tile_width"],
-                            from_row,
-                            from_col,
-                        )
-                return image_ifd["compression"], tile
-            else:
-                return image_ifd["compression"], tile
-        else:
-            raise TIFFError(f"Overview {z} is out of bounds.")
+
+    async def _process_edge_tile(self, tile, image_ifd, x, y, overflow):
+        from_col = image_ifd.image_width - image_ifd.tile_width * x + 1
+        from_row = image_ifd.image_height - image_ifd.tile_height * y + 1
+        if overflow == Overflow.Mask:
+            return await self._run_jpeg_op(
+                self._mask_jpeg,
+                tile,
+                image_ifd.tile_height,
+                image_ifd.tile_width,
+                from_row,
+                from_col,
+            )
+        elif overflow == Overflow.Crop:
+            return await self._run_jpeg_op(
+                crop_padded_jpeg,
+                tile,
+                image_ifd.tile_height,
+                image_ifd.tile_width,
+                from_row,
+                from_col,
+            )
+        return tile
+
+    async def _run_jpeg_op(self, fn, *args):
+        if self._worker_pool is None:
+            return fn(*args)
+        return await self._worker_pool.run(fn, *args)
 
     @property
     def version(self):
         return self._version
 
 
+def _tile_array(values, dtype):
+    if isinstance(values, TileArray):
+        return values
+    return np.asarray(values, dtype=dtype)
+
+
 from turbojpeg import TurboJPEG
 import os
+import threading
 
 # The python module cannot find the correct libpath on alpine
 LIBTURBOJPEG = os.getenv("LIBTURBOJPEG")
 
+_thread_local = threading.local()
+
+
+def get_turbojpeg():
+    """Returns the TurboJPEG instance of the calling thread.
+
+    Loading libturbojpeg is relatively expensive, so each thread loads it once
+    and reuses it for all subsequent jpeg operations."""
+    turbojpeg = getattr(_thread_local, "turbojpeg", None)
+    if turbojpeg is None:
+        turbojpeg = TurboJPEG(LIBTURBOJPEG)
+        _thread_local.turbojpeg = turbojpeg
+    return turbojpeg
+
 
 def mask_padded_jpeg(
     jpegbytes, tile_height, tile_width, from_row, from_col, mask_value=0
 ):
-    # TODO: Should this be made async. Maybe like https://stackoverflow.com/a/53563478
     if not 0 <= from_row < tile_height and not 0 <= from_col < tile_width:
         return jpegbytes
-    turbojpeg = TurboJPEG(LIBTURBOJPEG)
+    turbojpeg = get_turbojpeg()
     bgr_array = turbojpeg.decode(jpegbytes)
     if 0 <= from_row < tile_height:
         bgr_array[from_row:, :, :] = mask_value
@@ -430,9 +884,23 @@ def mask_padded_jpeg(
     return turbojpeg.encode(bgr_array)
 
 
+def mask_padded_jpeg_dct(jpegbytes, tile_height, tile_width, from_row, from_col):
+    """Same as mask_padded_jpeg but only touches the DCT coefficients of blocks outside
+    or on the edge of the image. Falls back to mask_padded_jpeg for jpegs which cannot
+    be masked this way."""
+    if not 0 <= from_row < tile_height and not 0 <= from_col < tile_width:
+        return jpegbytes
+    keep_height = from_row if 0 <= from_row < tile_height else tile_height
+    keep_width = from_col if 0 <= from_col < tile_width else tile_width
+    try:
+        _, _, _, colorspace = get_turbojpeg().decode_header(jpegbytes)
+        return mask_jpeg_coefficients(jpegbytes, keep_height, keep_width, colorspace)
+    except (JPEGError, OSError):
+        return mask_padded_jpeg(jpegbytes, tile_height, tile_width, from_row, from_col)
+
+
 def crop_padded_jpeg(jpegbytes, tile_height, tile_width, from_row, from_col):
-    # TODO: Should this be made async. Maybe like https://stackoverflow.com/a/53563478
     if not 0 <= from_row < tile_height and not 0 <= from_col < tile_width:
         return jpegbytes
-    turbojpeg = TurboJPEG(LIBTURBOJPEG)
+    turbojpeg = get_turbojpeg()
     return turbojpeg.crop(jpegbytes, 0, 0, from_col - 1, from_row - 1)
@@ -11,12 +11,31 @@ class HTTPError(Exception):
         self.status = status
 
 
+class UpstreamUnavailableError(Exception):
+    """Represents an upstream server which is failing reads fast after repeated errors"""
+
+    exit_code = 1
+
+    def __init__(self, message, retry_after=None):
+        self.message = message
+        self.retry_after = retry_after
+
+
 class HTTPRangeNotSupportedError(Exception):
     """Represents an error indicating missing upstram support for http range requests"""
 
     exit_code = 1
 
 
+class UnsupportedSchemeError(Exception):
+    """Represents a url with a scheme no reader is registered for"""
+
+    exit_code = 1
+
+    def __init__(self, message):
+        self.message = message
+
+
 class TIFFError(Exception):
     exit_code = 1
 
@@ -1,26 +1,184 @@
 """A utility to dump tiles directly from a local tiff file."""
 
+import asyncio
 import logging
-from aiocogdumper.cog_tiles import AbstractReader
+import mmap
+import os
+from collections import OrderedDict
+from email.utils import formatdate
 from pathlib import Path
-import aiofiles
+
+from aiocogdumper.cog_tiles import AbstractReader
+from aiocogdumper.ranges import plan_ranges, split_reads
 
 logger = logging.getLogger(__name__)
 
 
+class _OpenFile:
+    __slots__ = ("fd", "mmap", "users")
+
+    def __init__(self, path, use_mmap):
+        self.fd = os.open(path, os.O_RDONLY)
+        self.mmap = None
+        self.users = 0
+        try:
+            if use_mmap and os.fstat(self.fd).st_size > 0:
+                self.mmap = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+        os.close(self.fd)
+
+
+class FilePool:
+    """Pool of open local files shared by readers.
+
+    At most `max_open` files are kept open. When more are needed the least recently used
+    file which is not being read is closed.
+
+    Reads use `os.pread` in a thread, so slow storage (like NFS) does not block the event
+    loop, and concurrent reads of the same file share its file descriptor. With `use_mmap`
+    files are memory mapped instead and reads are slices of the mapping taken in the
+    event loop. This avoids a system call and a thread switch per read, but a read of
+    pages which are not in the page cache blocks the event loop."""
+
+    def __init__(self, max_open=64, use_mmap=False):
+        """
+        Parameters
+        ----------
+        max_open:
+            Max number of files kept open
+        use_mmap:
+            Memory map the files instead of reading with pread
+        """
+        self.max_open = max(int(max_open), 1)
+        self.use_mmap = use_mmap
+        self.opens = 0
+        self.reads = 0
+        self.evictions = 0
+        self._files = OrderedDict()
+
+    async def read(self, path, offset, length):
+        """Reads `length` bytes at `offset` of the file at `path`. Returns fewer bytes if
+        the file ends before"""
+        f = await self._acquire(path)
+        try:
+            self.reads += 1
+            if f.mmap is not None:
+                return f.mmap[offset : offset + length]
+            return await asyncio.to_thread(os.pread, f.fd, length, offset)
+        finally:
+            f.users -= 1
+            self._evict()
+
+    async def read_many(self, path, ranges):
+        """Reads each (offset, length) in `ranges` of the file at `path`. All ranges are
+        read in one thread, so a batch costs a single thread switch"""
+        f = await self._acquire(path)
+        try:
+            self.reads += len(ranges)
+            if f.mmap is not None:
+                return [f.mmap[offset : offset + length] for offset, length in ranges]
+            return await asyncio.to_thread(
+                lambda: [os.pread(f.fd, length, offset) for offset, length in ranges]
+            )
+        finally:
+            f.users -= 1
+            self._evict()
+
+    async def stat(self, path):
+        """Returns the os.stat_result of the open file at `path`"""
+        f = await self._acquire(path)
+        try:
+            return os.fstat(f.fd)
+        finally:
+            f.users -= 1
+            self._evict()
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def stats(self):
+        return {
+            "open": len(self._files),
+            "max_open": self.max_open,
+            "opens": self.opens,
+            "reads": self.reads,
+            "evictions": self.evictions,
+        }
+
+    async def _acquire(self, path):
+        f = self._files.get(path)
+        if f is None:
+            # Opening a file on network storage may be slow
+            f = await asyncio.to_thread(_OpenFile, path, self.use_mmap)
+            if path in self._files:
+                # Opened concurrently by another read
+                f.close()
+                f = self._files[path]
+                self._files.move_to_end(path)
+            else:
+                self.opens += 1
+                self._files[path] = f
+        else:
+            self._files.move_to_end(path)
+        f.users += 1
+        self._evict()
+        return f
+
+    def _evict(self):
+        if len(self._files) <= self.max_open:
+            return
+        # Files being read are closed when they are no longer used
+        for path in [p for p, f in self._files.items() if f.users == 0]:
+            if len(self._files) <= self.max_open:
+                break
+            self._files.pop(path).close()
+            self.evictions += 1
+
+
+_default_pool = None
+
+
+def default_pool():
+    """Pool used by readers which are not given one"""
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = FilePool()
+    return _default_pool
+
+
 class Reader(AbstractReader):
-    """Wraps the remote COG."""
+    """Wraps the local COG."""
 
-    def __init__(self, path: Path):
-        # TODO: Should we keep til reader instead of opening it each time?
-        # Now we risc opening multiple times. If we keep the reader how do we make sure we dont get too many open reader and that it is closed correctly?
-        self._path = path
+    def __init__(self, path: Path, pool: FilePool = None):
+        self._path = os.fspath(path)
+        self._pool = pool or default_pool()
+        # Validators of the file like those of http responses
+        self.etag = None
+        self.last_modified = None
 
     async def read(self, offset, length):
-        async with aiofiles.open(self._path, mode="rb") as f:
-            contents = await f.read()
-            start = offset
-            stop = offset + length - 1
-            logger.info(f"Reading bytes: {start} to {stop}")
-            await f.seek(offset)
-            return await f.read(length)
+        data = await self._pool.read(self._path, offset, length)
+        await self._set_validators()
+        return data
+
+    async def read_many(self, ranges, max_gap=0, max_merged_bytes=0):
+        reads = plan_ranges(ranges, max_gap, max_merged_bytes)
+        datas = await self._pool.read_many(
+            self._path, [(offset, length) for offset, length, _ in reads]
+        )
+        await self._set_validators()
+        return split_reads(ranges, reads, datas)
+
+    async def _set_validators(self):
+        if self.etag is None:
+            stat = await self._pool.stat(self._path)
+            self.etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            self.last_modified = formatdate(stat.st_mtime, usegmt=True)
@@ -0,0 +1,116 @@
+"""Index of parsed COG headers stored in a single file.
+
+The index holds the headers of a known catalogue of COGs, serialized with
+`COGTiff.dump_header`, so they can be opened without reading their headers.
+
+Format (all integers little endian)::
+
+    magic          8 bytes  b"COGHIDX1"
+    count          uint32   number of entries
+    entries        count times:
+        key_len    uint32
+        key        key_len bytes, utf-8 (usually the url of the COG)
+        dump_len   uint64
+        dump       dump_len bytes, output of COGTiff.dump_header
+"""
+
+import mmap
+import os
+import struct
+
+from aiocogdumper.errors import TIFFError
+
+MAGIC = b"COGHIDX1"
+
+
+def write_header_index(path, entries):
+    """Writes a header index.
+
+    The index is written to a temporary file which is renamed to `path`, so readers
+    never see a partial index.
+
+    Parameters
+    ----------
+    path:
+        Path of the index file
+    entries:
+        Iterable of (key, dump) where dump is the output of `COGTiff.dump_header`
+
+    Returns
+    -------
+    int
+        Number of entries written
+    """
+    tmp = f"{path}.tmp"
+    count = 0
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", 0))
+        for key, dump in entries:
+            key = key.encode()
+            f.write(struct.pack("<I", len(key)) + key)
+            f.write(struct.pack("<Q", len(dump)))
+            f.write(dump)
+            count += 1
+        f.seek(len(MAGIC))
+        f.write(struct.pack("<I", count))
+    os.replace(tmp, path)
+    return count
+
+
+class HeaderIndex:
+    """Read access to a header index.
+
+    The file is memory mapped, so the dumps are only paged in when used and the pages
+    are shared by all processes using the same index."""
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        with open(path, "rb") as f:
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:
+                # Empty file
+                raise TIFFError(f"Invalid header index {path}: {e}")
+        try:
+            self._read_entries()
+        except TIFFError:
+            self.close()
+            raise
+        except (struct.error, UnicodeDecodeError) as e:
+            self.close()
+            raise TIFFError(f"Invalid header index {path}: {e}")
+
+    def _read_entries(self):
+        mm = self._mmap
+        if mm[: len(MAGIC)] != MAGIC:
+            raise TIFFError(f"{self.path} is not a header index")
+        (count,) = struct.unpack_from("<I", mm, len(MAGIC))
+        pos = len(MAGIC) + 4
+        for _ in range(count):
+            (key_len,) = struct.unpack_from("<I", mm, pos)
+            key = mm[pos + 4 : pos + 4 + key_len].decode()
+            pos += 4 + key_len
+            (dump_len,) = struct.unpack_from("<Q", mm, pos)
+            pos += 8
+            if pos + dump_len > len(mm):
+                raise TIFFError(f"Truncated header index {self.path}")
+            self._entries[key] = (pos, dump_len)
+            pos += dump_len
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """Returns the dump of `key` or None if it is not in the index"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        offset, length = entry
+        return self._mmap[offset : offset + length]
+
+    def close(self):
+        self._mmap.close()
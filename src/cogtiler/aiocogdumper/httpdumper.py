@@ -22,16 +22,33 @@ class Reader(AbstractReader):
         self.url = url
         self.session = httpsession
         self.headers = headers or {}
+        # Validators of the file from the latest response
+        self.etag = None
+        self.last_modified = None
 
     async def read(self, offset, length):
+        async with self._get(offset, length) as r:
+            await self._check(r)
+            return await r.read()
+
+    async def stream(self, offset, length):
+        """Yields the bytes of a range in chunks as they are received"""
+        async with self._get(offset, length) as r:
+            await self._check(r)
+            async for chunk in r.content.iter_any():
+                yield chunk
+
+    def _get(self, offset, length):
         start = offset
         stop = offset + length - 1
         request_headers = dict(self.headers)
         request_headers["Range"] = f"bytes={start}-{stop}"
-        r = await self.session.get(self.url, headers=request_headers)
+        return self.session.get(self.url, headers=request_headers)
+
+    async def _check(self, r):
         if r.status == 200:
             raise HTTPRangeNotSupportedError()
         if r.status != 206:
             raise HTTPError(await r.content.read(512), r.status)
-        else:
-            return await r.read()
+        self.etag = r.headers.get("ETag")
+        self.last_modified = r.headers.get("Last-Modified")
@@ -0,0 +1,283 @@
+"""Masking of jpeg images in the DCT domain.
+
+Instead of decoding the whole image to pixels, masking and encoding it again, the
+jpeg is passed through a lossless libturbojpeg transform with a custom filter
+operating directly on the quantized DCT coefficients:
+
+- blocks entirely outside the kept area are replaced by a flat black block
+- blocks crossed by the edge of the kept area are masked using a linear
+  operator on their coefficients and quantized again
+- all other blocks are left untouched
+
+Only the blocks crossed by the edge are (slightly) changed by quantization.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+
+import numpy as np
+from turbojpeg import CUSTOMFILTER, CroppingRegion, TransformStruct
+
+from aiocogdumper.errors import JPEGError
+
+# The python module cannot find the correct libpath on alpine
+LIBTURBOJPEG = os.getenv("LIBTURBOJPEG")
+
+# See https://github.com/libjpeg-turbo/libjpeg-turbo/blob/main/turbojpeg.h
+TJXOP_NONE = 0
+TJCS_RGB = 0
+TJCS_YCbCr = 1
+TJCS_GRAY = 2
+
+DCTSIZE = 8
+
+# Position in natural (row major) order of the n'th coefficient in zigzag order
+ZIGZAG = np.array(
+    [
+        0, 1, 8, 16, 9, 2, 3, 10, 17, 24, 32, 25, 18, 11, 4, 5,
+        12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13, 6, 7, 14, 21, 28,
+        35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+        58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63,
+    ]
+)  # fmt: skip
+
+
+def _dct_matrix():
+    # Orthonormal 8 point DCT-II which is the transform used by jpeg
+    u = np.arange(DCTSIZE)[:, None]
+    x = np.arange(DCTSIZE)[None, :]
+    d = np.cos((2 * x + 1) * u * np.pi / (2 * DCTSIZE)) * np.sqrt(2 / DCTSIZE)
+    d[0, :] = np.sqrt(1 / DCTSIZE)
+    return d
+
+
+_D = _dct_matrix()
+_EYE = np.eye(DCTSIZE)
+_ONES = np.ones((DCTSIZE, DCTSIZE))
+
+
+def _edge_operator(keep, fill, qtable, rows=False):
+    """Returns (op, const) which masks pixel columns (or rows) >= `keep` of a block
+    with the value `fill` when applied to its flattened quantized coefficients `q`
+    as `round(q @ op + const)`"""
+    keep_mask = np.diag((np.arange(DCTSIZE) < keep).astype(float))
+    # In the DCT domain masking columns is a right multiplication of the (row major)
+    # coefficient matrix by `_D @ keep_mask @ _D.T` plus the coefficients of the fill
+    keep_op = _D @ keep_mask @ _D.T
+    fill_coeffs = _D @ _ONES @ (_EYE - keep_mask) @ _D.T
+    if rows:
+        op = np.kron(keep_op, _EYE)
+        fill_coeffs = fill_coeffs.T
+    else:
+        op = np.kron(_EYE, keep_op)
+    q = qtable.reshape(-1)
+    # Dequantize, mask and quantize in one operation
+    return q[:, None] * op / q[None, :], fill * fill_coeffs.reshape(-1) / q
+
+
+_lib = None
+_thread_local = threading.local()
+
+
+def _turbojpeg_lib():
+    global _lib
+    if _lib is None:
+        lib = ctypes.cdll.LoadLibrary(
+            LIBTURBOJPEG or ctypes.util.find_library("turbojpeg")
+        )
+        lib.tjInitTransform.restype = ctypes.c_void_p
+        lib.tjTransform.argtypes = [
+            ctypes.c_void_p,
+            ctypes.POINTER(ctypes.c_ubyte),
+            ctypes.c_ulong,
+            ctypes.c_int,
+            ctypes.POINTER(ctypes.c_void_p),
+            ctypes.POINTER(ctypes.c_ulong),
+            ctypes.POINTER(TransformStruct),
+            ctypes.c_int,
+        ]
+        lib.tjGetErrorStr2.argtypes = [ctypes.c_void_p]
+        lib.tjGetErrorStr2.restype = ctypes.c_char_p
+        lib.tjFree.argtypes = [ctypes.c_void_p]
+        _lib = lib
+    return _lib
+
+
+def _transform_handle():
+    """Returns the libturbojpeg transform handle of the calling thread. Like the
+    TurboJPEG instances of `cog_tiles.get_turbojpeg` each thread creates it once"""
+    handle = getattr(_thread_local, "handle", None)
+    if handle is None:
+        handle = _turbojpeg_lib().tjInitTransform()
+        if not handle:
+            raise OSError("Could not initialize libturbojpeg transform")
+        _thread_local.handle = handle
+    return handle
+
+
+def _parse_frame(data):
+    """Returns quantization tables (natural order) and per component
+    (h sampling, v sampling, quantization table id) from a jpeg"""
+    if data[:2] != b"\xff\xd8":
+        raise JPEGError("Missing SOI marker for JPEG tile")
+    qtables = {}
+    components = None
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise JPEGError("Invalid JPEG marker")
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        length = struct.unpack(">H", data[pos + 2 : pos + 4])[0]
+        segment = data[pos + 4 : pos + 2 + length]
+        if marker == 0xDB:
+            i = 0
+            while i < len(segment):
+                precision, table_id = segment[i] >> 4, segment[i] & 0x0F
+                fmt = ">64H" if precision else ">64B"
+                table = np.zeros(DCTSIZE * DCTSIZE)
+                table[ZIGZAG] = struct.unpack_from(fmt, segment, i + 1)
+                qtables[table_id] = table.reshape(DCTSIZE, DCTSIZE)
+                i += 1 + struct.calcsize(fmt)
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            num_components = segment[5]
+            components = [
+                (
+                    segment[6 + 3 * c + 1] >> 4,
+                    segment[6 + 3 * c + 1] & 0x0F,
+                    segment[6 + 3 * c + 2],
+                )
+                for c in range(num_components)
+            ]
+        elif marker == 0xDA:
+            break
+        pos += 2 + length
+    if components is None:
+        raise JPEGError("Missing SOF marker in JPEG")
+    for _, _, table_id in components:
+        if table_id not in qtables:
+            raise JPEGError(f"Missing quantization table {table_id} in JPEG")
+    return qtables, components
+
+
+def mask_jpeg_coefficients(jpegbytes, keep_height, keep_width, colorspace=TJCS_YCbCr):
+    """Masks everything but the top left `keep_width` x `keep_height` pixels of a
+    jpeg with black without decoding it to pixels.
+
+    Parameters
+    ----------
+    jpegbytes:
+        The jpeg image
+    keep_height:
+        Number of pixel rows to keep
+    keep_width:
+        Number of pixel columns to keep
+    colorspace:
+        The TJCS colorspace of the jpeg as returned by TurboJPEG.decode_header.
+        Only RGB, YCbCr and gray are supported
+
+    Returns
+    -------
+    bytes
+        The masked jpeg
+    """
+    if colorspace not in (TJCS_RGB, TJCS_YCbCr, TJCS_GRAY):
+        raise JPEGError(f"Unsupported colorspace {colorspace} for masking")
+    qtables, components = _parse_frame(jpegbytes)
+    h_max = max(c[0] for c in components)
+    v_max = max(c[1] for c in components)
+
+    # Per component: Index of first block column (row) which is not entirely kept,
+    # first block column (row) which is entirely masked, a flat block with the value
+    # of masked samples and the operators masking the partially kept blocks.
+    # Masked samples are black, which in YCbCr has neutral chroma (level shifted)
+    planes = []
+    for ci, (h_samp, v_samp, table_id) in enumerate(components):
+        fill = -128.0 if colorspace != TJCS_YCbCr or ci == 0 else 0.0
+        qtable = qtables[table_id]
+        keep_w = -(-keep_width * h_samp // h_max)
+        keep_h = -(-keep_height * v_samp // v_max)
+        fill_block = np.zeros(DCTSIZE * DCTSIZE, np.int16)
+        fill_block[0] = round(fill * DCTSIZE / qtable[0, 0])
+        planes.append(
+            (
+                keep_w // DCTSIZE,
+                -(-keep_w // DCTSIZE),
+                keep_h // DCTSIZE,
+                -(-keep_h // DCTSIZE),
+                fill_block,
+                _edge_operator(keep_w % DCTSIZE, fill, qtable),
+                _edge_operator(keep_h % DCTSIZE, fill, qtable, rows=True),
+            )
+        )
+
+    def mask_filter(
+        coeffs_ptr, array_region, plane_region, ci, transform_id, transform_ptr
+    ):
+        try:
+            part_col, full_col, part_row, full_row, fill_block, col_op, row_op = planes[
+                ci
+            ]
+            blocks_x = array_region.w // DCTSIZE
+            blocks_y = array_region.h // DCTSIZE
+            row0 = array_region.y // DCTSIZE
+            if row0 + blocks_y <= part_row and part_col >= blocks_x:
+                # Every block is kept. A partially kept last block column still has
+                # to be masked
+                return 0
+            count = blocks_y * blocks_x * DCTSIZE * DCTSIZE
+            address = ctypes.cast(coeffs_ptr, ctypes.c_void_p).value
+            coeffs = np.frombuffer(
+                (ctypes.c_short * count).from_address(address), np.int16
+            ).reshape(blocks_y, blocks_x, DCTSIZE * DCTSIZE)
+            for r in range(blocks_y):
+                row = row0 + r
+                if row >= full_row:
+                    coeffs[r] = fill_block
+                    continue
+                coeffs[r, full_col:] = fill_block
+                if part_col < full_col and part_col < blocks_x:
+                    op, const = col_op
+                    coeffs[r, part_col] = np.round(coeffs[r, part_col] @ op + const)
+                if row == part_row:
+                    op, const = row_op
+                    n = min(full_col, blocks_x)
+                    coeffs[r, :n] = np.round(coeffs[r, :n] @ op + const)
+            return 0
+        except Exception:  # pragma: no cover
+            # Exceptions cannot propagate through the C library. Let the transform fail.
+            return -1
+
+    callback = CUSTOMFILTER(mask_filter)
+    transform = TransformStruct(
+        CroppingRegion(0, 0, 0, 0), TJXOP_NONE, 0, None, callback
+    )
+
+    lib = _turbojpeg_lib()
+    src = (ctypes.c_ubyte * len(jpegbytes)).from_buffer_copy(jpegbytes)
+    dest = ctypes.c_void_p()
+    dest_size = ctypes.c_ulong()
+    handle = _transform_handle()
+    try:
+        status = lib.tjTransform(
+            handle,
+            src,
+            len(jpegbytes),
+            1,
+            ctypes.byref(dest),
+            ctypes.byref(dest_size),
+            ctypes.byref(transform),
+            0,
+        )
+        if status != 0:
+            raise OSError(lib.tjGetErrorStr2(handle).decode())
+        return ctypes.string_at(dest, dest_size.value)
+    finally:
+        if dest:
+            lib.tjFree(dest)
@@ -0,0 +1,77 @@
+"""Planning of byte range reads."""
+
+import asyncio
+
+
+def plan_ranges(ranges, max_gap=0, max_merged_bytes=0):
+    """Groups byte ranges into as few reads as possible.
+
+    Ranges which overlap or are at most `max_gap` bytes apart are merged into one read,
+    as long as the read is at most `max_merged_bytes` long. A range longer than that is
+    still read whole.
+
+    Parameters
+    ----------
+    ranges:
+        List of (offset, length)
+    max_gap:
+        Maximum number of unneeded bytes read between two merged ranges
+    max_merged_bytes:
+        Maximum length of a read of merged ranges. 0 is no limit
+
+    Returns
+    -------
+    list
+        (offset, length, indices) of each read, where `indices` are the positions in
+        `ranges` of the ranges covered by the read. Empty ranges are not read
+    """
+    reads = []
+    order = sorted(
+        (i for i, (_, length) in enumerate(ranges) if length > 0),
+        key=lambda i: ranges[i][0],
+    )
+    for i in order:
+        offset, length = ranges[i]
+        if reads and offset <= reads[-1][0] + reads[-1][1] + max_gap:
+            start, read_length, indices = reads[-1]
+            end = max(start + read_length, offset + length)
+            if max_merged_bytes <= 0 or end - start <= max_merged_bytes:
+                reads[-1] = (start, end - start, indices + [i])
+                continue
+        reads.append((offset, length, [i]))
+    return reads
+
+
+async def read_ranges(read, ranges, max_gap=0, max_merged_bytes=0):
+    """Reads a number of byte ranges concurrently, merging ranges which are close.
+
+    Parameters
+    ----------
+    read:
+        Coroutine function `read(offset, length)` returning bytes
+    ranges:
+        List of (offset, length)
+    max_gap:
+        Maximum number of unneeded bytes read between two merged ranges
+    max_merged_bytes:
+        Maximum length of a read of merged ranges. 0 is no limit
+
+    Returns
+    -------
+    list
+        The bytes of each range in the order of `ranges`
+    """
+    reads = plan_ranges(ranges, max_gap, max_merged_bytes)
+    datas = await asyncio.gather(*(read(offset, length) for offset, length, _ in reads))
+    return split_reads(ranges, reads, datas)
+
+
+def split_reads(ranges, reads, datas):
+    """Returns the bytes of each range in `ranges` cut from the bytes `datas` of the
+    `reads` planned by `plan_ranges`"""
+    result = [b""] * len(ranges)
+    for (start, _, indices), data in zip(reads, datas):
+        for i in indices:
+            offset, length = ranges[i]
+            result[i] = data[offset - start : offset - start + length]
+    return result
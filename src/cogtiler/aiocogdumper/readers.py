@@ -0,0 +1,115 @@
+"""Registry of readers by url scheme."""
+
+import logging
+from typing import Callable, Dict, Iterable, Union
+from urllib.parse import urlparse
+
+from aiocogdumper.cog_tiles import AbstractReader
+from aiocogdumper.errors import UnsupportedSchemeError
+
+logger = logging.getLogger(__name__)
+
+
+class ReaderStats:
+    """Counters of the reads of all readers of a scheme"""
+
+    __slots__ = ("readers", "reads", "ranges", "bytes", "errors")
+
+    def __init__(self):
+        self.readers = 0
+        self.reads = 0
+        self.ranges = 0
+        self.bytes = 0
+        self.errors = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class CountingReader(AbstractReader):
+    """Wraps a reader and counts its reads, ranges, bytes and errors.
+
+    Attributes not defined here (like the `etag` of a http reader) are those of the
+    wrapped reader."""
+
+    def __init__(self, reader: AbstractReader, stats: ReaderStats):
+        self.reader = reader
+        self._stats = stats
+        stats.readers += 1
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+    async def read(self, offset, length):
+        self._stats.reads += 1
+        self._stats.ranges += 1
+        try:
+            data = await self.reader.read(offset, length)
+        except Exception:
+            self._stats.errors += 1
+            raise
+        self._stats.bytes += len(data)
+        return data
+
+    async def read_many(self, ranges, max_gap=0, max_merged_bytes=0):
+        self._stats.reads += 1
+        self._stats.ranges += len(ranges)
+        try:
+            datas = await self.reader.read_many(ranges, max_gap, max_merged_bytes)
+        except Exception:
+            self._stats.errors += 1
+            raise
+        self._stats.bytes += sum(len(data) for data in datas)
+        return datas
+
+    async def stream(self, offset, length):
+        self._stats.reads += 1
+        self._stats.ranges += 1
+        try:
+            async for chunk in self.reader.stream(offset, length):
+                self._stats.bytes += len(chunk)
+                yield chunk
+        except Exception:
+            self._stats.errors += 1
+            raise
+
+
+class ReaderRegistry:
+    """Creates the reader of a url from the factory registered for its scheme.
+
+    A factory is called as `factory(url, headers)` and returns an `AbstractReader`.
+    Readers are wrapped in a `CountingReader`, so reads are counted per scheme for any
+    backend."""
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[..., AbstractReader]] = {}
+        self._stats: Dict[str, ReaderStats] = {}
+
+    def register(
+        self,
+        schemes: Union[str, Iterable[str]],
+        factory: Callable[..., AbstractReader],
+    ) -> None:
+        """Registers `factory` for urls of the scheme or schemes in `schemes`. A scheme
+        registered before is replaced"""
+        if isinstance(schemes, str):
+            schemes = [schemes]
+        for scheme in schemes:
+            self._factories[scheme.lower()] = factory
+            self._stats.setdefault(scheme.lower(), ReaderStats())
+
+    @property
+    def schemes(self):
+        return sorted(self._factories)
+
+    def reader(self, url: str, headers: Dict[str, str] = None) -> AbstractReader:
+        """Returns a reader of `url`. Raises UnsupportedSchemeError if no reader is
+        registered for its scheme"""
+        scheme = urlparse(str(url)).scheme.lower()
+        factory = self._factories.get(scheme)
+        if factory is None:
+            raise UnsupportedSchemeError(f"No reader for url scheme [{scheme}]")
+        return CountingReader(factory(url, headers), self._stats[scheme])
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {scheme: stats.as_dict() for scheme, stats in self._stats.items()}
@@ -1,31 +1,163 @@
 """A utility to dump tiles directly from a tiff file in an S3 bucket."""
-
-import os
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote, unquote, urlparse
+import hashlib
+import hmac
 import logging
+import os
 
-import boto3
+import aiohttp
+from yarl import URL
 
-from .cog_tiles import AbstractReader
+from aiocogdumper.httpdumper import Reader as HttpReader
 
 logger = logging.getLogger(__name__)
 
-region = os.environ.get("AWS_REGION", "us-east-1")
-s3 = boto3.resource("s3", region_name=region)
+# Hash of the empty body of GET requests
+EMPTY_PAYLOAD_HASH = hashlib.sha256(b"").hexdigest()
+
+
+def parse_s3_url(url: str) -> Tuple[str, str]:
+    """Returns the bucket and key of an s3://bucket/key url"""
+    parsed = urlparse(str(url))
+    if parsed.scheme != "s3" or not parsed.netloc or len(parsed.path) < 2:
+        raise ValueError(f"Not an s3://bucket/key url: {url}")
+    return parsed.netloc, unquote(parsed.path[1:])
+
+
+class S3Config:
+    """Endpoint and credentials used for S3 requests.
+
+    Requests are signed with AWS Signature Version 4 when credentials are given,
+    otherwise they are sent unsigned (for public buckets). Credentials default to the
+    standard `AWS_ACCESS_KEY_ID`, `AWS_SECRET_ACCESS_KEY` and `AWS_SESSION_TOKEN`
+    environment variables."""
+
+    def __init__(
+        self,
+        endpoint: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        secret_access_key: Optional[str] = None,
+        session_token: Optional[str] = None,
+    ):
+        """
+        Parameters
+        ----------
+        endpoint:
+            Url of an S3 compatible server (like http://localhost:9000). Objects are
+            addressed path style (endpoint/bucket/key). None uses AWS S3
+        region:
+            Region of the buckets. Defaults to `AWS_REGION` or us-east-1
+        access_key_id, secret_access_key, session_token:
+            Credentials. Default to the AWS environment variables
+        """
+        self.endpoint = endpoint.rstrip("/") if endpoint else None
+        self.region = region or os.environ.get("AWS_REGION", "us-east-1")
+        self.access_key_id = access_key_id or os.environ.get("AWS_ACCESS_KEY_ID")
+        self.secret_access_key = secret_access_key or os.environ.get(
+            "AWS_SECRET_ACCESS_KEY"
+        )
+        self.session_token = session_token or os.environ.get("AWS_SESSION_TOKEN")
+        self._signing_keys = {}
+
+    def object_url(self, bucket: str, key: str) -> URL:
+        """Http url of an object"""
+        path = quote(key, safe="/~")
+        if self.endpoint:
+            url = f"{self.endpoint}/{bucket}/{path}"
+        elif "." in bucket:
+            # Virtual hosted names of buckets with dots do not match the certificate
+            url = f"https://s3.{self.region}.amazonaws.com/{bucket}/{path}"
+        else:
+            url = f"https://{bucket}.s3.{self.region}.amazonaws.com/{path}"
+        return URL(url, encoded=True)
+
+    def sign(
+        self, method: str, url: URL, headers: Dict[str, str], now: datetime = None
+    ) -> Dict[str, str]:
+        """Returns `headers` with the headers authenticating a request for `url`"""
+        if not (self.access_key_id and self.secret_access_key):
+            return dict(headers)
+        now = now or datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = amz_date[:8]
+        host = url.raw_host if url.is_default_port() else f"{url.raw_host}:{url.port}"
+        signed = {k.lower(): str(v).strip() for k, v in headers.items()}
+        signed["host"] = host
+        signed["x-amz-content-sha256"] = EMPTY_PAYLOAD_HASH
+        signed["x-amz-date"] = amz_date
+        if self.session_token:
+            signed["x-amz-security-token"] = self.session_token
+        names = sorted(signed)
+        canonical_request = "\n".join(
+            [
+                method,
+                url.raw_path,
+                (
+                    "&".join(sorted(url.raw_query_string.split("&")))
+                    if url.raw_query_string
+                    else ""
+                ),
+                "".join(f"{name}:{signed[name]}\n" for name in names),
+                ";".join(names),
+                EMPTY_PAYLOAD_HASH,
+            ]
+        )
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join(
+            [
+                "AWS4-HMAC-SHA256",
+                amz_date,
+                scope,
+                hashlib.sha256(canonical_request.encode()).hexdigest(),
+            ]
+        )
+        signature = hmac.new(
+            self._signing_key(date), string_to_sign.encode(), hashlib.sha256
+        ).hexdigest()
+        result = dict(headers)
+        result.update(
+            {k: v for k, v in signed.items() if k.startswith("x-amz-")},
+        )
+        result["Authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key_id}/{scope}, "
+            f"SignedHeaders={';'.join(names)}, Signature={signature}"
+        )
+        return result
+
+    def _signing_key(self, date: str) -> bytes:
+        # The key only changes with the date, so it is derived once a day
+        key = self._signing_keys.get(date)
+        if key is None:
+            key = f"AWS4{self.secret_access_key}".encode()
+            for part in (date, self.region, "s3", "aws4_request"):
+                key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+            self._signing_keys = {date: key}
+        return key
+
 
+class Reader(HttpReader):
+    """Wraps a COG in an S3 bucket.
 
-class Reader(AbstractReader):
-    """Wraps the remote COG."""
+    Objects are read with ranged GET requests through `httpsession`, so they share its
+    pool of kept alive connections."""
 
-    def __init__(self, bucket_name, key):
-        """Init reader object."""
-        self.bucket = bucket_name
+    def __init__(
+        self,
+        bucket: str,
+        key: str,
+        httpsession: aiohttp.ClientSession,
+        config: Optional[S3Config] = None,
+    ):
+        self.bucket = bucket
         self.key = key
-        self.source = s3.Object(self.bucket, self.key)
+        self.config = config or S3Config()
+        super().__init__(self.config.object_url(bucket, key), httpsession)
 
-    def read(self, offset, length):
-        """Read method."""
+    def _get(self, offset, length):
         start = offset
         stop = offset + length - 1
-        logger.info(f"Reading bytes: {start} to {stop}")
-        r = self.source.get(Range=f"bytes={start}-{stop}")
-        return r["Body"].read()
+        headers = self.config.sign("GET", self.url, {"Range": f"bytes={start}-{stop}"})
+        return self.session.get(self.url, headers=headers)
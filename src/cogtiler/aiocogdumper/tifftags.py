@@ -23,41 +23,49 @@ sizes = {
     1: {
         # TIFFByte
         'format': 'B',
+        'dtype': 'u1',
         'size': 1
     },
     2: {
         # TIFFascii
         'format': 'c',
+        'dtype': 'S1',
         'size': 1
         },
     3: {
         # TIFFshort
         'format': 'H',
+        'dtype': 'u2',
         'size': 2
         },
     4: {
         # TIFFlong
         'format': 'L',
+        'dtype': 'u4',
         'size': 4
         },
     5: {
         # TIFFrational
         'format': 'f',
+        'dtype': 'f4',
         'size': 4
         },
     7: {
         # undefined
         'format': 'B',
+        'dtype': 'u1',
         'size': 1
         },
     12: {
         # TIFFdouble
         'format': 'd',
+        'dtype': 'f8',
         'size': 8
     },
     16: {
         # TIFFlong8
         'format': 'Q',
+        'dtype': 'u8',
         'size': 8
     }
 }
@@ -0,0 +1,78 @@
+"""Pool for running blocking (jpeg) operations outside of the event loop."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WorkerPool:
+    """Runs blocking functions in a thread pool with a bounded queue.
+
+    libturbojpeg is called through ctypes which releases the GIL, so threads are
+    sufficient to keep jpeg decoding and encoding from stalling the event loop.
+    """
+
+    def __init__(self, workers=0, queue_size=0):
+        """
+        Parameters
+        ----------
+        workers:
+            Number of worker threads. With 0 workers functions are run directly
+            in the calling thread (ie. in the event loop)
+        queue_size:
+            Number of jobs allowed to queue in the pool waiting for a free worker.
+            Further callers are suspended (`waiting`) until there is room in the queue
+        """
+        self.workers = int(workers)
+        self.queue_size = int(queue_size)
+        self.waiting = 0
+        self.in_pool = 0
+        self.completed = 0
+        self._executor = None
+        self._slots = None
+
+    def start(self, initializer=None):
+        """Start the worker threads.
+
+        `initializer` is called in each worker thread when it is started"""
+        if self.workers <= 0:
+            return
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="cogtiler-jpeg",
+            initializer=initializer,
+        )
+        self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+
+    def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._slots = None
+
+    async def run(self, fn, *args):
+        """Run `fn(*args)` in the pool and return its result"""
+        executor, slots = self._executor, self._slots
+        if executor is None:
+            return fn(*args)
+        self.waiting += 1
+        try:
+            await slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_pool += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, fn, *args)
+        finally:
+            self.in_pool -= 1
+            self.completed += 1
+            slots.release()
+
+    def stats(self):
+        return {
+            "workers": self.workers if self._executor is not None else 0,
+            "queue_size": self.queue_size,
+            "waiting": self.waiting,
+            "in_pool": self.in_pool,
+            "completed": self.completed,
+        }
@@ -0,0 +1,116 @@
+"""Builds a header index for a catalogue of COGs.
+
+Usage:
+    python build_header_index.py cogs.txt -o headers.idx
+
+Each line of the input file is a COG to index, either an http(s), s3 or file url or a
+local path, optionally followed by whitespace and the url the COG is served from. Local files are
+then indexed under that url, for example:
+
+    /data/2021/image_0001.tif https://example.com/cogs/2021/image_0001.tif
+
+Set `COGTILER_HEADER_INDEX` to the output file to make cogtiler load it at startup.
+"""
+
+import argparse
+import asyncio
+import sys
+from urllib.parse import unquote, urlparse
+
+import aiohttp
+from loguru import logger
+
+from aiocogdumper.cog_tiles import COGTiff
+from aiocogdumper.filedumper import Reader as FileReader
+from aiocogdumper.headerindex import write_header_index
+from aiocogdumper.httpdumper import Reader as HttpReader
+from aiocogdumper.readers import ReaderRegistry
+from aiocogdumper.s3dumper import S3Config, Reader as S3Reader, parse_s3_url
+
+
+def read_catalogue(path):
+    """Returns (source, key) of each COG listed in the file at `path` ("-" is stdin)"""
+    f = sys.stdin if path == "-" else open(path)
+    try:
+        entries = []
+        for line in f:
+            parts = line.split()
+            if not parts or parts[0].startswith("#"):
+                continue
+            entries.append((parts[0], parts[1] if len(parts) > 1 else parts[0]))
+        return entries
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+async def dump_headers(entries, headers, concurrency, timeout, s3_config=None):
+    """Reads and dumps the header of each (source, key). COGs which fail are skipped"""
+    slots = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=timeout)
+    ) as session:
+        readers = ReaderRegistry()
+        readers.register(("http", "https"), lambda url, h: HttpReader(url, session, h))
+        readers.register(
+            "s3", lambda url, h: S3Reader(*parse_s3_url(url), session, s3_config)
+        )
+        readers.register("file", lambda url, h: FileReader(unquote(urlparse(url).path)))
+        # Local paths have no scheme
+        readers.register("", lambda path, h: FileReader(path))
+
+        async def dump(source, key):
+            local = urlparse(source).scheme in ("", "file")
+            async with slots:
+                try:
+                    reader = readers.reader(source, headers)
+                    # Read the whole tile arrays, so indexed COGs never read header data
+                    cog = COGTiff(reader.read, source=key)
+                    await cog.read_header()
+                    # The validators of a local copy of a COG served from another
+                    # url are unknown. They are taken from the upstream server when
+                    # the COG is opened
+                    if not local or key.startswith("file:"):
+                        cog.etag = reader.etag
+                        cog.last_modified = reader.last_modified
+                except Exception as e:
+                    logger.warning(f"Skipping [{source}]: {repr(e)}")
+                    return None
+            return key, cog.dump_header()
+
+        dumps = await asyncio.gather(*(dump(*entry) for entry in entries))
+    return [d for d in dumps if d is not None]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build a header index for a catalogue of COGs"
+    )
+    parser.add_argument(
+        "catalogue", help='File listing a COG per line ("-" reads stdin)'
+    )
+    parser.add_argument("-o", "--output", required=True, help="Index file to write")
+    parser.add_argument("--token", help="Token sent to the upstream server")
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="Headers read at the same time"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=30.0, help="Timeout in seconds per COG"
+    )
+    parser.add_argument("--s3-endpoint", help="S3 compatible server for s3:// urls")
+    parser.add_argument("--s3-region", help="Region of the S3 buckets")
+    args = parser.parse_args(argv)
+
+    entries = read_catalogue(args.catalogue)
+    headers = {"token": args.token} if args.token else {}
+    s3_config = S3Config(args.s3_endpoint, args.s3_region)
+    dumps = asyncio.run(
+        dump_headers(entries, headers, args.concurrency, args.timeout, s3_config)
+    )
+    count = write_header_index(args.output, dumps)
+    logger.info(f"Wrote {count} of {len(entries)} headers to {args.output}")
+    return 0 if count == len(entries) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,55 @@
-from typing import Optional, Dict
+from typing import AsyncIterator, Optional, Dict, List, Tuple, Union
+import asyncio
+import hashlib
+import os
+from email.utils import parsedate_to_datetime
+from urllib.parse import unquote, urlparse
+from uuid import uuid4
 import aiohttp
-from pydantic import BaseModel, HttpUrl, validator
+from pydantic import AnyUrl, BaseModel, FileUrl, HttpUrl, validator
 from pydantic.fields import Field
-from fastapi import Response, Query, security
+from fastapi import Header, Response, Query, security
+from fastapi.responses import StreamingResponse
 from fastapi.exceptions import HTTPException
 from fastapi.params import Depends
 
 from aiocogdumper.errors import TIFFError
+from aiocogdumper.filedumper import FilePool, Reader as FileReader
+from aiocogdumper.headerindex import HeaderIndex
 from aiocogdumper.httpdumper import Reader as HttpReader
-from aiocogdumper.cog_tiles import COGTiff, Overflow
+from aiocogdumper.readers import ReaderRegistry
+from aiocogdumper.s3dumper import S3Config, Reader as S3Reader, parse_s3_url
+from aiocogdumper.cog_tiles import AbstractReader, COGTiff, Overflow, get_turbojpeg
+from aiocogdumper.workerpool import WorkerPool
 from cache import AsyncLRU
 
+from diskcache import DiskCache
+from headerprefetch import HeaderPrefetch
+from hedging import Hedger, HedgedReader
+from httppool import HttpPool
+from prefetch import TilePrefetcher
+from retry import CircuitBreakers, Retrier, RetryingReader
+from singleflight import SingleFlight
+from tilecache import TileCache
+
+
+from loguru import logger
 
 from settings import get_settings
 
 
+class S3Url(AnyUrl):
+    allowed_schemes = {"s3"}
+    host_required = True
+
+
 class CogRequest(BaseModel):
-    url: HttpUrl = Field(
+    url: Union[HttpUrl, FileUrl, S3Url] = Field(
         default=Query(
             ...,
-            description="Url for Cloud Optimized GeoTIFF (COG). Must be JPEG compressed.",
+            description="Url for Cloud Optimized GeoTIFF (COG). Must be JPEG compressed. "
+            "file:// urls are only allowed below the configured file root and "
+            "s3://bucket/key urls only for the configured buckets.",
         )
     )
     query_token: Optional[str] = Depends(
@@ -38,6 +68,24 @@ class CogRequest(BaseModel):
     @validator("url")
     def url_in_whitelist(cls, value):
         settings = get_settings()
+        if value.scheme == "file":
+            path = _file_path(value)
+            root = settings.file_root and os.path.realpath(settings.file_root)
+            if (
+                not root
+                or path is None
+                or os.path.commonpath([root, os.path.realpath(path)]) != root
+            ):
+                raise HTTPException(403, "Specified URL is not allowed")
+            return value
+        if value.scheme == "s3":
+            if value.host not in settings.s3_buckets:
+                raise HTTPException(403, "Specified URL is not allowed")
+            try:
+                parse_s3_url(value)
+            except ValueError:
+                raise HTTPException(400, "Specified URL has no object key")
+            return value
         if not settings.whitelist:
             return value
         for whitelisted in settings.whitelist:
@@ -46,47 +94,735 @@ class CogRequest(BaseModel):
         raise HTTPException(403, "Specified URL is not allowed")
 
 
+class TileConditions(BaseModel):
+    if_none_match: Optional[str] = Field(
+        default=Header(None, description="ETags of tiles held by the client")
+    )
+    if_modified_since: Optional[str] = Field(
+        default=Header(None, description="Date of the tile held by the client")
+    )
+
+    def not_modified(self, etag: Optional[str], last_modified: Optional[str]) -> bool:
+        """Whether the client holds the current version of a tile with the given ETag
+        and Last-Modified, and can be answered with 304 Not Modified"""
+        if self.if_none_match is not None:
+            # If-Modified-Since is ignored when If-None-Match is sent
+            if etag is None:
+                return False
+            if self.if_none_match.strip() == "*":
+                return True
+            # Weak comparison
+            tags = [
+                tag.strip().removeprefix("W/") for tag in self.if_none_match.split(",")
+            ]
+            return etag.removeprefix("W/") in tags
+        if self.if_modified_since is not None and last_modified is not None:
+            try:
+                return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(
+                    self.if_modified_since
+                )
+            except (TypeError, ValueError):
+                # Invalid dates are ignored
+                return False
+        return False
+
+
+class TileIndex(BaseModel):
+    z: int = Field(..., description="Overview level (top most is `z=0`)")
+    x: int = Field(..., description="Tile column (from left side of image)")
+    y: int = Field(..., description="Tile row (from top of image)")
+
+
+class TileBatch(BaseModel):
+    tiles: List[TileIndex] = Field(..., description="Tiles to get")
+
+
 # Inspired by https://github.com/tiangolo/fastapi/issues/236
 class HttpCogClient:
-    def __init__(self, timeout: float = 10.0) -> None:
+    def __init__(
+        self,
+        timeout: float = 10.0,
+        tile_cache_size: int = 0,
+        jpeg_workers: int = 0,
+        jpeg_queue_size: int = 0,
+        dct_mask: bool = False,
+        edge_tile_cache_size: int = 0,
+        edge_tile_warmup_levels: int = 0,
+        header_cache_size: int = 1024,
+        lazy_tile_arrays: bool = False,
+        header_prefetch_percentile: float = 0,
+        max_range_gap: int = 0,
+        max_merged_bytes: int = 0,
+        prefetch_concurrency: int = 0,
+        prefetch_max_bytes: int = 0,
+        disk_cache_dir: Optional[str] = None,
+        disk_cache_size: int = 0,
+        shared_header_cache_dir: Optional[str] = None,
+        shared_header_cache_size: int = 0,
+        header_index: Optional[str] = None,
+        pool_limit: int = 100,
+        pool_limit_per_host: int = 0,
+        keepalive_timeout: float = 15.0,
+        dns_cache_ttl: Optional[int] = 10,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        stream_tiles: bool = False,
+        file_pool_size: int = 64,
+        file_mmap: bool = False,
+        s3_endpoint: Optional[str] = None,
+        s3_region: Optional[str] = None,
+        hedge_percentile: float = 0,
+        hedge_budget: float = 0.05,
+        hedge_min_delay: float = 0.01,
+        retries: int = 0,
+        retry_backoff: float = 0.1,
+        retry_max_backoff: float = 2.0,
+        retry_timeouts: bool = False,
+        breaker_failures: int = 0,
+        breaker_reset_timeout: float = 10.0,
+    ) -> None:
         """_summary_
 
         Parameters
         ----------
         timeout : float, optional
             Timeout in seconds for each http request for COG data, by default 10.0
+        tile_cache_size : int, optional
+            Max number of bytes of tiles to keep in memory. 0 disables tile caching, by default 0
+        jpeg_workers : int, optional
+            Number of threads used for masking and cropping jpeg tiles. 0 runs the jpeg operations
+            in the event loop, by default 0
+        jpeg_queue_size : int, optional
+            Number of jpeg operations allowed to queue for a free thread before callers are
+            suspended, by default 0
+        dct_mask : bool, optional
+            Mask edge tiles in the DCT domain instead of decoding and encoding them, by default False
+        edge_tile_cache_size : int, optional
+            Max number of bytes of masked and cropped edge tiles to keep in memory. 0 disables the
+            edge tile cache, by default 0
+        edge_tile_warmup_levels : int, optional
+            Number of lowest resolution overviews for which edge tiles are processed in the
+            background when a header is first parsed, by default 0
+        header_cache_size : int, optional
+            Number of parsed COG headers to keep in memory, by default 1024
+        lazy_tile_arrays : bool, optional
+            Read the tile offsets and byte counts of an overview when its tiles are first
+            requested instead of with the header, by default False
+        header_prefetch_percentile : float, optional
+            Percentile of the header sizes seen for the same url prefix or host used as the
+            initial read of a new header. 0 always reads a fixed number of bytes, by default 0
+        max_range_gap : int, optional
+            Max number of bytes between a tile and its mask for them to be fetched in a single
+            request, by default 0
+        max_merged_bytes : int, optional
+            Max number of bytes of a single request of merged tiles and masks. 0 is no
+            limit, by default 0
+        prefetch_concurrency : int, optional
+            Max number of background reads of the neighbours of requested tiles into the
+            tile cache. 0 disables prefetching, by default 0
+        prefetch_max_bytes : int, optional
+            Max number of bytes of prefetched tiles which have not been requested yet. No
+            more tiles are prefetched while this is exceeded, by default 0
+        disk_cache_dir : Optional[str], optional
+            Directory of a cache of parsed headers and tiles shared by all workers and kept
+            across restarts. None disables the disk cache, by default None
+        disk_cache_size : int, optional
+            Max number of bytes in the disk cache, by default 0
+        shared_header_cache_dir : Optional[str], optional
+            Directory on a tmpfs (like /dev/shm) holding parsed headers shared by all worker
+            processes. Only one worker reads a header from upstream. None disables the
+            shared header cache, by default None
+        shared_header_cache_size : int, optional
+            Max number of bytes in the shared header cache, by default 0
+        header_index : Optional[str], optional
+            Path of a header index (see build_header_index.py) loaded at startup. COGs in
+            the index are opened without reading their header, by default None
+        pool_limit : int, optional
+            Max number of open connections to upstream servers. 0 means no limit, by
+            default 100
+        pool_limit_per_host : int, optional
+            Max number of open connections to the same upstream server. 0 means no
+            limit, by default 0
+        keepalive_timeout : float, optional
+            Seconds an idle upstream connection is kept open for reuse. 0 closes
+            connections after each request, by default 15.0
+        dns_cache_ttl : Optional[int], optional
+            Seconds resolved upstream host names are cached. None caches them forever,
+            by default 10
+        connect_timeout : Optional[float], optional
+            Timeout in seconds for opening a new upstream connection. None only limits
+            the whole request by `timeout`, by default None
+        read_timeout : Optional[float], optional
+            Timeout in seconds between reads of upstream response data. None only
+            limits the whole request by `timeout`, by default None
+        stream_tiles : bool, optional
+            Send tiles which need no processing to the client while they are read from
+            upstream instead of when the whole tile is read, by default False
+        file_pool_size : int, optional
+            Max number of local COG files (file:// urls) kept open, by default 64
+        file_mmap : bool, optional
+            Read local COG files through memory maps instead of pread in a thread, by
+            default False
+        s3_endpoint : Optional[str], optional
+            Url of an S3 compatible server used for s3:// urls. None uses AWS S3, by
+            default None
+        s3_region : Optional[str], optional
+            Region of the S3 buckets. None uses the AWS_REGION environment variable or
+            us-east-1, by default None
+        hedge_percentile : float, optional
+            Percentile of recent upstream read latencies after which a duplicate read
+            is sent (http and s3 urls). 0 disables hedging, by default 0
+        hedge_budget : float, optional
+            Max number of duplicate reads as a fraction of all upstream reads, by
+            default 0.05
+        hedge_min_delay : float, optional
+            Min number of seconds before a duplicate read is sent, by default 0.01
+        retries : int, optional
+            Max number of retries of an upstream read failing with a transient error
+            (like a 503 or a closed connection), by default 0
+        retry_backoff : float, optional
+            Seconds of the max (jittered) delay before the first retry. The max delay
+            doubles with each retry, by default 0.1
+        retry_max_backoff : float, optional
+            Upper bound in seconds of the delay before a retry, by default 2.0
+        retry_timeouts : bool, optional
+            Also retry reads which time out. Each attempt may take the whole request
+            timeout, by default False
+        breaker_failures : int, optional
+            Number of consecutive transient failures of reads from an upstream host
+            after which reads from it fail fast. 0 disables the circuit breakers, by
+            default 0
+        breaker_reset_timeout : float, optional
+            Seconds reads from a failing upstream host fail fast before one is tried
+            again, by default 10.0
         """
         self.http_session = None
         self.timeout_s = float(timeout)
+        self.connect_timeout_s = connect_timeout
+        self.read_timeout_s = read_timeout
+        self.http_pool = HttpPool(
+            pool_limit, pool_limit_per_host, keepalive_timeout, dns_cache_ttl
+        )
+        self.file_pool = FilePool(file_pool_size, file_mmap)
+        self.s3_config = S3Config(s3_endpoint, s3_region)
+        self.hedger = Hedger(hedge_percentile, hedge_budget, hedge_min_delay)
+        self.retrier = Retrier(
+            retries,
+            retry_backoff,
+            retry_max_backoff,
+            CircuitBreakers(breaker_failures, breaker_reset_timeout),
+            retry_timeouts,
+        )
+        self.tile_cache = TileCache(tile_cache_size)
+        # Concurrent requests for the same header or tile share a single upstream fetch
+        self.header_flight = SingleFlight()
+        self.tile_flight = SingleFlight()
+        self.jpeg_pool = WorkerPool(jpeg_workers, jpeg_queue_size)
+        self.dct_mask = dct_mask
+        # Masked and cropped edge tiles never change and are cached apart from other tiles
+        self.edge_tile_cache = TileCache(edge_tile_cache_size)
+        self.edge_tile_warmup_levels = edge_tile_warmup_levels
+        self.lazy_tile_arrays = lazy_tile_arrays
+        self.header_prefetch = HeaderPrefetch(header_prefetch_percentile)
+        self.max_range_gap = max_range_gap
+        self.max_merged_bytes = max_merged_bytes
+        self.prefetcher = TilePrefetcher(
+            self.tile_cache, self.tile_flight, prefetch_concurrency, prefetch_max_bytes
+        )
+        self.disk_cache = DiskCache(disk_cache_dir, disk_cache_size)
+        self.shared_header_cache = DiskCache(
+            shared_header_cache_dir, shared_header_cache_size
+        )
+        self.header_index_path = header_index
+        self.header_index = None
+        self.header_index_hits = 0
+        self.access_checks = 0
+        self.outdated_headers = 0
+        self.stream_tiles = stream_tiles
+        self.readers = ReaderRegistry()
+        self.readers.register(("http", "https"), self._http_reader)
+        self.readers.register("file", self._file_reader)
+        self.readers.register("s3", self._s3_reader)
+        self._background_tasks = set()
+        self._load_cog = AsyncLRU(maxsize=header_cache_size)(self._load_cog_uncached)
 
     def start(self):
-        self.http_session: aiohttp.ClientSession = aiohttp.ClientSession(
-            timeout=aiohttp.ClientTimeout(total=self.timeout_s)
+        self.http_session: aiohttp.ClientSession = self.http_pool.session(
+            aiohttp.ClientTimeout(
+                total=self.timeout_s,
+                sock_connect=self.connect_timeout_s,
+                sock_read=self.read_timeout_s,
+            )
         )
+        # Load libturbojpeg now so a missing library is discovered at startup
+        get_turbojpeg()
+        self.jpeg_pool.start(initializer=get_turbojpeg)
+        if self.header_index_path:
+            self.header_index = HeaderIndex(self.header_index_path)
+            logger.info(
+                f"Loaded {len(self.header_index)} headers from {self.header_index_path}"
+            )
 
     async def stop(self):
         await self.http_session.close()
         self.http_session = None
+        self.prefetcher.stop()
+        self.jpeg_pool.stop()
+        self.file_pool.close()
+        if self.header_index is not None:
+            self.header_index.close()
+            self.header_index = None
 
     async def cog_from_query_param(
         self, cog_req: CogRequest = Depends(CogRequest)
     ) -> COGTiff:
         token = cog_req.get_token()
         headers = {"token": token} if token else {}
-        return await self._get_http_cog(cog_req.get_cog_url(), headers)
+        return await self._get_cog(cog_req.get_cog_url(), headers)
 
     async def get_tile_response(
-        self, cog: COGTiff, z: int, x: int, y: int, overflow: Overflow = Overflow.Pad
+        self,
+        cog: COGTiff,
+        z: int,
+        x: int,
+        y: int,
+        overflow: Overflow = Overflow.Pad,
+        conditions: Optional["TileConditions"] = None,
     ) -> Response:
+        key = (cog.source, z, x, y, overflow)
+        validators = self._tile_validators(cog, key)
+        if conditions is not None and conditions.not_modified(**validators):
+            return Response(status_code=304, headers=_validator_headers(validators))
+        tilebytes = self.tile_cache.get(key)
+        if tilebytes is not None:
+            self.prefetcher.hit(key)
+        elif self.stream_tiles and key not in self.tile_flight:
+            chunks = asyncio.Queue()
+            if self.tile_cache.max_bytes > 0 or self.disk_cache.enabled:
+                # Concurrent requests for the tile wait for the whole tile in the flight
+                self.tile_flight.start(
+                    key, lambda: self._stream_tile(cog, key, chunks, keep=True)
+                )
+            else:
+                # Nothing keeps the tile, so it is not held in memory as a whole, and
+                # concurrent requests read it on their own
+                self._run_in_background(self._stream_tile(cog, key, chunks, keep=False))
+            size = await chunks.get()
+            if isinstance(size, Exception):
+                raise size
+            self.prefetcher.schedule(cog, z, x, y, overflow)
+            return StreamingResponse(
+                _drain(chunks),
+                media_type="image/jpeg",
+                headers={
+                    "Content-Length": str(size),
+                    **_validator_headers(validators),
+                },
+            )
+        else:
+            tilebytes = await self.tile_flight.do(
+                key, lambda: self._fetch_tile(cog, key)
+            )
+            # The tile may have been read by a prefetch
+            self.prefetcher.hit(key)
+        self.prefetcher.schedule(cog, z, x, y, overflow)
+        return Response(
+            content=tilebytes,
+            media_type="image/jpeg",
+            headers=_validator_headers(validators),
+        )
+
+    async def get_tiles_response(
+        self,
+        cog: COGTiff,
+        tiles: List[Tuple[int, int, int, str]],
+        overflow: Overflow = Overflow.Pad,
+    ) -> Response:
+        """Streams a number of tiles as a multipart/mixed response.
+
+        Tiles not in the tile cache are read with as few upstream requests as possible.
+        Parts are sent in the order the tiles are ready.
+
+        Parameters
+        ----------
+        cog : COGTiff
+            The COG to read the tiles from
+        tiles : List[Tuple[int, int, int, str]]
+            (z, x, y, name) of each tile. `name` is sent as Content-Location of its part
+        overflow : Overflow, optional
+            What to do about tile overflow, by default Overflow.Pad
+
+        Returns
+        -------
+        Response
+            Multipart response with one image/jpeg part for each tile
+        """
+        hits = []
+        # Name of each tile not in the tile cache
+        misses = {}
+        for z, x, y, name in tiles:
+            key = (cog.source, z, x, y, overflow)
+            tilebytes = self.tile_cache.get(key)
+            if tilebytes is None:
+                misses[key] = name
+            else:
+                hits.append((name, tilebytes))
+        if misses and self.disk_cache.enabled:
+            from_disk = await asyncio.gather(
+                *(self.disk_cache.get(_tile_disk_key(cog, key)) for key in misses)
+            )
+            for (key, name), tilebytes in zip(list(misses.items()), from_disk):
+                if tilebytes is not None:
+                    self.tile_cache.put(key, tilebytes)
+                    hits.append((name, tilebytes))
+                    del misses[key]
+        misses = list(misses.items())
+        # Invalid tiles raise here, before the response is started
+        fetched = await cog.get_tiles(
+            [(x, y, z, overflow) for (_, z, x, y, _), _ in misses]
+        )
+        boundary = uuid4().hex
+
+        async def parts():
+            def part(name, tilebytes):
+                return (
+                    (
+                        f"--{boundary}\r\n"
+                        "Content-Type: image/jpeg\r\n"
+                        f"Content-Location: {name}\r\n"
+                        f"Content-Length: {len(tilebytes)}\r\n\r\n"
+                    ).encode()
+                    + tilebytes
+                    + b"\r\n"
+                )
+
+            for name, tilebytes in hits:
+                yield part(name, tilebytes)
+            async for i, _, tilebytes in fetched:
+                key, name = misses[i]
+                self._store_tile(cog, key, tilebytes)
+                yield part(name, tilebytes)
+            yield f"--{boundary}--\r\n".encode()
+
+        return StreamingResponse(
+            parts(), media_type=f"multipart/mixed; boundary={boundary}"
+        )
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            "http_pool": self.http_pool.stats(),
+            "file_pool": self.file_pool.stats(),
+            "readers": self.readers.stats(),
+            "hedging": self.hedger.stats(),
+            "retries": self.retrier.stats(),
+            "circuit_breakers": self.retrier.breakers.stats(),
+            "tile_cache": self.tile_cache.stats(),
+            "edge_tile_cache": self.edge_tile_cache.stats(),
+            "header_flight": self.header_flight.stats(),
+            "tile_flight": self.tile_flight.stats(),
+            "jpeg_pool": self.jpeg_pool.stats(),
+            "header_prefetch": self.header_prefetch.stats(),
+            "tile_prefetch": self.prefetcher.stats(),
+            "disk_cache": self.disk_cache.stats(),
+            "shared_header_cache": self.shared_header_cache.stats(),
+            "header_index": {
+                "entries": len(self.header_index) if self.header_index else 0,
+                "hits": self.header_index_hits,
+            },
+            "access_checks": {
+                "checks": self.access_checks,
+                "outdated_headers": self.outdated_headers,
+            },
+        }
+
+    def _tile_validators(self, cog: COGTiff, key) -> Dict[str, Optional[str]]:
+        """ETag and Last-Modified of a tile derived from the validators of its COG. They
+        are None if the upstream server sent no validators"""
+        if cog.etag is None and cog.last_modified is None:
+            return {"etag": None, "last_modified": None}
+        _, z, x, y, overflow = key
+        # Masked tiles differ with the masking method
+        tag = f"{cog.etag}:{cog.last_modified}:{z}:{x}:{y}:{overflow.value}"
+        tag += f":{self.dct_mask}"
+        etag = f'"{hashlib.sha1(tag.encode()).hexdigest()}"'
+        if cog.etag is not None and cog.etag.startswith("W/"):
+            # The upstream file may change without changing a weak ETag
+            etag = "W/" + etag
+        return {"etag": etag, "last_modified": cog.last_modified}
+
+    async def _fetch_tile(self, cog: COGTiff, key) -> bytes:
+        _, z, x, y, overflow = key
+        tilebytes = await self.disk_cache.get(_tile_disk_key(cog, key))
+        if tilebytes is not None:
+            self.tile_cache.put(key, tilebytes)
+            return tilebytes
         mime_type, tilebytes = await cog.get_tile(x, y, z, overflow)
-        return Response(content=tilebytes, media_type="image/jpeg")
+        self._store_tile(cog, key, tilebytes)
+        return tilebytes
+
+    async def _stream_tile(
+        self, cog: COGTiff, key, chunks: asyncio.Queue, keep: bool
+    ) -> Optional[bytes]:
+        """Reads a tile like `_fetch_tile`, putting its size and then its bytes on
+        `chunks` as they are read. The bytes are followed by None, or by an exception
+        if the read fails. With `keep` the tile is stored in the caches and returned,
+        and a failed read raises"""
+        _, z, x, y, overflow = key
+        try:
+            stream = None
+            tilebytes = await self.disk_cache.get(_tile_disk_key(cog, key))
+            if tilebytes is not None:
+                self.tile_cache.put(key, tilebytes)
+            else:
+                stream = await cog.stream_tile(x, y, z, overflow)
+                if stream is None:
+                    # Edge tiles need processing, so they are read as a whole
+                    _, tilebytes = await cog.get_tile(x, y, z, overflow)
+                    self._store_tile(cog, key, tilebytes)
+            if stream is None:
+                chunks.put_nowait(len(tilebytes))
+                chunks.put_nowait(tilebytes)
+            else:
+                _, size, tile_chunks = stream
+                parts = []
+                started = False
+                async for chunk in tile_chunks:
+                    if not started:
+                        # Respond once the first bytes are read, so a failed upstream
+                        # request still gets an error response
+                        chunks.put_nowait(size)
+                        started = True
+                    if keep:
+                        parts.append(chunk)
+                    chunks.put_nowait(chunk)
+                if not started:
+                    chunks.put_nowait(size)
+                tilebytes = None
+                if keep:
+                    tilebytes = b"".join(parts)
+                    self._store_tile(cog, key, tilebytes)
+            chunks.put_nowait(None)
+            return tilebytes
+        except Exception as e:
+            chunks.put_nowait(e)
+            if keep:
+                raise
+            return None
+
+    def _store_tile(self, cog: COGTiff, key, tilebytes: bytes) -> None:
+        self.tile_cache.put(key, tilebytes)
+        if self.disk_cache.enabled:
+            self._run_in_background(
+                self.disk_cache.put(_tile_disk_key(cog, key), tilebytes)
+            )
 
-    @AsyncLRU(maxsize=1024)
-    async def _get_http_cog(
+    async def _get_cog(
         self, url: str, headers: Optional[Dict[str, str]] = None
     ) -> COGTiff:
-        reader = HttpReader(url, self.http_session, headers)
-        cog = COGTiff(reader.read)
-        # parse header here to know if it throws. If it does throw it will not be cached
-        await cog.read_header()
+        key = (url, tuple(sorted((headers or {}).items())))
+        return await self.header_flight.do(key, lambda: self._load_cog(url, headers))
+
+    async def _load_cog_uncached(
+        self, url: str, headers: Optional[Dict[str, str]] = None
+    ) -> COGTiff:
+        reader = self.readers.reader(url, headers)
+        cog = self._new_cog(url, reader)
+        dump = self.header_index.get(url) if self.header_index else None
+        if dump is not None:
+            try:
+                cog.load_header(dump)
+                self.header_index_hits += 1
+            except TIFFError as e:
+                # Like an index written by an older version
+                logger.warning(f"Ignoring indexed header [{url}]: {e.message}")
+                dump = None
+        if dump is not None and not await self._check_upstream(cog, reader):
+            # The caches may hold the header of the new file
+            logger.info(f"Indexed header is outdated [{url}]")
+            cog, dump = self._new_cog(url, reader), None
+        if dump is None:
+            dump = await self._read_header(cog, reader, url, headers)
+            if dump is not None and not await self._check_upstream(cog, reader):
+                logger.info(f"Cached header is outdated, reading it again [{url}]")
+                cog = self._new_cog(url, reader)
+                await self._read_upstream_header(
+                    cog, reader, url, _header_cache_key(url, headers)
+                )
+        if self.edge_tile_warmup_levels > 0:
+            self._run_in_background(cog.warm_edge_tiles(self.edge_tile_warmup_levels))
         return cog
+
+    def _new_cog(self, url: str, reader: AbstractReader) -> COGTiff:
+        return COGTiff(
+            reader.read,
+            stream=reader.stream,
+            source=url,
+            worker_pool=self.jpeg_pool,
+            dct_mask=self.dct_mask,
+            edge_tile_cache=(
+                self.edge_tile_cache if self.edge_tile_cache.max_bytes > 0 else None
+            ),
+            lazy_tile_arrays=self.lazy_tile_arrays,
+            header_bytes=self.header_prefetch.initial_bytes(url),
+            max_range_gap=self.max_range_gap,
+            max_merged_bytes=self.max_merged_bytes,
+        )
+
+    async def _check_upstream(self, cog: COGTiff, reader: AbstractReader) -> bool:
+        """Checks a COG opened from a cached header against the upstream server.
+
+        The header was not read with this token now, so it is not known if the upstream
+        server accepts it. A single byte is read before anything of the COG is served.
+        The COG is cached per token, so this is done once per url and token.
+
+        Returns False if the validators of the upstream file differ from those the
+        header was read with, as the COG was replaced since"""
+        await reader.read(0, 1)
+        self.access_checks += 1
+        etag, last_modified = reader.etag, reader.last_modified
+        if cog.etag is None and cog.last_modified is None:
+            # Like a header indexed from a local copy of the COG. It can not be checked,
+            # but its tiles get the validators of the upstream file
+            cog.etag, cog.last_modified = etag, last_modified
+            return True
+        if cog.etag is not None and etag is not None:
+            fresh = cog.etag == etag
+        elif cog.last_modified is not None and last_modified is not None:
+            fresh = cog.last_modified == last_modified
+        else:
+            fresh = True
+        if not fresh:
+            self.outdated_headers += 1
+        return fresh
+
+    def _http_reader(
+        self, url: str, headers: Optional[Dict[str, str]]
+    ) -> AbstractReader:
+        return self._upstream(HttpReader(url, self.http_session, headers))
+
+    def _file_reader(self, url: str, headers: Optional[Dict[str, str]]) -> FileReader:
+        return FileReader(_file_path(url), self.file_pool)
+
+    def _s3_reader(self, url: str, headers: Optional[Dict[str, str]]) -> AbstractReader:
+        # The token is for cogtiler and is not sent to S3
+        return self._upstream(
+            S3Reader(*parse_s3_url(url), self.http_session, self.s3_config)
+        )
+
+    def _upstream(self, reader: AbstractReader) -> AbstractReader:
+        """Adds retries, circuit breaking and hedging to a reader of remote COGs"""
+        if self.retrier.enabled:
+            reader = RetryingReader(reader, self.retrier)
+        if self.hedger.enabled:
+            # Each hedged read is retried on its own
+            reader = HedgedReader(reader, self.hedger)
+        return reader
+
+    async def _read_header(
+        self,
+        cog: COGTiff,
+        reader: AbstractReader,
+        url: str,
+        headers: Optional[Dict[str, str]],
+    ) -> Optional[bytes]:
+        """Reads the header of `cog` from the shared header cache, the disk cache or the
+        upstream server. Returns the cached header, or None if it was read from the
+        upstream server"""
+        cache_key = _header_cache_key(url, headers)
+        dump = await self._load_cached_header(cog, cache_key)
+        if dump is not None:
+            return dump
+        # Let one worker read the header while the others wait for it to be shared
+        async with self.shared_header_cache.lock(cache_key, self.timeout_s):
+            dump = await self._load_cached_header(cog, cache_key, disk=False)
+            if dump is not None:
+                return dump
+            await self._read_upstream_header(cog, reader, url, cache_key)
+        return None
+
+    async def _read_upstream_header(
+        self, cog: COGTiff, reader: AbstractReader, url: str, cache_key: str
+    ) -> None:
+        """Reads the header of `cog` from the upstream server and stores it in the shared
+        header cache and the disk cache, replacing any outdated entry"""
+        # parse header here to know if it throws. If it does throw it will not be
+        # cached
+        await cog.read_header()
+        cog.etag, cog.last_modified = reader.etag, reader.last_modified
+        self.header_prefetch.record(
+            url, cog.header_size, cog.header_reads, cog.header_bytes_read
+        )
+        dump = cog.dump_header()
+        await self.shared_header_cache.put(cache_key, dump)
+        if self.disk_cache.enabled:
+            self._run_in_background(self.disk_cache.put(cache_key, dump))
+
+    async def _load_cached_header(
+        self, cog: COGTiff, cache_key: str, disk: bool = True
+    ) -> Optional[bytes]:
+        """Loads the header of `cog` from the shared header cache or the disk cache.
+        Returns the loaded header or None if it was not found in either"""
+        caches = [self.shared_header_cache]
+        if disk:
+            caches.append(self.disk_cache)
+        for cache in caches:
+            dump = await cache.get(cache_key)
+            if dump is None:
+                continue
+            try:
+                cog.load_header(dump)
+            except TIFFError as e:
+                logger.warning(f"Ignoring cached header [{cache_key}]: {e.message}")
+                continue
+            if cache is not self.shared_header_cache:
+                await self.shared_header_cache.put(cache_key, dump)
+            return dump
+        return None
+
+    def _run_in_background(self, coro):
+        async def run():
+            try:
+                await coro
+            except Exception as e:
+                logger.warning(f"Background task failed: {repr(e)}")
+
+        # Keep a reference to the task so it is not garbage collected before it is done
+        task = asyncio.ensure_future(run())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+
+def _validator_headers(validators: Dict[str, Optional[str]]) -> Dict[str, str]:
+    headers = {"ETag": validators["etag"], "Last-Modified": validators["last_modified"]}
+    return {name: value for name, value in headers.items() if value is not None}
+
+
+def _header_cache_key(url: str, headers: Optional[Dict[str, str]]) -> str:
+    # The key includes the request headers (the token) so a header cached for one
+    # token is never used for another
+    return f"header:{url}:{sorted((headers or {}).items())}"
+
+
+def _tile_disk_key(cog: COGTiff, key) -> str:
+    source, z, x, y, overflow = key
+    # Tiles of a COG which is replaced in place are not found under its new validators
+    return f"tile:{source}:{cog.etag}:{cog.last_modified}:{z}:{x}:{y}:{overflow.value}"
+
+
+async def _drain(chunks: asyncio.Queue) -> AsyncIterator[bytes]:
+    """Yields the bytes put on `chunks` by `HttpCogClient._stream_tile`"""
+    while True:
+        chunk = await chunks.get()
+        if chunk is None:
+            return
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+
+
+def _file_path(url: str) -> Optional[str]:
+    """Local path of a file:// url or None if the url names another host"""
+    parsed = urlparse(str(url))
+    if parsed.netloc not in ("", "localhost"):
+        return None
+    return unquote(parsed.path)
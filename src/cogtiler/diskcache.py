@@ -0,0 +1,234 @@
+import asyncio
+import fcntl
+import hashlib
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from loguru import logger
+
+
+class DiskCache:
+    """Cache of bytes in a directory on disk, shared by all worker processes.
+
+    Entries are stored as one file each in a sharded directory tree named by the hash
+    of their key. Writes go to a temporary file which is atomically renamed into place,
+    so readers never see partial entries. Reading an entry updates its modification
+    time which is used for LRU eviction.
+
+    Each process counts the bytes it writes. When it has written a 20th of the size
+    limit the directory is scanned and the least recently used entries are removed
+    until the cache is below 90% of the limit. Only one process scans at a time.
+
+    File operations run in a thread so they do not block the event loop. On a tmpfs like
+    /dev/shm the cache lives in memory shared by the processes."""
+
+    # Fraction of max_bytes written by a process before it checks the total size
+    evict_interval = 0.05
+    # Fraction of max_bytes the cache is reduced to when evicting
+    evict_target = 0.9
+    # Temporary files older than this (in seconds) are left over from crashed writers
+    stale_tmp_age = 3600
+    # Max seconds between attempts to acquire a lock held by another process
+    lock_poll_interval = 0.05
+
+    def __init__(self, directory: str, max_bytes: int = 0) -> None:
+        """_summary_
+
+        Parameters
+        ----------
+        directory : str
+            Directory holding the cache. Created if it does not exist
+        max_bytes : int, optional
+            Maximum total number of bytes of the cached entries. 0 disables the cache,
+            by default 0
+        """
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+        self._written = 0
+        if self.enabled:
+            try:
+                os.makedirs(os.path.join(self.directory, ".locks"), exist_ok=True)
+            except OSError as e:
+                logger.warning(f"Disabling cache in [{self.directory}]: {repr(e)}")
+                self.max_bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and self.max_bytes > 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        try:
+            data = await asyncio.to_thread(self._get, self._path(key))
+        except OSError as e:
+            self.errors += 1
+            logger.warning(f"Disk cache read failed: {repr(e)}")
+            data = None
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    async def put(self, key: str, data: bytes) -> None:
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        try:
+            await asyncio.to_thread(self._put, self._path(key), data)
+            self.writes += 1
+            self._written += len(data)
+            if self._written >= self.max_bytes * self.evict_interval:
+                self._written = 0
+                self.evictions += await asyncio.to_thread(self._evict)
+        except OSError as e:
+            self.errors += 1
+            logger.warning(f"Disk cache write failed: {repr(e)}")
+
+    @asynccontextmanager
+    async def lock(self, key: str, timeout: float = 10.0) -> AsyncIterator[None]:
+        """Lock on `key` shared by all processes using the cache directory.
+
+        Used to let a single process fill an entry while others wait for it. Each key is
+        locked with its own lock file, so only processes filling the same entry wait for
+        each other. If the lock is not acquired within `timeout` seconds the caller
+        proceeds without it."""
+        if not self.enabled:
+            yield
+            return
+        path = os.path.join(
+            self.directory, ".locks", hashlib.sha1(key.encode()).hexdigest()
+        )
+        fd = None
+        try:
+            fd = await self._acquire(path, time.monotonic() + timeout)
+            if fd is None:
+                logger.warning(f"Proceeding without cache lock on [{key}]")
+            yield
+        finally:
+            if fd is not None:
+                # Remove the lock file before releasing it, so processes waiting on it
+                # start over with a new file
+                _remove(path)
+                os.close(fd)
+
+    async def _acquire(self, path: str, deadline: float) -> Optional[int]:
+        """Returns a file descriptor of the locked file `path`, or None if it could not be
+        locked before `deadline`"""
+        delay = 0.005
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                if time.monotonic() >= deadline:
+                    return None
+                # Poll instead of blocking a thread
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.lock_poll_interval)
+                continue
+            try:
+                current = os.stat(path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current == os.fstat(fd).st_ino:
+                return fd
+            # Locked a file removed by the previous holder
+            os.close(fd)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "max_bytes": self.max_bytes if self.enabled else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "errors": self.errors,
+        }
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:4], digest)
+
+    @staticmethod
+    def _get(path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            # Missing or evicted by another process
+            return None
+        return data
+
+    @staticmethod
+    def _put(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _evict(self) -> int:
+        """Removes the least recently used entries if the cache is too big. Returns the
+        number of removed entries"""
+        with open(os.path.join(self.directory, ".lock"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is evicting
+                return 0
+            now = time.time()
+            entries = []
+            total = 0
+            for root, dirs, files in os.walk(self.directory):
+                if root == self.directory and ".locks" in dirs:
+                    dirs.remove(".locks")
+                for name in files:
+                    if name == ".lock":
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if name.endswith(".tmp"):
+                        if now - stat.st_mtime > self.stale_tmp_age:
+                            _remove(path)
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            removed = 0
+            if total > self.max_bytes:
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= self.max_bytes * self.evict_target:
+                        break
+                    _remove(path)
+                    total -= size
+                    removed += 1
+            return removed
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
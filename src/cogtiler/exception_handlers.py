@@ -1,8 +1,16 @@
 from asyncio.exceptions import TimeoutError
+from math import ceil
+
+import aiohttp
 from fastapi import HTTPException
 from fastapi.exception_handlers import http_exception_handler
 
-from aiocogdumper.errors import HTTPError, TIFFError, HTTPRangeNotSupportedError
+from aiocogdumper.errors import (
+    HTTPError,
+    TIFFError,
+    HTTPRangeNotSupportedError,
+    UpstreamUnavailableError,
+)
 
 from loguru import logger
 
@@ -15,6 +23,31 @@ async def upstream_http_exception_handler(request, exc: HTTPError):
     return await http_exception_handler(request, exc)
 
 
+async def upstream_connection_exception_handler(
+    request, exc: aiohttp.ClientConnectionError
+):
+    """Handle failed connections to the upstream server"""
+    logger.warning(
+        f"Upstream connection error [{request.query_params['url']}]: {repr(exc)}"
+    )
+    # Convert to FastApi exception
+    exc = HTTPException(502, "Could not connect to upstream server")
+    return await http_exception_handler(request, exc)
+
+
+async def upstream_unavailable_exception_handler(
+    request, exc: UpstreamUnavailableError
+):
+    """Handle reads failed fast by the circuit breaker of an unhealthy upstream server"""
+    logger.warning(
+        f"Upstream unavailable [{request.query_params['url']}]: {exc.message}"
+    )
+    # Convert to FastApi exception
+    headers = {"Retry-After": str(ceil(exc.retry_after))} if exc.retry_after else None
+    exc = HTTPException(503, exc.message, headers=headers)
+    return await http_exception_handler(request, exc)
+
+
 async def upstream_range_not_supported_exception_handler(
     request, exc: HTTPRangeNotSupportedError
 ):
@@ -45,10 +78,21 @@ async def upstream_timeout_exception_handler(request, exc: TimeoutError):
     return await http_exception_handler(request, exc)
 
 
+async def file_not_found_exception_handler(request, exc: FileNotFoundError):
+    """Handle missing local (file://) COGs"""
+    logger.warning(f"File not found [{request.query_params['url']}]")
+    # Convert to FastApi exception
+    exc = HTTPException(404, "COG file not found")
+    return await http_exception_handler(request, exc)
+
+
 # All custom exception handlers
 all_exception_handlers = {
     HTTPError: upstream_http_exception_handler,
     HTTPRangeNotSupportedError: upstream_range_not_supported_exception_handler,
+    UpstreamUnavailableError: upstream_unavailable_exception_handler,
+    aiohttp.ClientConnectionError: upstream_connection_exception_handler,
     TIFFError: upstream_tiff_exception_handler,
     TimeoutError: upstream_timeout_exception_handler,
+    FileNotFoundError: file_not_found_exception_handler,
 }
@@ -0,0 +1,117 @@
+from collections import OrderedDict, deque
+from math import ceil
+from typing import Deque, Dict, List, Optional
+from urllib.parse import urlsplit
+
+
+class HeaderPrefetch:
+    """Learns how many bytes to read when opening a COG header.
+
+    COGs from the same producer tend to have headers of the same size. The header sizes
+    seen for each url prefix (the url without the file name) and each host are recorded,
+    and the initial read of a new COG is a running percentile of the sizes seen for its
+    prefix, or else its host. This saves the extra round trips of headers which do not
+    fit in the initial read, and avoids reading far more than needed."""
+
+    # Number of recent header sizes kept per prefix or host
+    samples = 64
+    # Initial reads are rounded up to a multiple of this
+    block_size = 4096
+
+    def __init__(
+        self,
+        percentile: float = 95,
+        max_bytes: int = 1024 * 1024,
+        max_keys: int = 1024,
+    ) -> None:
+        """_summary_
+
+        Parameters
+        ----------
+        percentile : float, optional
+            Percentile of the recorded header sizes used for the initial read. 0 disables
+            learning, by default 95
+        max_bytes : int, optional
+            Upper bound of the initial read, by default 1 MiB
+        max_keys : int, optional
+            Maximum number of prefixes and hosts to keep header sizes for, by default 1024
+        """
+        self.percentile = float(percentile)
+        self.max_bytes = int(max_bytes)
+        self.max_keys = int(max_keys)
+        self.headers = 0
+        self.reads = 0
+        self.extra_round_trips = 0
+        self.headers_with_extra_round_trips = 0
+        self.bytes_read = 0
+        self.bytes_needed = 0
+        self._sizes: "OrderedDict[str, Deque[int]]" = OrderedDict()
+
+    def initial_bytes(self, url: str) -> Optional[int]:
+        """Number of bytes to read when opening the header of the COG at `url`. None if
+        no headers have been recorded for its prefix or host"""
+        if self.percentile <= 0:
+            return None
+        for key in self._keys(url):
+            sizes = self._sizes.get(key)
+            if sizes:
+                self._sizes.move_to_end(key)
+                size = _percentile(sorted(sizes), self.percentile)
+                size = ceil(size / self.block_size) * self.block_size
+                return max(self.block_size, min(size, self.max_bytes))
+        return None
+
+    def record(self, url: str, size: int, reads: int, bytes_read: int) -> None:
+        """Record a parsed header
+
+        Parameters
+        ----------
+        url : str
+            Url of the COG
+        size : int
+            Number of bytes of the header which were needed
+        reads : int
+            Number of reads (round trips) used for reading the header
+        bytes_read : int
+            Number of bytes read for the header
+        """
+        self.headers += 1
+        self.reads += reads
+        self.extra_round_trips += max(reads - 1, 0)
+        if reads > 1:
+            self.headers_with_extra_round_trips += 1
+        self.bytes_read += bytes_read
+        self.bytes_needed += size
+        if self.percentile <= 0:
+            return
+        for key in self._keys(url):
+            sizes = self._sizes.get(key)
+            if sizes is None:
+                sizes = self._sizes[key] = deque(maxlen=self.samples)
+            self._sizes.move_to_end(key)
+            sizes.append(size)
+        while len(self._sizes) > self.max_keys:
+            self._sizes.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "keys": len(self._sizes),
+            "headers": self.headers,
+            "reads": self.reads,
+            "extra_round_trips": self.extra_round_trips,
+            "headers_with_extra_round_trips": self.headers_with_extra_round_trips,
+            "bytes_read": self.bytes_read,
+            "bytes_needed": self.bytes_needed,
+        }
+
+    @staticmethod
+    def _keys(url: str) -> List[str]:
+        parts = urlsplit(url)
+        prefix = parts.path.rsplit("/", 1)[0]
+        return [f"{parts.netloc}{prefix}/", parts.netloc]
+
+
+def _percentile(sorted_values: List[int], percentile: float) -> int:
+    # Nearest rank percentile
+    rank = ceil(percentile / 100 * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
@@ -0,0 +1,190 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from aiocogdumper.cog_tiles import AbstractReader
+from headerprefetch import _percentile
+
+
+class Hedger:
+    """Hedges slow upstream reads by sending a duplicate request.
+
+    The latencies of recent reads are recorded. When a read has not completed after a
+    running percentile of them, the same read is sent again and whichever finishes first
+    is used. The other is cancelled.
+
+    Duplicate requests are limited by a budget: each read earns `budget` hedges, and a
+    hedge is only sent if a whole one has been earned (at most `burst` are saved up). So
+    at most about `budget` times the number of reads are sent as extra requests."""
+
+    # Number of recent latencies kept
+    samples = 256
+    # Number of latencies needed before reads are hedged
+    min_samples = 16
+    # Max number of unused hedges saved up
+    burst = 10
+
+    def __init__(
+        self, percentile: float = 0, budget: float = 0.05, min_delay: float = 0.01
+    ) -> None:
+        """_summary_
+
+        Parameters
+        ----------
+        percentile : float, optional
+            Percentile of the recent read latencies after which a read is hedged. 0
+            disables hedging, by default 0
+        budget : float, optional
+            Max number of hedges as a fraction of the number of reads, by default 0.05
+        min_delay : float, optional
+            Min number of seconds before a read is hedged, by default 0.01
+        """
+        self.percentile = float(percentile)
+        self.budget = float(budget)
+        self.min_delay = float(min_delay)
+        self.reads = 0
+        self.hedged = 0
+        self.wins = 0
+        self.budget_exhausted = 0
+        self._tokens = 0.0
+        self._latencies = deque(maxlen=self.samples)
+
+    @property
+    def enabled(self) -> bool:
+        return self.percentile > 0 and self.budget > 0
+
+    def delay(self) -> Optional[float]:
+        """Seconds after which a read is hedged. None if too few reads are recorded"""
+        if len(self._latencies) < self.min_samples:
+            return None
+        delay = _percentile(sorted(self._latencies), self.percentile)
+        return max(delay, self.min_delay)
+
+    async def read(self, read: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns the result of `read()`, calling it again if it is slow"""
+        return await self._run(lambda: asyncio.ensure_future(read()))
+
+    async def stream(self, stream: Callable[[], AsyncIterator[bytes]]):
+        """Yields the chunks of `stream()`. If the first chunk is slow the stream is
+        opened again and the stream which yields first is used"""
+        streams = []
+        chunks = None
+
+        def first_chunk():
+            chunks = stream().__aiter__()
+            task = asyncio.ensure_future(_first_chunk(chunks))
+            streams.append((chunks, task))
+            return task
+
+        try:
+            chunks, chunk = await self._run(first_chunk)
+        finally:
+            for other, task in streams:
+                if other is not chunks:
+                    # A generator can not be closed while the task reading it runs
+                    await asyncio.wait([task])
+                    await other.aclose()
+        try:
+            if chunk is None:
+                return
+            yield chunk
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    def stats(self) -> Dict[str, float]:
+        delay = self.delay()
+        return {
+            "reads": self.reads,
+            "hedged": self.hedged,
+            "wins": self.wins,
+            "budget_exhausted": self.budget_exhausted,
+            "hedge_rate": self.hedged / self.reads if self.reads else 0.0,
+            "win_rate": self.wins / self.hedged if self.hedged else 0.0,
+            "delay_ms": round(delay * 1000, 1) if delay is not None else None,
+        }
+
+    async def _run(self, start: Callable[[], "asyncio.Future"]) -> Any:
+        self.reads += 1
+        self._tokens = min(self._tokens + self.budget, self.burst)
+        delay = self.delay() if self.enabled else None
+        started = time.perf_counter()
+        first = start()
+        try:
+            if delay is not None:
+                await asyncio.wait([first], timeout=delay)
+            if first.done() or delay is None:
+                result = await first
+                self._latencies.append(time.perf_counter() - started)
+                return result
+            if self._tokens < 1:
+                self.budget_exhausted += 1
+                result = await first
+                self._latencies.append(time.perf_counter() - started)
+                return result
+            self._tokens -= 1
+            self.hedged += 1
+            second = start()
+            try:
+                winner = await _first_success(first, second)
+            finally:
+                # The latency of the first read is at least this long
+                self._latencies.append(time.perf_counter() - started)
+                _cancel(second)
+            if winner is second:
+                self.wins += 1
+            return winner.result()
+        finally:
+            _cancel(first)
+
+
+class HedgedReader(AbstractReader):
+    """Wraps a reader and hedges its reads with a `Hedger`.
+
+    Attributes not defined here (like the `etag` of a http reader) are those of the
+    wrapped reader."""
+
+    def __init__(self, reader: AbstractReader, hedger: Hedger):
+        self.reader = reader
+        self.hedger = hedger
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+    async def read(self, offset, length):
+        return await self.hedger.read(lambda: self.reader.read(offset, length))
+
+    async def stream(self, offset, length):
+        chunks = self.hedger.stream(lambda: self.reader.stream(offset, length))
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+
+async def _first_chunk(chunks):
+    """Returns `chunks` and its first chunk (None if it is empty)"""
+    async for chunk in chunks:
+        return chunks, chunk
+    return chunks, None
+
+
+async def _first_success(first: asyncio.Future, second: asyncio.Future):
+    """Returns the first of two futures which completes without an exception, or
+    `first` if both fail"""
+    pending = {first, second}
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in (first, second):
+            if future in done and future.exception() is None:
+                return future
+    return first
+
+
+def _cancel(future: asyncio.Future) -> None:
+    if not future.cancel() and not future.cancelled():
+        # Mark the exception of a failed loser as retrieved
+        future.exception()
@@ -0,0 +1,107 @@
+from typing import Dict, Optional
+
+import aiohttp
+
+
+class HttpPool:
+    """Creates the aiohttp session used for upstream requests and keeps statistics of
+    its connection pool.
+
+    Connections to the upstream servers are kept alive and reused between requests, so
+    most requests avoid the cost of a new TCP and TLS handshake. Requests wait for a free
+    connection when `limit` or `limit_per_host` is reached.
+
+    Events of the pool are counted through aiohttp tracing. The number of open, idle and
+    waiting connections are read from the connector when stats are requested."""
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 15.0,
+        dns_cache_ttl: Optional[int] = 10,
+    ) -> None:
+        """_summary_
+
+        Parameters
+        ----------
+        limit : int, optional
+            Max number of open connections. 0 means no limit, by default 100
+        limit_per_host : int, optional
+            Max number of open connections to the same host. 0 means no limit, by
+            default 0
+        keepalive_timeout : float, optional
+            Seconds an idle connection is kept open for reuse. 0 closes connections
+            after each request, by default 15.0
+        dns_cache_ttl : Optional[int], optional
+            Seconds resolved host names are cached. None caches them forever, by
+            default 10
+        """
+        self.limit = int(limit)
+        self.limit_per_host = int(limit_per_host)
+        self.keepalive_timeout = float(keepalive_timeout)
+        self.dns_cache_ttl = dns_cache_ttl
+        self.connector: Optional[aiohttp.TCPConnector] = None
+        self.created = 0
+        self.reused = 0
+        self.queued = 0
+        self.dns_cache_misses = 0
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_connection_create_end.append(self._on_create)
+        self.trace_config.on_connection_reuseconn.append(self._on_reuse)
+        self.trace_config.on_connection_queued_start.append(self._on_queued)
+        self.trace_config.on_dns_cache_miss.append(self._on_dns_cache_miss)
+
+    def session(self, timeout: aiohttp.ClientTimeout) -> aiohttp.ClientSession:
+        """Creates a session using a new connection pool"""
+        if self.keepalive_timeout > 0:
+            keepalive = dict(keepalive_timeout=self.keepalive_timeout)
+        else:
+            keepalive = dict(force_close=True)
+        self.connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            **keepalive,
+        )
+        return aiohttp.ClientSession(
+            connector=self.connector,
+            timeout=timeout,
+            trace_configs=[self.trace_config],
+        )
+
+    def stats(self) -> Dict[str, int]:
+        open_ = idle = waiting = 0
+        connector = self.connector
+        if connector is not None and not connector.closed:
+            # aiohttp has no public api for the state of the pool
+            idle = sum(
+                len(conns) for conns in getattr(connector, "_conns", {}).values()
+            )
+            open_ = len(getattr(connector, "_acquired", ())) + idle
+            waiting = sum(
+                len(waiters) for waiters in getattr(connector, "_waiters", {}).values()
+            )
+        return {
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "open": open_,
+            "idle": idle,
+            "waiting": waiting,
+            "created": self.created,
+            "reused": self.reused,
+            "queued": self.queued,
+            "dns_cache_misses": self.dns_cache_misses,
+        }
+
+    async def _on_create(self, session, context, params) -> None:
+        self.created += 1
+
+    async def _on_reuse(self, session, context, params) -> None:
+        self.reused += 1
+
+    async def _on_queued(self, session, context, params) -> None:
+        self.queued += 1
+
+    async def _on_dns_cache_miss(self, session, context, params) -> None:
+        self.dns_cache_misses += 1
@@ -1,10 +1,10 @@
 import math
 import sys
 
-from fastapi import FastAPI, Path, Query, Response
+from fastapi import FastAPI, HTTPException, Path, Query, Response
 from fastapi.openapi.utils import get_openapi
 from fastapi.param_functions import Depends
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 
 from aiocogdumper.cog_tiles import COGTiff, Overflow
 from aiocogdumper.cog_tiles import TiffInfo
@@ -17,6 +17,8 @@ from middlewares import ProcessTimeMiddleware, CacheControlMiddleware
 from cog import (
     HttpCogClient,
     CogRequest,
+    TileBatch,
+    TileConditions,
 )
 
 # Setup of settings and log
@@ -56,7 +58,47 @@ app.add_middleware(
 )
 
 # COG client
-cog_client = HttpCogClient(timeout=settings.request_timeout)
+cog_client = HttpCogClient(
+    timeout=settings.request_timeout,
+    tile_cache_size=settings.tile_cache_size,
+    jpeg_workers=settings.jpeg_workers,
+    jpeg_queue_size=settings.jpeg_queue_size,
+    dct_mask=settings.dct_mask,
+    edge_tile_cache_size=settings.edge_tile_cache_size,
+    edge_tile_warmup_levels=settings.edge_tile_warmup_levels,
+    header_cache_size=settings.header_cache_size,
+    lazy_tile_arrays=settings.lazy_tile_arrays,
+    header_prefetch_percentile=settings.header_prefetch_percentile,
+    max_range_gap=settings.max_range_gap,
+    max_merged_bytes=settings.max_merged_bytes,
+    prefetch_concurrency=settings.prefetch_concurrency,
+    prefetch_max_bytes=settings.prefetch_max_bytes,
+    disk_cache_dir=settings.disk_cache_dir,
+    disk_cache_size=settings.disk_cache_size,
+    shared_header_cache_dir=settings.shared_header_cache_dir,
+    shared_header_cache_size=settings.shared_header_cache_size,
+    header_index=settings.header_index,
+    pool_limit=settings.pool_limit,
+    pool_limit_per_host=settings.pool_limit_per_host,
+    keepalive_timeout=settings.keepalive_timeout,
+    dns_cache_ttl=settings.dns_cache_ttl,
+    connect_timeout=settings.connect_timeout,
+    read_timeout=settings.read_timeout,
+    stream_tiles=settings.stream_tiles,
+    file_pool_size=settings.file_pool_size,
+    file_mmap=settings.file_mmap,
+    s3_endpoint=settings.s3_endpoint,
+    s3_region=settings.s3_region,
+    hedge_percentile=settings.hedge_percentile,
+    hedge_budget=settings.hedge_budget,
+    hedge_min_delay=settings.hedge_min_delay,
+    retries=settings.retries,
+    retry_backoff=settings.retry_backoff,
+    retry_max_backoff=settings.retry_max_backoff,
+    retry_timeouts=settings.retry_timeouts,
+    breaker_failures=settings.breaker_failures,
+    breaker_reset_timeout=settings.breaker_reset_timeout,
+)
 
 
 # Startup and shutdown events
@@ -123,7 +165,10 @@ async def get_info(cog: COGTiff = Depends(cog_client.cog_from_query_param)):
     responses={200: {"content": {"image/jpeg": {}}}},
     response_class=Response,
 )
-async def get_thumbnail(cog: COGTiff = Depends(cog_client.cog_from_query_param)):
+async def get_thumbnail(
+    cog: COGTiff = Depends(cog_client.cog_from_query_param),
+    conditions: TileConditions = Depends(TileConditions),
+):
     """Gets a thumbnail from the specified JPEG compressed Cloud Optimized GeoTIFF.
 
     This is equivalent to getting the top most tile from the overviews `(z=0, x=0, y=0)` using `overflow = crop`.
@@ -132,7 +177,7 @@ async def get_thumbnail(cog: COGTiff = Depends(cog_client.cog_from_query_param))
     info = await cog.get_info(0)
     max_zoom = info.overviews
     return await cog_client.get_tile_response(
-        cog, max_zoom, 0, 0, overflow=Overflow.Crop
+        cog, max_zoom, 0, 0, overflow=Overflow.Crop, conditions=conditions
     )
 
 
@@ -159,12 +204,59 @@ async def get_tile_from_xyz(
     y: int = Path(..., description="Tile row (from top of image)"),
     overflow: Overflow = Query(Overflow.Mask, description=overflow_description),
     cog: COGTiff = Depends(cog_client.cog_from_query_param),
+    conditions: TileConditions = Depends(TileConditions),
 ):
-    """Gets a single tile from the specified JPEG compressed Cloud Optimized GeoTIFF"""
+    """Gets a single tile from the specified JPEG compressed Cloud Optimized GeoTIFF
+
+    Tiles have an `ETag` (and a `Last-Modified` if the upstream server sends one).
+    Requests with a matching `If-None-Match` or `If-Modified-Since` header get an empty
+    `304 Not Modified` response."""
     info = await cog.get_info(0)
     zoomlevels = info.overviews + 1
     cog_z = zoomlevels - z - 1
-    return await cog_client.get_tile_response(cog, cog_z, x, y, overflow)
+    return await cog_client.get_tile_response(
+        cog, cog_z, x, y, overflow, conditions=conditions
+    )
+
+
+@app.post(
+    "/tiles/batch",
+    responses={200: {"content": {"multipart/mixed": {}}}},
+    response_class=Response,
+)
+async def get_tile_batch(
+    batch: TileBatch,
+    overflow: Overflow = Query(Overflow.Mask, description=overflow_description),
+    cog: COGTiff = Depends(cog_client.cog_from_query_param),
+):
+    """Gets a number of tiles from the specified JPEG compressed Cloud Optimized GeoTIFF
+    in one `multipart/mixed` response.
+
+    Tiles use the same `z`, `x` and `y` as `/tiles/{z}/{x}/{y}.jpg`. Each part has a
+    `Content-Location` header like `tiles/{z}/{x}/{y}.jpg` identifying the tile. Parts are
+    sent as soon as their tile is ready, so they may not be in the requested order.
+
+    Tiles which are close together in the file are read from the upstream server in a
+    single request."""
+    if len(batch.tiles) > settings.batch_max_tiles:
+        raise HTTPException(
+            400, f"At most {settings.batch_max_tiles} tiles can be requested at once"
+        )
+    info = await cog.get_info(0)
+    zoomlevels = info.overviews + 1
+    levels = [await cog.get_info(z) for z in range(zoomlevels)]
+    tiles = []
+    for t in batch.tiles:
+        name = f"tiles/{t.z}/{t.x}/{t.y}.jpg"
+        cog_z = zoomlevels - t.z - 1
+        if not (
+            0 <= cog_z < zoomlevels
+            and 0 <= t.x < levels[cog_z].tile_cols
+            and 0 <= t.y < levels[cog_z].tile_rows
+        ):
+            raise HTTPException(400, f"Tile {name} is out of bounds")
+        tiles.append((cog_z, t.x, t.y, name))
+    return await cog_client.get_tiles_response(cog, tiles, overflow)
 
 
 ########################################################################################
@@ -190,7 +282,10 @@ async def get_deepzoom_xml(cog: COGTiff = Depends(cog_client.cog_from_query_para
     response_class=Response,
 )
 async def get_deepzoom_tile(
-    z: int, tilename: str, cog: COGTiff = Depends(cog_client.cog_from_query_param)
+    z: int,
+    tilename: str,
+    cog: COGTiff = Depends(cog_client.cog_from_query_param),
+    conditions: TileConditions = Depends(TileConditions),
 ):
     """Deep Zoom image tiles"""
     # TODO: regex på tile i FastAPI. TROR det er ("x_y.jpg")
@@ -202,7 +297,9 @@ async def get_deepzoom_tile(
     num_levels = int(math.ceil(math.log(max_dimension, 2))) + 1
     cog_z = num_levels - z - 1
     # DeepZoom apparantly crops overflow away from tiles
-    return await cog_client.get_tile_response(cog, cog_z, x, y, Overflow.Crop)
+    return await cog_client.get_tile_response(
+        cog, cog_z, x, y, Overflow.Crop, conditions=conditions
+    )
 
 
 ########################################################################################
@@ -241,5 +338,18 @@ async def get_html_viewer(cog_req: CogRequest = Depends(CogRequest)):
     return HTMLResponse(html)
 
 
+########################################################################################
+# cache statistics
+
+
+if settings.stats:
+
+    @app.get("/stats", include_in_schema=False)
+    async def get_stats():
+        """Internal counters of the caches in this worker"""
+        # The counters change with every request, so they must not be cached
+        return JSONResponse(cog_client.stats(), headers={"Cache-Control": "no-store"})
+
+
 ########################################################################################
 # helper methods
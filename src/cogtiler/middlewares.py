@@ -1,38 +1,49 @@
 import time
 
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi import Response, Request
+from starlette.datastructures import URL, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from loguru import logger
 
 
-class ProcessTimeMiddleware(BaseHTTPMiddleware):
+class ProcessTimeMiddleware:
     """Middleware adding processing time to response header and logs"""
 
     def __init__(
         self,
-        app,
+        app: ASGIApp,
     ):
-        super().__init__(app)
+        self.app = app
 
-    async def dispatch(self, request: Request, call_next):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         start = time.perf_counter()
-        response = await call_next(request)
-        end = time.perf_counter()
-        process_time = f"{(end - start) * 1000:0.1f} ms"
-        logger.debug("{} {} {}", request.method, request.url, process_time)
-        response.headers["X-Process-Time"] = process_time
-        return response
 
+        async def send_with_process_time(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                end = time.perf_counter()
+                process_time = f"{(end - start) * 1000:0.1f} ms"
+                logger.debug(
+                    "{} {} {}", scope["method"], URL(scope=scope), process_time
+                )
+                MutableHeaders(scope=message)["X-Process-Time"] = process_time
+            await send(message)
 
-class CacheControlMiddleware(BaseHTTPMiddleware):
+        await self.app(scope, receive, send_with_process_time)
+
+
+class CacheControlMiddleware:
     """Set Cache-Control header for any successful GET (unless it was set before this middleware)."""
 
     HEADER_NAME = "Cache-Control"
     REQUEST_METHODS = ["GET", "HEAD"]
 
-    def __init__(self, app, storage_directive: str = "public", max_age: int = None):
-        super().__init__(app)
+    def __init__(
+        self, app: ASGIApp, storage_directive: str = "public", max_age: int = None
+    ):
+        self.app = app
         self.storage_directive = storage_directive
         self.max_age = int(max_age) if max_age is not None else None
         value = self.storage_directive
@@ -41,12 +52,16 @@ class CacheControlMiddleware(BaseHTTPMiddleware):
         self.cache_control_dict = {self.HEADER_NAME: value}
         logger.info(f"Adding cache-control middleware: [{value}]")
 
-    async def dispatch(self, request: Request, call_next) -> Response:
-        response = await call_next(request)
-        if (
-            self.HEADER_NAME not in response.headers
-            and request.method in self.REQUEST_METHODS
-            and response.status_code < 500
-        ):
-            response.headers.update(self.cache_control_dict)
-        return response
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] not in self.REQUEST_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cache_control(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 500:
+                headers = MutableHeaders(scope=message)
+                if self.HEADER_NAME not in headers:
+                    headers.update(self.cache_control_dict)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cache_control)
@@ -0,0 +1,178 @@
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Set, Tuple, Union
+
+from loguru import logger
+
+from aiocogdumper.cog_tiles import COGTiff, Overflow
+from singleflight import SingleFlight
+from tilecache import TileCache
+
+
+class TilePrefetcher:
+    """Reads the neighbours of requested tiles into the tile cache in the background.
+
+    After a tile is served its neighbours in the same overview and the four tiles
+    covering it in the next (higher resolution) overview are likely to be requested
+    next. They are read with a single batched read into the tile cache. While they are
+    read the tiles are in flight in the tile single flight group, so requests for them
+    wait for the prefetch instead of reading them again.
+
+    Prefetching is bounded by the number of concurrent prefetches and by the number of
+    bytes of prefetched tiles which have not been requested yet. When either bound is
+    reached new prefetches are skipped."""
+
+    def __init__(
+        self,
+        tile_cache: TileCache,
+        tile_flight: SingleFlight,
+        concurrency: int = 0,
+        max_bytes: int = 0,
+    ) -> None:
+        """_summary_
+
+        Parameters
+        ----------
+        tile_cache : TileCache
+            Cache the prefetched tiles are put in
+        tile_flight : SingleFlight
+            Single flight group of tile reads, keyed like the tile cache
+        concurrency : int, optional
+            Max number of prefetches running at the same time. 0 disables prefetching,
+            by default 0
+        max_bytes : int, optional
+            Max number of bytes of prefetched tiles which have not been requested yet,
+            by default 0
+        """
+        self.tile_cache = tile_cache
+        self.tile_flight = tile_flight
+        self.concurrency = int(concurrency)
+        self.max_bytes = int(max_bytes)
+        self.size = 0
+        self.in_flight = 0
+        self.prefetched = 0
+        self.hits = 0
+        self.wasted = 0
+        self.skipped = 0
+        # Prefetched tiles which have not been requested yet and their sizes
+        self._unused: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.concurrency > 0 and self.max_bytes > 0
+
+    def hit(self, key: Hashable) -> None:
+        """Tell the prefetcher that the tile with `key` was served from the tile cache"""
+        size = self._unused.pop(key, None)
+        if size is not None:
+            self.size -= size
+            self.hits += 1
+
+    def schedule(self, cog: COGTiff, z: int, x: int, y: int, overflow: Overflow):
+        """Prefetch the neighbours of tile (z, x, y) in the background"""
+        if not self.enabled:
+            return
+        if self.in_flight >= self.concurrency or self.size >= self.max_bytes:
+            self.skipped += 1
+            return
+        self.in_flight += 1
+        task = asyncio.ensure_future(self._prefetch(cog, z, x, y, overflow))
+        # Keep a reference to the task so it is not garbage collected before it is done
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        return {
+            "in_flight": self.in_flight,
+            "prefetched": self.prefetched,
+            "hits": self.hits,
+            "wasted": self.wasted,
+            "skipped": self.skipped,
+            "unused_bytes": self.size,
+            "hit_ratio": self.hits / self.prefetched if self.prefetched else 0.0,
+        }
+
+    async def _prefetch(
+        self, cog: COGTiff, z: int, x: int, y: int, overflow: Overflow
+    ) -> None:
+        # Tiles being prefetched which have not been read yet
+        pending: Dict[Hashable, asyncio.Future] = {}
+        error = None
+        try:
+            keys = [
+                (cog.source, tz, tx, ty, overflow)
+                for tz, tx, ty in await self._neighbours(cog, z, x, y)
+            ]
+            keys = [
+                key
+                for key in keys
+                if key not in self.tile_cache and key not in self.tile_flight
+            ]
+            if not keys:
+                return
+            loop = asyncio.get_running_loop()
+            for key in keys:
+                future = pending[key] = loop.create_future()
+                self.tile_flight.start(key, lambda: future)
+            tiles = await cog.get_tiles(
+                [(tx, ty, tz, ov) for _, tz, tx, ty, ov in keys]
+            )
+            async for i, _, tilebytes in tiles:
+                self._add(keys[i], tilebytes)
+                pending.pop(keys[i]).set_result(tilebytes)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = e
+            logger.warning(f"Prefetch failed: {repr(e)}")
+        finally:
+            self.in_flight -= 1
+            # Requests waiting for the tiles get the error of the prefetch
+            for future in pending.values():
+                if error is None:
+                    future.cancel()
+                else:
+                    future.set_exception(error)
+
+    def _add(self, key: Hashable, tilebytes: bytes) -> None:
+        self.tile_cache.put(key, tilebytes)
+        self.prefetched += 1
+        old = self._unused.pop(key, None)
+        if old is not None:
+            self.size -= old
+        self._unused[key] = len(tilebytes)
+        self.size += len(tilebytes)
+        # Forget the oldest unused tiles. They were most likely prefetched in vain
+        while self.size > self.max_bytes:
+            _, size = self._unused.popitem(last=False)
+            self.size -= size
+            self.wasted += 1
+
+    @staticmethod
+    async def _neighbours(
+        cog: COGTiff, z: int, x: int, y: int
+    ) -> List[Tuple[int, int, int]]:
+        info = await cog.get_info(z)
+        tiles = [
+            (z, x + dx, y + dy)
+            for dy in (-1, 0, 1)
+            for dx in (-1, 0, 1)
+            if (dx or dy)
+            and 0 <= x + dx < info.tile_cols
+            and 0 <= y + dy < info.tile_rows
+        ]
+        # z counts overviews from full resolution, so z - 1 is the next resolution
+        if z > 0:
+            child = await cog.get_info(z - 1)
+            tiles += [
+                (z - 1, cx, cy)
+                for cy in (2 * y, 2 * y + 1)
+                for cx in (2 * x, 2 * x + 1)
+                if cx < child.tile_cols and cy < child.tile_rows
+            ]
+        return tiles
@@ -0,0 +1,311 @@
+import asyncio
+import random
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict
+from urllib.parse import urlsplit
+
+import aiohttp
+from loguru import logger
+
+from aiocogdumper.cog_tiles import AbstractReader
+from aiocogdumper.errors import HTTPError, UpstreamUnavailableError
+
+# Upstream statuses worth retrying
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def is_transient(e: BaseException) -> bool:
+    """Whether a failed upstream read may succeed if retried"""
+    if isinstance(e, HTTPError):
+        return e.status in RETRY_STATUSES
+    return isinstance(
+        e,
+        (
+            aiohttp.ClientConnectionError,
+            aiohttp.ClientPayloadError,
+            asyncio.TimeoutError,
+        ),
+    )
+
+
+class _Circuit:
+    __slots__ = ("failures", "opened_at", "probing")
+
+    def __init__(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+
+class CircuitBreakers:
+    """Per host circuit breakers failing upstream reads fast while a host is unhealthy.
+
+    After `failures` consecutive transient failures (see `is_transient`) of reads from a
+    host its circuit opens, and reads from it fail right away with an
+    UpstreamUnavailableError instead of waiting for the upstream server. After
+    `reset_timeout` seconds a single read is let through. If it succeeds the circuit
+    closes, otherwise it stays open for another `reset_timeout`."""
+
+    def __init__(
+        self, failures: int = 0, reset_timeout: float = 10.0, max_hosts: int = 1024
+    ) -> None:
+        """_summary_
+
+        Parameters
+        ----------
+        failures : int, optional
+            Number of consecutive failures which open the circuit of a host. 0 disables
+            the circuit breakers, by default 0
+        reset_timeout : float, optional
+            Seconds a circuit stays open before a read is tried again, by default 10.0
+        max_hosts : int, optional
+            Max number of hosts to keep track of. Hosts with closed circuits are
+            forgotten first, by default 1024
+        """
+        self.failures = int(failures)
+        self.reset_timeout = float(reset_timeout)
+        self.max_hosts = int(max_hosts)
+        self.trips = 0
+        self.rejected = 0
+        self._circuits: Dict[str, _Circuit] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.failures > 0
+
+    def check(self, host: str) -> None:
+        """Raises UpstreamUnavailableError if reads from `host` should fail fast"""
+        circuit = self._circuits.get(host)
+        if circuit is None or circuit.opened_at is None:
+            return
+        remaining = circuit.opened_at + self.reset_timeout - time.monotonic()
+        if remaining <= 0 and not circuit.probing:
+            # Let this read find out if the host has recovered
+            circuit.probing = True
+            return
+        self.rejected += 1
+        raise UpstreamUnavailableError(
+            f"Upstream server {host} is unavailable", max(remaining, 1)
+        )
+
+    def success(self, host: str) -> None:
+        circuit = self._circuits.get(host)
+        if circuit is None:
+            return
+        if circuit.opened_at is not None:
+            logger.info(f"Upstream server {host} recovered")
+        del self._circuits[host]
+
+    def failure(self, host: str) -> None:
+        circuit = self._circuits.get(host)
+        if circuit is None:
+            self._forget()
+            circuit = self._circuits[host] = _Circuit()
+        circuit.failures += 1
+        circuit.probing = False
+        if circuit.opened_at is not None or circuit.failures >= self.failures:
+            if circuit.opened_at is None:
+                self.trips += 1
+                logger.warning(
+                    f"Upstream server {host} failed {circuit.failures} times in a row. "
+                    f"Failing reads for {self.reset_timeout} s"
+                )
+            circuit.opened_at = time.monotonic()
+
+    def release(self, host: str) -> None:
+        """Tell the breaker that a read let through by `check` was abandoned"""
+        circuit = self._circuits.get(host)
+        if circuit is not None:
+            circuit.probing = False
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hosts": len(self._circuits),
+            "open": sum(c.opened_at is not None for c in self._circuits.values()),
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+    def _forget(self) -> None:
+        if len(self._circuits) < self.max_hosts:
+            return
+        for host in [h for h, c in self._circuits.items() if c.opened_at is None]:
+            del self._circuits[host]
+            if len(self._circuits) < self.max_hosts:
+                return
+
+
+class Retrier:
+    """Retries transient failures of upstream reads with jittered exponential backoff.
+
+    Reads are idempotent range requests, so they can be sent again safely. Attempt `n`
+    (from 1) is delayed by a random time between 0 and `backoff * 2 ** (n - 1)`, capped
+    at `max_backoff` ("full jitter"), so retries from many requests are spread out.
+    Every attempt goes through the circuit breaker of the host.
+
+    Timeouts are only retried with `retry_timeouts`, as each attempt may take the whole
+    request timeout. They still count as failures for the circuit breaker."""
+
+    def __init__(
+        self,
+        retries: int = 0,
+        backoff: float = 0.1,
+        max_backoff: float = 2.0,
+        breakers: CircuitBreakers = None,
+        retry_timeouts: bool = False,
+    ) -> None:
+        """_summary_
+
+        Parameters
+        ----------
+        retries : int, optional
+            Max number of retries of a read, by default 0
+        backoff : float, optional
+            Seconds of the max delay before the first retry. The max delay doubles
+            with each retry, by default 0.1
+        max_backoff : float, optional
+            Upper bound in seconds of the delay before a retry, by default 2.0
+        breakers : CircuitBreakers, optional
+            Circuit breakers of the upstream hosts, by default None
+        retry_timeouts : bool, optional
+            Retry reads which time out, by default False
+        """
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.breakers = breakers or CircuitBreakers()
+        self.retry_timeouts = retry_timeouts
+        self.attempts = 0
+        self.retried = 0
+        self.recovered = 0
+        self.exhausted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.retries > 0 or self.breakers.enabled
+
+    async def read(self, host: str, read: Callable[[], Awaitable[Any]]) -> Any:
+        """Returns the result of `read()`, retrying transient failures"""
+        retry = 0
+        while True:
+            try:
+                result = await self._attempt(host, read)
+            except Exception as e:
+                if not await self._should_retry(e, retry):
+                    raise
+                retry += 1
+                continue
+            if retry > 0:
+                self.recovered += 1
+            return result
+
+    async def stream(self, host: str, stream: Callable[[], AsyncIterator[bytes]]):
+        """Yields the chunks of `stream()`. Failures before the first chunk are retried"""
+        retry = 0
+        while True:
+            chunks = stream().__aiter__()
+            try:
+                chunk = await self._attempt(host, lambda: _first_chunk(chunks))
+            except Exception as e:
+                await chunks.aclose()
+                if not await self._should_retry(e, retry):
+                    raise
+                retry += 1
+                continue
+            except BaseException:
+                await chunks.aclose()
+                raise
+            break
+        if retry > 0:
+            self.recovered += 1
+        try:
+            if chunk is None:
+                return
+            yield chunk
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "attempts": self.attempts,
+            "retried": self.retried,
+            "recovered": self.recovered,
+            "exhausted": self.exhausted,
+        }
+
+    async def _attempt(self, host: str, read: Callable[[], Awaitable[Any]]) -> Any:
+        breakers = self.breakers
+        if breakers.enabled:
+            breakers.check(host)
+        self.attempts += 1
+        try:
+            result = await read()
+        except Exception as e:
+            if breakers.enabled:
+                if is_transient(e):
+                    breakers.failure(host)
+                else:
+                    # The host answered, but not with data
+                    breakers.success(host)
+            raise
+        except BaseException:
+            # Cancelled, like the loser of a hedged read
+            if breakers.enabled:
+                breakers.release(host)
+            raise
+        if breakers.enabled:
+            breakers.success(host)
+        return result
+
+    async def _should_retry(self, e: Exception, retry: int) -> bool:
+        if not is_transient(e):
+            return False
+        if isinstance(e, asyncio.TimeoutError) and not self.retry_timeouts:
+            return False
+        if retry >= self.retries:
+            if self.retries > 0:
+                self.exhausted += 1
+            return False
+        self.retried += 1
+        delay = min(self.max_backoff, self.backoff * 2**retry)
+        await asyncio.sleep(random.uniform(0, delay))
+        return True
+
+
+class RetryingReader(AbstractReader):
+    """Wraps a http (or S3) reader and retries its reads with a `Retrier`.
+
+    Attributes not defined here (like the `etag` of a http reader) are those of the
+    wrapped reader."""
+
+    def __init__(self, reader: AbstractReader, retrier: Retrier):
+        self.reader = reader
+        self.retrier = retrier
+        self.host = urlsplit(str(reader.url)).netloc
+
+    def __getattr__(self, name):
+        return getattr(self.reader, name)
+
+    async def read(self, offset, length):
+        return await self.retrier.read(
+            self.host, lambda: self.reader.read(offset, length)
+        )
+
+    async def stream(self, offset, length):
+        chunks = self.retrier.stream(
+            self.host, lambda: self.reader.stream(offset, length)
+        )
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+
+async def _first_chunk(chunks):
+    """Returns the first chunk of `chunks` or None if it is empty"""
+    async for chunk in chunks:
+        return chunk
+    return None
@@ -16,8 +16,50 @@ class Settings(BaseSettings):
 
     whitelist: Set[HttpUrl] = set()
     debug: bool = False
+    stats: bool = False
     request_timeout: float = 10
     cache_max_age: Optional[int] = 60 * 60 * 24
+    tile_cache_size: int = 32 * 1024 * 1024
+    jpeg_workers: int = 2
+    jpeg_queue_size: int = 64
+    dct_mask: bool = True
+    edge_tile_cache_size: int = 8 * 1024 * 1024
+    edge_tile_warmup_levels: int = 0
+    header_cache_size: int = 1024
+    lazy_tile_arrays: bool = True
+    header_prefetch_percentile: float = 95
+    max_range_gap: int = 16 * 1024
+    max_merged_bytes: int = 4 * 1024 * 1024
+    batch_max_tiles: int = 64
+    prefetch_concurrency: int = 0
+    prefetch_max_bytes: int = 4 * 1024 * 1024
+    disk_cache_dir: Optional[str] = None
+    disk_cache_size: int = 1024 * 1024 * 1024
+    shared_header_cache_dir: Optional[str] = None
+    shared_header_cache_size: int = 16 * 1024 * 1024
+    header_index: Optional[str] = None
+    pool_limit: int = 100
+    pool_limit_per_host: int = 0
+    keepalive_timeout: float = 15
+    dns_cache_ttl: Optional[int] = 10
+    connect_timeout: Optional[float] = None
+    read_timeout: Optional[float] = None
+    stream_tiles: bool = True
+    file_root: Optional[str] = None
+    file_pool_size: int = 64
+    file_mmap: bool = False
+    s3_buckets: Set[str] = set()
+    s3_endpoint: Optional[str] = None
+    s3_region: Optional[str] = None
+    hedge_percentile: float = 0
+    hedge_budget: float = 0.05
+    hedge_min_delay: float = 0.01
+    retries: int = 2
+    retry_backoff: float = 0.1
+    retry_max_backoff: float = 2
+    retry_timeouts: bool = False
+    breaker_failures: int = 10
+    breaker_reset_timeout: float = 10
 
     class Config:
         env_prefix = "cogtiler_"
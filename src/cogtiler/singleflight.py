@@ -0,0 +1,71 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key into a single call.
+
+    While a call for a key is in flight, later callers with the same key await the
+    result (or exception) of the first call instead of starting their own."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight: Dict[Hashable, "asyncio.Future"] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """Awaits `fn()` unless a call with the same key is already in flight
+
+        Parameters
+        ----------
+        key : Hashable
+            Identifies calls which can share a result
+        fn : Callable[[], Awaitable[T]]
+            Creates the awaitable doing the actual work
+
+        Returns
+        -------
+        T
+            Result of the shared call
+        """
+        # Shield the shared task so one cancelled caller (eg. a client disconnecting)
+        # does not cancel the call for everybody else
+        return await asyncio.shield(self.start(key, fn))
+
+    def start(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> "asyncio.Future":
+        """Starts `fn()` unless a call with the same key is already in flight, without
+        waiting for it
+
+        Returns
+        -------
+        asyncio.Future
+            The shared call
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        return task
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def _forget(self, key: Hashable, task: "asyncio.Future") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark exception as retrieved in case all callers went away
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._inflight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
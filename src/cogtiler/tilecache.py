@@ -0,0 +1,65 @@
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+
+class TileCache:
+    """In-memory LRU cache of tile bytes bounded by the total size of the cached tiles."""
+
+    def __init__(self, max_bytes: int = 0) -> None:
+        """_summary_
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            Maximum total number of bytes held by the cache. 0 disables the cache, by default 0
+        """
+        self.max_bytes = int(max_bytes)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._tiles: "OrderedDict[Hashable, bytes]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._tiles)
+
+    def __contains__(self, key: Hashable) -> bool:
+        # Does not count as a hit or miss, nor refresh the tile
+        return key in self._tiles
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        tile = self._tiles.get(key)
+        if tile is None:
+            self.misses += 1
+            return None
+        self._tiles.move_to_end(key)
+        self.hits += 1
+        return tile
+
+    def put(self, key: Hashable, tile: bytes) -> None:
+        # Tiles larger than the whole cache are never stored
+        if len(tile) > self.max_bytes:
+            return
+        old = self._tiles.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._tiles[key] = tile
+        self.size += len(tile)
+        while self.size > self.max_bytes:
+            _, evicted = self._tiles.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        self._tiles.clear()
+        self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._tiles),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
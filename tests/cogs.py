@@ -0,0 +1,93 @@
+"""Builds synthetic COGs for the tests and the benchmarks"""
+
+import struct
+import zlib
+
+import numpy as np
+
+
+def write_cog(levels, tile, bigtiff=False, compression=7):
+    """Returns a tiled (Big)TIFF with the header layout of GDAL: the IFDs of all levels,
+    then their TileOffsets and TileByteCounts arrays, then the tiles.
+
+    `levels` holds `(width, height, tiles, masks)` of the full resolution image and
+    each overview, with the tiles in row major order. `masks` is None or the deflate
+    compressed mask tiles of the level, which get their own IFD after the one of the
+    level and are stored right after their image tile, like in COGs written by GDAL"""
+    offset_format, offset_size, entry_size = ("Q", 8, 20) if bigtiff else ("L", 4, 12)
+    long_type = 16 if bigtiff else 4
+    dtype = np.uint64 if bigtiff else np.uint32
+    # (width, height, new subfile type, compression, tiles) of each IFD
+    ifds = []
+    for w, h, tiles, masks in levels:
+        ifds.append((w, h, 0, compression, tiles))
+        if masks is not None:
+            ifds.append((w, h, 4, 8, masks))
+    num_tags = [7 if subfile_type == 0 else 8 for _, _, subfile_type, _, _ in ifds]
+    first_ifd = 16 if bigtiff else 8
+    ifd_offsets = np.cumsum(
+        [first_ifd]
+        + [(8 if bigtiff else 2) + n * entry_size + offset_size for n in num_tags]
+    )
+    arrays_at = int(ifd_offsets[-1])
+    tiles_at = arrays_at + sum(2 * len(tiles) * offset_size for *_, tiles in ifds)
+
+    # Tiles of each level, followed by their mask when there is one
+    counts = [np.array([len(t) for t in tiles], np.int64) for *_, tiles in ifds]
+    offsets = []
+    data = []
+    pos = tiles_at
+    for w, h, tiles, masks in levels:
+        level_counts = counts[len(offsets)]
+        if masks is None:
+            offsets.append(pos + np.cumsum(level_counts) - level_counts)
+            pos += int(level_counts.sum())
+            data.extend(tiles)
+            continue
+        mask_counts = counts[len(offsets) + 1]
+        both = np.stack([level_counts, mask_counts], -1).ravel()
+        starts = (pos + np.cumsum(both) - both).reshape(-1, 2)
+        offsets.extend([starts[:, 0], starts[:, 1]])
+        pos += int(both.sum())
+        for tile_data, mask_data in zip(tiles, masks):
+            data += [tile_data, mask_data]
+
+    if bigtiff:
+        out = bytearray(b"II" + struct.pack("<HHHQ", 43, 8, 0, first_ifd))
+    else:
+        out = bytearray(b"II" + struct.pack("<HL", 42, first_ifd))
+
+    def entry(code, type_, count, value):
+        head = struct.pack("<HHQ" if bigtiff else "<HHL", code, type_, count)
+        return head + value.ljust(offset_size, b"\0")
+
+    arrays = bytearray()
+    for i, (w, h, subfile_type, ifd_compression, tiles) in enumerate(ifds):
+        n = len(tiles)
+        if n == 1:
+            # A single value is stored in the entry itself
+            offsets_value, counts_value = int(offsets[i][0]), int(counts[i][0])
+        else:
+            offsets_value = arrays_at + len(arrays)
+            counts_value = offsets_value + n * offset_size
+        arrays += offsets[i].astype(dtype).tobytes() + counts[i].astype(dtype).tobytes()
+        next_ifd = int(ifd_offsets[i + 1]) if i + 1 < len(ifds) else 0
+        out += struct.pack("<Q" if bigtiff else "<H", num_tags[i])
+        if subfile_type:
+            out += entry(254, 4, 1, struct.pack("<L", subfile_type))
+        out += entry(256, 4, 1, struct.pack("<L", w))
+        out += entry(257, 4, 1, struct.pack("<L", h))
+        out += entry(259, 3, 1, struct.pack("<H", ifd_compression))
+        out += entry(322, 3, 1, struct.pack("<H", tile))
+        out += entry(323, 3, 1, struct.pack("<H", tile))
+        for code, value in ((324, offsets_value), (325, counts_value)):
+            out += entry(code, long_type, n, struct.pack(f"<{offset_format}", value))
+        out += struct.pack(f"<{offset_format}", next_ifd)
+    out += arrays
+    out += b"".join(data)
+    return bytes(out)
+
+
+def mask_tile(tile):
+    """Returns a deflate compressed mask tile where all pixels are valid"""
+    return zlib.compress(np.full((tile, tile), 255, np.uint8).tobytes())
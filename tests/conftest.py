@@ -0,0 +1,181 @@
+import asyncio
+import json
+import os
+import re
+import sys
+import threading
+from collections import Counter
+
+import numpy as np
+import pytest
+
+# The app and aiocogdumper are imported the same way as when running from src/cogtiler
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "cogtiler"))
+
+from cogs import mask_tile, write_cog  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def tj():
+    from aiocogdumper.cog_tiles import get_turbojpeg
+
+    try:
+        return get_turbojpeg()
+    except OSError as e:
+        pytest.skip(f"libturbojpeg not available: {e}")
+
+
+def make_cog(
+    tj, width=1000, height=700, tile=256, levels=3, bigtiff=False, shift=0, masks=False
+):
+    """Returns a jpeg compressed, tiled (Big)TIFF with `levels` - 1 overviews and the
+    tiles of each level. The image is a gradient, shifted right by `shift` pixels. With
+    `masks`, each level has a mask stored right after each of its tiles"""
+    y, x = np.mgrid[0:height, 0:width]
+    x = x + shift
+    image = np.stack([x % 256, y % 256, (x + y) % 256], -1).astype(np.uint8)
+    ifds = []
+    for _ in range(levels):
+        h, w = image.shape[:2]
+        tiles = []
+        for ty in range(-(-h // tile)):
+            for tx in range(-(-w // tile)):
+                # Padding of edge tiles is not black, so masking can be seen
+                padded = np.full((tile, tile, 3), 200, np.uint8)
+                part = image[ty * tile : (ty + 1) * tile, tx * tile : (tx + 1) * tile]
+                padded[: part.shape[0], : part.shape[1]] = part
+                tiles.append(tj.encode(padded, quality=90))
+        ifds.append((w, h, tiles))
+        image = image[::2, ::2]
+    levels = [
+        (w, h, tiles, [mask_tile(tile)] * len(tiles) if masks else None)
+        for w, h, tiles in ifds
+    ]
+    return write_cog(levels, tile, bigtiff), ifds
+
+
+class Upstream:
+    """A http server of COGs in a thread, answering range requests like an object
+    store. Requests are counted per path and the ranges read and the request headers
+    are recorded. Paths may have several parts, like the path style urls of S3 objects.
+    Requests with the token `bad` are rejected. Responses are sent after `delay`
+    seconds. The next requests are answered with the statuses in `statuses` instead,
+    and with `cut` set responses are cut off after that many bytes"""
+
+    def __init__(self):
+        self.files = {}
+        self.requests = Counter()
+        self.ranges = []
+        self.headers = []
+        self.delay = 0
+        self.statuses = []
+        self.cut = None
+        self.url = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def start(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/{name:.+}", self._handle)
+        self._runner = web.AppRunner(app)
+        self._thread.start()
+        self._call(self._runner.setup())
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        self._call(site.start())
+        port = self._runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    def stop(self):
+        self._call(self._runner.cleanup())
+        self._call(self._cancel_handlers())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    async def _cancel_handlers(self):
+        # Like those still waiting to answer requests the client gave up on
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        name = request.match_info["name"]
+        self.requests[name] += 1
+        self.headers.append(request.headers)
+        if request.headers.get("token") == "bad":
+            raise web.HTTPForbidden(text="Invalid token")
+        if self.statuses:
+            return web.Response(status=self.statuses.pop(0), text="Failed")
+        data = self.files.get(name)
+        if data is None:
+            raise web.HTTPNotFound()
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", request.headers.get("Range", ""))
+        if match is None:
+            return web.Response(body=data)
+        start, stop = int(match[1]), min(int(match[2]), len(data) - 1)
+        self.ranges.append((name, start, stop))
+        await asyncio.sleep(self.delay)
+        headers = {
+            "Content-Range": f"bytes {start}-{stop}/{len(data)}",
+            "ETag": f'"{name}-{len(data)}"',
+            "Last-Modified": "Mon, 05 Oct 2026 10:00:00 GMT",
+        }
+        if self.cut is None:
+            return web.Response(
+                status=206, body=data[start : stop + 1], headers=headers
+            )
+        response = web.StreamResponse(status=206, headers=headers)
+        response.content_length = stop + 1 - start
+        await response.prepare(request)
+        await response.write(data[start : start + self.cut])
+        # Let the client receive the first bytes before the connection is lost
+        await asyncio.sleep(0.05)
+        request.transport.close()
+        return response
+
+
+@pytest.fixture
+def upstream():
+    server = Upstream()
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def app(monkeypatch, tj):
+    """Starts the app with the given settings (keyword arguments named like the
+    settings) and returns a TestClient of it"""
+    from fastapi.testclient import TestClient
+
+    from settings import get_settings
+
+    clients = []
+
+    def start(**settings):
+        for name, value in settings.items():
+            if not isinstance(value, str):
+                value = json.dumps(value)
+            monkeypatch.setenv(f"COGTILER_{name.upper()}", value)
+        get_settings.cache_clear()
+        # The app is set up when main is imported
+        sys.modules.pop("main", None)
+        import main
+
+        client = TestClient(main.app, raise_server_exceptions=False)
+        client.__enter__()
+        clients.append(client)
+        return client
+
+    yield start
+    for client in clients:
+        client.__exit__(None, None, None)
+    sys.modules.pop("main", None)
+    get_settings.cache_clear()
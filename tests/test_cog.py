@@ -0,0 +1,258 @@
+import asyncio
+
+import pytest
+
+from aiocogdumper.cog_tiles import Overflow
+from aiocogdumper.errors import HTTPError
+from build_header_index import main as build_header_index
+from cog import HttpCogClient, TileConditions
+from conftest import make_cog
+
+
+@pytest.fixture
+def cog_url(tj, upstream):
+    upstream.files["cog.tif"], _ = make_cog(tj)
+    return f"{upstream.url}/cog.tif"
+
+
+def run(client, coro):
+    async def main():
+        client.start()
+        try:
+            return await coro(client)
+        finally:
+            await client.stop()
+
+    return asyncio.run(main())
+
+
+def test_indexed_header_checks_token(tmp_path, upstream, cog_url):
+    catalogue = tmp_path / "cogs.txt"
+    catalogue.write_text(cog_url + "\n")
+    index = tmp_path / "headers.idx"
+    assert build_header_index([str(catalogue), "-o", str(index)]) == 0
+    upstream.requests.clear()
+
+    async def get_tiles(client):
+        cog = await client._get_cog(cog_url, {"token": "good"})
+        await client.get_tile_response(cog, 0, 0, 0, Overflow.Mask)
+        with pytest.raises(HTTPError) as error:
+            await client._get_cog(cog_url, {"token": "bad"})
+        assert error.value.status == 403
+        # The accepted token is checked once
+        await client._get_cog(cog_url, {"token": "good"})
+        return client.stats()
+
+    stats = run(
+        HttpCogClient(header_index=str(index), tile_cache_size=2**20), get_tiles
+    )
+    assert stats["header_index"]["hits"] == 2
+    assert stats["access_checks"]["checks"] == 1
+    # A check for each token and the tile
+    assert upstream.requests["cog.tif"] == 3
+
+
+def test_outdated_indexed_header_is_not_used(tmp_path, tj, upstream, cog_url):
+    catalogue = tmp_path / "cogs.txt"
+    catalogue.write_text(cog_url + "\n")
+    index = tmp_path / "headers.idx"
+    assert build_header_index([str(catalogue), "-o", str(index)]) == 0
+    upstream.files["cog.tif"], ifds = make_cog(tj, width=900, shift=100)
+
+    async def get_tile(client):
+        cog = await client._get_cog(cog_url)
+        response = await client.get_tile_response(cog, 0, 1, 1)
+        await asyncio.gather(*client._background_tasks)
+        return response.body, client.stats()
+
+    def restarted():
+        return HttpCogClient(
+            header_index=str(index),
+            disk_cache_dir=str(tmp_path / "cache"),
+            disk_cache_size=2**24,
+        )
+
+    tile, stats = run(restarted(), get_tile)
+    assert tile == ifds[0][2][1 * 4 + 1]
+    assert stats["header_index"]["hits"] == 1
+    assert stats["access_checks"] == {"checks": 1, "outdated_headers": 1}
+    # The header of the new file is then found in the disk cache
+    tile, stats = run(restarted(), get_tile)
+    assert tile == ifds[0][2][1 * 4 + 1]
+    assert stats["access_checks"] == {"checks": 2, "outdated_headers": 1}
+    assert stats["disk_cache"]["hits"] >= 1
+
+
+def test_local_copy_in_index_gets_upstream_validators(tmp_path, upstream, cog_url):
+    local = tmp_path / "cog.tif"
+    local.write_bytes(upstream.files["cog.tif"])
+    catalogue = tmp_path / "cogs.txt"
+    catalogue.write_text(f"{local} {cog_url}\n")
+    index = tmp_path / "headers.idx"
+    assert build_header_index([str(catalogue), "-o", str(index)]) == 0
+    upstream.requests.clear()
+
+    async def get_cog(client):
+        cog = await client._get_cog(cog_url)
+        return cog.etag, client.stats()
+
+    etag, stats = run(HttpCogClient(header_index=str(index)), get_cog)
+    assert etag == f'"cog.tif-{len(upstream.files["cog.tif"])}"'
+    assert stats["access_checks"] == {"checks": 1, "outdated_headers": 0}
+    assert upstream.requests["cog.tif"] == 1
+
+
+def test_shared_header_cache_checks_token(tmp_path, upstream, cog_url):
+    def worker():
+        return HttpCogClient(
+            shared_header_cache_dir=str(tmp_path), shared_header_cache_size=2**20
+        )
+
+    async def get_cog(client):
+        await client._get_cog(cog_url, {"token": "good"})
+        return client.stats()
+
+    async def get_cogs(client):
+        # The header read by the other worker is used for the same token only
+        await client._get_cog(cog_url, {"token": "good"})
+        with pytest.raises(HTTPError):
+            await client._get_cog(cog_url, {"token": "bad"})
+        return client.stats()
+
+    assert run(worker(), get_cog)["access_checks"]["checks"] == 0
+    assert run(worker(), get_cogs)["access_checks"]["checks"] == 1
+
+
+LAST_MODIFIED = "Mon, 05 Oct 2026 10:00:00 GMT"
+
+
+def conditions(if_none_match=None, if_modified_since=None):
+    # The defaults of the fields are only filled in by FastAPI
+    return TileConditions(
+        if_none_match=if_none_match, if_modified_since=if_modified_since
+    )
+
+
+@pytest.mark.parametrize(
+    "headers, not_modified",
+    [
+        ({}, False),
+        ({"if_none_match": '"abc"'}, True),
+        ({"if_none_match": 'W/"abc"'}, True),
+        ({"if_none_match": '"other", "abc"'}, True),
+        ({"if_none_match": "*"}, True),
+        ({"if_none_match": '"other"'}, False),
+        # If-Modified-Since is ignored when If-None-Match is sent
+        ({"if_none_match": '"other"', "if_modified_since": LAST_MODIFIED}, False),
+        ({"if_modified_since": LAST_MODIFIED}, True),
+        ({"if_modified_since": "Mon, 05 Oct 2026 09:59:59 GMT"}, False),
+        ({"if_modified_since": "yesterday"}, False),
+    ],
+)
+def test_tile_conditions(headers, not_modified):
+    assert conditions(**headers).not_modified('"abc"', LAST_MODIFIED) == not_modified
+
+
+def test_tile_conditions_without_validators():
+    assert not conditions(if_none_match="*").not_modified(None, None)
+    assert not conditions(if_modified_since=LAST_MODIFIED).not_modified('"abc"', None)
+
+
+def test_not_modified_tiles(upstream, cog_url):
+    async def get_tiles(client):
+        cog = await client._get_cog(cog_url)
+        response = await client.get_tile_response(cog, 0, 1, 1)
+        etag = response.headers["ETag"]
+        assert response.status_code == 200
+        assert response.headers["Last-Modified"] == LAST_MODIFIED
+        reads = upstream.requests["cog.tif"]
+
+        cached = await client.get_tile_response(
+            cog, 0, 1, 1, conditions=conditions(if_none_match=etag)
+        )
+        assert cached.status_code == 304
+        assert cached.body == b""
+        assert cached.headers["ETag"] == etag
+        # Answered without reading the tile
+        assert upstream.requests["cog.tif"] == reads
+
+        other = await client.get_tile_response(
+            cog, 0, 1, 1, Overflow.Mask, conditions=conditions(if_none_match=etag)
+        )
+        assert other.status_code == 200
+        assert other.headers["ETag"] != etag
+
+    run(HttpCogClient(), get_tiles)
+
+
+def test_weak_upstream_etag_gives_weak_tile_etags(upstream, cog_url):
+    async def get_tile(client):
+        cog = await client._get_cog(cog_url)
+        cog.etag = 'W/"weak"'
+        return await client.get_tile_response(cog, 0, 0, 0)
+
+    assert run(HttpCogClient(), get_tile).headers["ETag"].startswith('W/"')
+
+
+def test_no_validators_without_upstream_validators(upstream, cog_url):
+    async def get_tile(client):
+        cog = await client._get_cog(cog_url)
+        cog.etag = cog.last_modified = None
+        return await client.get_tile_response(
+            cog, 0, 0, 0, conditions=conditions(if_none_match="*")
+        )
+
+    response = run(HttpCogClient(), get_tile)
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+
+
+def test_replaced_cog_is_not_served_from_disk_cache(tmp_path, tj, upstream, cog_url):
+    def restarted():
+        return HttpCogClient(disk_cache_dir=str(tmp_path), disk_cache_size=2**24)
+
+    async def get_tile(client):
+        cog = await client._get_cog(cog_url)
+        response = await client.get_tile_response(cog, 0, 1, 1)
+        # Wait for the disk cache writes
+        await asyncio.gather(*client._background_tasks)
+        return response.body, client.stats()
+
+    tile, _ = run(restarted(), get_tile)
+    # Replaced by a COG with other tile offsets and another ETag
+    upstream.files["cog.tif"], ifds = make_cog(tj, width=900, shift=100)
+    assert tile != ifds[0][2][1 * 4 + 1]
+
+    tile, stats = run(restarted(), get_tile)
+    assert tile == ifds[0][2][1 * 4 + 1]
+    assert stats["access_checks"] == {"checks": 1, "outdated_headers": 1}
+    # The new header replaced the outdated one
+    tile, stats = run(restarted(), get_tile)
+    assert stats["access_checks"] == {"checks": 1, "outdated_headers": 0}
+    assert stats["disk_cache"]["hits"] == 2
+
+
+@pytest.mark.parametrize("tile_cache_size", [0, 2**20], ids=["uncached", "cached"])
+def test_streamed_tile_is_only_kept_when_cached(tj, upstream, tile_cache_size):
+    upstream.files["cog.tif"], ifds = make_cog(tj)
+    stored = []
+
+    async def stream_tile(client):
+        client._store_tile = lambda cog, key, tilebytes: stored.append(tilebytes)
+        cog = await client._get_cog(f"{upstream.url}/cog.tif")
+        response = await client.get_tile_response(cog, 0, 1, 1)
+        in_flight = (cog.source, 0, 1, 1, Overflow.Pad) in client.tile_flight
+        tile = b"".join([chunk async for chunk in response.body_iterator])
+        await asyncio.gather(*client._background_tasks)
+        return tile, in_flight
+
+    client = HttpCogClient(tile_cache_size=tile_cache_size, stream_tiles=True)
+    tile, in_flight = run(client, stream_tile)
+    assert tile == ifds[0][2][1 * 4 + 1]
+    if tile_cache_size:
+        # Concurrent requests wait for the tile, which is joined for the cache
+        assert in_flight
+        assert stored == [tile]
+    else:
+        assert not in_flight
+        assert stored == []
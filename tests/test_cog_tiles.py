@@ -0,0 +1,262 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from aiocogdumper import cog_tiles
+from aiocogdumper.cog_tiles import COGTiff, Overflow
+from aiocogdumper.errors import TIFFError
+from conftest import make_cog
+from tilecache import TileCache
+
+
+class BytesReader:
+    """Reads a file held in memory and records the reads"""
+
+    def __init__(self, data):
+        self.data = data
+        self.reads = []
+
+    async def read(self, offset, length):
+        self.reads.append((offset, length))
+        return self.data[offset : offset + length]
+
+    async def stream(self, offset, length, chunk_size=1000):
+        self.reads.append((offset, length))
+        for start in range(offset, offset + length, chunk_size):
+            yield self.data[start : min(start + chunk_size, offset + length)]
+
+
+@pytest.fixture(scope="module", params=[False, True], ids=["tiff", "bigtiff"])
+def small_cog(request, tj):
+    return make_cog(tj, bigtiff=request.param)
+
+
+@pytest.fixture(scope="module")
+def many_tiles(tj):
+    # 4096 tiles in the full resolution image, so its tile arrays are 32 KiB
+    return make_cog(tj, width=4096, height=4096, tile=64, levels=2)
+
+
+def test_parses_ifds(small_cog):
+    data, ifds = small_cog
+    reader = BytesReader(data)
+    cog = COGTiff(reader.read)
+    asyncio.run(cog.read_header())
+
+    assert len(reader.reads) == 1
+    assert len(cog._image_ifds) == len(ifds)
+    assert cog._mask_ifds == []
+    for ifd, (width, height, tiles) in zip(cog._image_ifds, ifds):
+        assert (ifd.image_width, ifd.image_height) == (width, height)
+        assert (ifd.tile_width, ifd.tile_height) == (256, 256)
+        assert ifd.compression == "image/jpeg"
+        assert ifd.nx_tiles * ifd.ny_tiles == len(tiles)
+        assert isinstance(ifd.offsets, np.ndarray)
+        for i, tile in enumerate(tiles):
+            offset, count = int(ifd.offsets[i]), int(ifd.byte_counts[i])
+            assert data[offset : offset + count] == tile
+    # The raw header is released after parsing
+    assert len(cog.header) == 0
+
+
+def test_get_tile(small_cog):
+    data, ifds = small_cog
+    cog = COGTiff(BytesReader(data).read)
+
+    async def get_tiles():
+        return [
+            await cog.get_tile(1, 1, 0),
+            await cog.get_tile(0, 0, 2, Overflow.Pad),
+        ]
+
+    (mime_type, tile), (_, last) = asyncio.run(get_tiles())
+    assert mime_type == "image/jpeg"
+    assert tile == ifds[0][2][1 * 4 + 1]
+    assert last == ifds[2][2][0]
+    with pytest.raises(TIFFError):
+        asyncio.run(cog.get_tile(4, 0, 0))
+    with pytest.raises(TIFFError):
+        asyncio.run(cog.get_tile(0, 0, 3))
+
+
+@pytest.fixture(scope="module")
+def masked_cog(tj):
+    return make_cog(tj, masks=True)
+
+
+def test_tile_and_close_mask_are_not_streamed(masked_cog):
+    data, ifds = masked_cog
+    reader = BytesReader(data)
+    cog = COGTiff(reader.read, stream=reader.stream)
+
+    async def get_tile():
+        assert await cog.stream_tile(1, 1, 0) is None
+        return await cog.get_tile(1, 1, 0)
+
+    _, tile = asyncio.run(get_tile())
+    assert tile.startswith(ifds[0][2][1 * 4 + 1])
+    # The tile is read with its mask in a single read
+    image, mask = cog._image_ifds[0], cog._mask_ifds[0]
+    offset = int(image.offsets[1 * 4 + 1])
+    length = int(image.byte_counts[1 * 4 + 1]) + int(mask.byte_counts[1 * 4 + 1])
+    assert reader.reads[1:] == [(offset, length)]
+
+
+def test_tile_and_far_mask_are_streamed(masked_cog):
+    data, ifds = masked_cog
+    reader = BytesReader(data)
+    # Too long to be read in a single read
+    cog = COGTiff(reader.read, max_merged_bytes=100, stream=reader.stream)
+
+    async def stream_tile():
+        _, size, chunks = await cog.stream_tile(1, 1, 0)
+        return size, [chunk async for chunk in chunks]
+
+    size, chunks = asyncio.run(stream_tile())
+    _, tile = asyncio.run(cog.get_tile(1, 1, 0))
+    assert b"".join(chunks) == tile
+    assert tile.startswith(ifds[0][2][1 * 4 + 1])
+    assert size == len(tile)
+    assert len(chunks) > 2
+
+
+def test_processed_edge_tiles_are_cached(small_cog):
+    data, _ = small_cog
+    reader = BytesReader(data)
+    cache = TileCache(2**24)
+    cog = COGTiff(reader.read, source="cog.tif", edge_tile_cache=cache)
+
+    async def get_tiles():
+        return [
+            await cog.get_tile(3, 0, 0, Overflow.Mask),
+            await cog.get_tile(1, 1, 0, Overflow.Mask),
+            await cog.get_tile(3, 0, 0, Overflow.Mask),
+            await cog.get_tile(3, 0, 0, Overflow.Crop),
+        ]
+
+    masked, _, again, cropped = asyncio.run(get_tiles())
+    assert again == masked
+    assert cropped != masked
+    # Only edge tiles are kept, per overflow, and a cached tile is not read again
+    assert set(cache._tiles) == {
+        ("cog.tif", 0, 3, 0, Overflow.Mask),
+        ("cog.tif", 0, 3, 0, Overflow.Crop),
+    }
+    assert len(reader.reads) == 4
+    # Processed like without the cache
+    _, uncached = asyncio.run(COGTiff(reader.read).get_tile(3, 0, 0, Overflow.Mask))
+    assert masked[1] == uncached
+
+
+def test_warm_edge_tiles(small_cog):
+    data, _ = small_cog
+    reader = BytesReader(data)
+    cache = TileCache(2**24)
+    cog = COGTiff(reader.read, source="cog.tif", edge_tile_cache=cache)
+    asyncio.run(cog.warm_edge_tiles(2))
+    # The single tile of the last overview and the right and bottom tiles of the one
+    # before, for both overflows which process edge tiles
+    edges = [(2, 0, 0), (1, 1, 0), (1, 1, 1), (1, 0, 1)]
+    assert set(cache._tiles) == {
+        ("cog.tif", z, x, y, overflow)
+        for z, x, y in edges
+        for overflow in (Overflow.Mask, Overflow.Crop)
+    }
+    reads = len(reader.reads)
+    for z, x, y in edges:
+        _, tile = asyncio.run(cog.get_tile(x, y, z, Overflow.Crop))
+        assert tile == cache.get(("cog.tif", z, x, y, Overflow.Crop))
+    assert len(reader.reads) == reads
+
+
+def test_warm_edge_tiles_without_cache(small_cog):
+    data, _ = small_cog
+    reader = BytesReader(data)
+    asyncio.run(
+        COGTiff(reader.read, edge_tile_cache=TileCache(2**24)).warm_edge_tiles()
+    )
+    # Without a source tiles cannot be cached, so nothing but the header is read
+    assert len(reader.reads) == 1
+
+
+def test_truncated_header_raises(small_cog):
+    data, _ = small_cog
+    cog = COGTiff(BytesReader(data[:200]).read, header_bytes=64)
+    with pytest.raises(TIFFError):
+        asyncio.run(cog.read_header())
+
+
+def test_header_read_ahead_is_bounded(monkeypatch, many_tiles):
+    data, ifds = many_tiles
+    monkeypatch.setattr(cog_tiles, "MAX_HEADER_READ_AHEAD", 256)
+    reader = BytesReader(data)
+    cog = COGTiff(reader.read, header_bytes=64)
+    asyncio.run(cog.read_header())
+
+    assert [len(ifd.offsets) for ifd in cog._image_ifds] == [4096, 1024]
+    assert cog.header_reads == len(reader.reads) > 1
+    # Each read covers the missing bytes and at most 256 bytes more
+    assert cog.header_bytes_read <= cog.header_size + 256 * cog.header_reads
+
+
+def test_turbojpeg_instance_per_thread(tj):
+    assert cog_tiles.get_turbojpeg() is tj
+    with ThreadPoolExecutor(1) as pool:
+        other = pool.submit(cog_tiles.get_turbojpeg).result()
+    assert other is not tj
+
+
+def test_lazy_tile_arrays_read_one_chunk(many_tiles):
+    data, ifds = many_tiles
+    reader = BytesReader(data)
+    cog = COGTiff(reader.read, lazy_tile_arrays=True, header_bytes=1024)
+    asyncio.run(cog.read_header())
+    offsets = cog._image_ifds[0].offsets
+    assert isinstance(offsets, cog_tiles.TileArray)
+    assert len(offsets) == 4096
+    header_reads = len(reader.reads)
+
+    async def get_tiles():
+        # Tiles of the same chunk share its read
+        return await asyncio.gather(
+            cog.get_tile(2, 20, 0), cog.get_tile(3, 20, 0), cog.get_tile(4, 20, 0)
+        )
+
+    tiles = asyncio.run(get_tiles())
+    assert [tile for _, tile in tiles] == ifds[0][2][20 * 64 + 2 : 20 * 64 + 5]
+    chunk_reads = reader.reads[header_reads:-3]
+    # A chunk of the offsets and of the byte counts
+    assert len(chunk_reads) == 2
+    assert all(length <= cog_tiles.TILE_ARRAY_CHUNK_BYTES for _, length in chunk_reads)
+
+
+def test_lazy_tile_arrays_in_header_bytes_are_read_right_away(small_cog):
+    data, _ = small_cog
+    cog = COGTiff(BytesReader(data).read, lazy_tile_arrays=True)
+    asyncio.run(cog.read_header())
+    assert all(isinstance(ifd.offsets, np.ndarray) for ifd in cog._image_ifds)
+
+
+def test_tile_array_failed_read_is_not_kept():
+    data = np.arange(100, dtype="<u4").tobytes()
+    reads = []
+
+    async def read(offset, length):
+        reads.append(offset)
+        # The first read is cut short
+        return data[offset : offset + length - (4 if len(reads) == 1 else 0)]
+
+    array = cog_tiles.TileArray(read, 0, 100, "<u4", chunk_bytes=64)
+
+    async def get(idx):
+        return await array.get(idx)
+
+    with pytest.raises(TIFFError):
+        asyncio.run(get(20))
+    assert asyncio.run(get(20)) == 20
+    assert asyncio.run(get(31)) == 31
+    assert reads == [64, 64]
+    with pytest.raises(TIFFError):
+        asyncio.run(get(100))
@@ -0,0 +1,78 @@
+import asyncio
+import multiprocessing
+import os
+import time
+
+from cog import HttpCogClient
+from conftest import make_cog
+from diskcache import DiskCache
+
+
+def test_lock_is_per_key(tmp_path):
+    cache = DiskCache(str(tmp_path), 2**20)
+
+    async def hold(key, held, release):
+        async with cache.lock(key):
+            held.set()
+            await release.wait()
+
+    async def main():
+        held, release = asyncio.Event(), asyncio.Event()
+        holder = asyncio.create_task(hold("a", held, release))
+        await held.wait()
+        # Another key is not blocked by the held lock
+        started = time.monotonic()
+        async with cache.lock("b", timeout=1):
+            pass
+        assert time.monotonic() - started < 0.5
+        waiter = asyncio.create_task(hold("a", asyncio.Event(), asyncio.Event()))
+        await asyncio.sleep(0.1)
+        assert not waiter.done()
+        release.set()
+        await holder
+        waiter.cancel()
+
+    asyncio.run(main())
+    # Lock files are removed when released
+    assert os.listdir(tmp_path / ".locks") == []
+
+
+def open_cog(url, directory, barrier):
+    async def main():
+        client = HttpCogClient(
+            shared_header_cache_dir=directory, shared_header_cache_size=2**20
+        )
+        client.start()
+        try:
+            barrier.wait()
+            await client._get_cog(url)
+        finally:
+            await client.stop()
+
+    asyncio.run(main())
+
+
+def test_header_is_read_once_by_all_workers(tmp_path, tj, upstream):
+    upstream.files["cog.tif"], _ = make_cog(tj)
+    # Long enough for all workers to ask for the header while it is read
+    upstream.delay = 0.5
+    context = multiprocessing.get_context("spawn")
+    workers = 4
+    barrier = context.Barrier(workers)
+    processes = [
+        context.Process(
+            target=open_cog,
+            args=(f"{upstream.url}/cog.tif", str(tmp_path), barrier),
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    # Workers using the shared header only check that they can read the COG
+    header_reads = [r for r in upstream.ranges if r[2] - r[1] > 0]
+    assert len(header_reads) == 1
+    assert len(upstream.ranges) == workers
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from aiocogdumper.filedumper import FilePool, Reader
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i in range(4):
+        path = tmp_path / f"{i}.tif"
+        path.write_bytes(bytes(range(i, i + 100)))
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("use_mmap", [False, True], ids=["pread", "mmap"])
+def test_reads(files, use_mmap):
+    pool = FilePool(use_mmap=use_mmap)
+
+    async def read():
+        return [
+            await pool.read(files[1], 10, 5),
+            # Past the end of the file
+            await pool.read(files[1], 95, 10),
+            await pool.read_many(files[1], [(0, 2), (50, 3)]),
+        ]
+
+    try:
+        assert asyncio.run(read()) == [
+            bytes(range(11, 16)),
+            bytes(range(96, 101)),
+            [bytes([1, 2]), bytes([51, 52, 53])],
+        ]
+        assert (pool._files[files[1]].mmap is not None) == use_mmap
+        assert pool.stats()["reads"] == 4
+    finally:
+        pool.close()
+
+
+def test_least_recently_used_files_are_closed(files):
+    pool = FilePool(max_open=2)
+
+    async def read(*indices):
+        for i in indices:
+            await pool.read(files[i], 0, 1)
+
+    asyncio.run(read(0, 1, 0, 2))
+    assert list(pool._files) == [files[0], files[2]]
+    assert pool.stats()["evictions"] == 1
+    asyncio.run(read(3))
+    assert list(pool._files) == [files[2], files[3]]
+    assert (pool.opens, pool.evictions) == (4, 2)
+    pool.close()
+    assert pool.stats()["open"] == 0
+
+
+def test_files_being_read_are_not_closed(files):
+    pool = FilePool(max_open=1)
+
+    async def read():
+        # Both files are open until their reads are done
+        reads = [pool.read(files[0], 0, 10), pool.read(files[1], 0, 10)]
+        return await asyncio.gather(*reads)
+
+    assert asyncio.run(read()) == [bytes(range(10)), bytes(range(1, 11))]
+    assert pool.stats()["open"] == 1
+    pool.close()
+
+
+def test_stat_keeps_the_limit(files):
+    pool = FilePool(max_open=1)
+
+    async def stat():
+        # While a file is being read
+        f = await pool._acquire(files[0])
+        try:
+            return (await pool.stat(files[1])).st_size
+        finally:
+            f.users -= 1
+
+    assert asyncio.run(stat()) == 100
+    # The file opened by stat is closed right away
+    assert list(pool._files) == [files[0]]
+    pool.close()
+
+
+def test_reader_validators(files):
+    pool = FilePool()
+    reader = Reader(files[0], pool)
+    assert asyncio.run(reader.read(0, 4)) == bytes(range(4))
+    assert reader.etag.startswith('"') and reader.last_modified.endswith("GMT")
+    etag = reader.etag
+    other = Reader(files[1], pool)
+    asyncio.run(other.read(0, 1))
+    assert other.etag != etag
+    pool.close()
@@ -0,0 +1,65 @@
+from headerprefetch import HeaderPrefetch
+
+
+def test_unknown_prefix_and_host():
+    prefetch = HeaderPrefetch()
+    assert prefetch.initial_bytes("http://a.com/cogs/1.tif") is None
+    prefetch.record("http://a.com/cogs/1.tif", 10_000, 1, 16384)
+    assert prefetch.initial_bytes("http://b.com/cogs/1.tif") is None
+
+
+def test_percentile_of_prefix_then_host():
+    prefetch = HeaderPrefetch(percentile=50)
+    for size in (5_000, 9_000, 20_000):
+        prefetch.record("http://a.com/small/x.tif", size, 1, 16384)
+    prefetch.record("http://a.com/large/x.tif", 100_000, 2, 120_000)
+    # Nearest rank median of the prefix, rounded up to whole blocks
+    assert prefetch.initial_bytes("http://a.com/small/y.tif") == 12288
+    assert prefetch.initial_bytes("http://a.com/large/y.tif") == 102400
+    # Other prefixes of the host use all sizes seen for the host
+    assert prefetch.initial_bytes("http://a.com/other/y.tif") == 12288
+
+
+def test_initial_bytes_are_bounded():
+    prefetch = HeaderPrefetch(max_bytes=65536)
+    prefetch.record("http://a.com/large/x.tif", 1_000_000, 3, 1_000_000)
+    prefetch.record("http://a.com/tiny/x.tif", 100, 1, 16384)
+    assert prefetch.initial_bytes("http://a.com/large/y.tif") == 65536
+    assert prefetch.initial_bytes("http://a.com/tiny/y.tif") == 4096
+
+
+def test_recent_sizes_and_keys_are_kept():
+    prefetch = HeaderPrefetch(percentile=100, max_keys=4)
+    for _ in range(HeaderPrefetch.samples):
+        prefetch.record("http://a.com/cogs/x.tif", 8192, 1, 8192)
+    assert prefetch.initial_bytes("http://a.com/cogs/x.tif") == 8192
+    # Older sizes are dropped
+    prefetch.record("http://a.com/cogs/x.tif", 3 * 8192, 1, 8192)
+    assert prefetch.initial_bytes("http://a.com/cogs/x.tif") == 3 * 8192
+    for host in ("b.com", "c.com"):
+        prefetch.record(f"http://{host}/cogs/x.tif", 8192, 1, 8192)
+    # The least recently used prefix and host are forgotten
+    assert prefetch.stats()["keys"] == 4
+    assert prefetch.initial_bytes("http://a.com/cogs/x.tif") is None
+
+
+def test_disabled():
+    prefetch = HeaderPrefetch(percentile=0)
+    prefetch.record("http://a.com/cogs/x.tif", 8192, 1, 16384)
+    assert prefetch.initial_bytes("http://a.com/cogs/x.tif") is None
+    assert prefetch.stats()["headers"] == 1
+
+
+def test_stats():
+    prefetch = HeaderPrefetch()
+    prefetch.record("http://a.com/cogs/1.tif", 10_000, 1, 16384)
+    prefetch.record("http://a.com/cogs/2.tif", 50_000, 3, 65536)
+    assert prefetch.stats() == {
+        "keys": 2,
+        "headers": 2,
+        "reads": 4,
+        "extra_round_trips": 2,
+        "headers_with_extra_round_trips": 1,
+        "bytes_read": 16384 + 65536,
+        "bytes_needed": 60_000,
+    }
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from hedging import HedgedReader, Hedger
+
+
+class SlowReader:
+    """Reader whose reads (and streams until their first chunk) take the next of
+    `latencies` seconds. Reads return which of them they were"""
+
+    def __init__(self, *latencies):
+        self.latencies = list(latencies)
+        self.started = 0
+        self.cancelled = 0
+        self.closed = 0
+
+    async def read(self, offset, length):
+        n = self.started
+        self.started += 1
+        try:
+            await asyncio.sleep(self.latencies[n])
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return n
+
+    async def stream(self, offset, length):
+        n = self.started
+        self.started += 1
+        try:
+            await asyncio.sleep(self.latencies[n])
+            yield f"stream {n}".encode()
+            yield b" end"
+        finally:
+            self.closed += 1
+
+
+def warmed_up(**kwargs):
+    """Returns a Hedger with enough recorded latencies of 10 ms to hedge"""
+    hedger = Hedger(**kwargs)
+    hedger._latencies.extend([0.01] * Hedger.min_samples)
+    return hedger
+
+
+def test_delay_is_a_percentile_of_recent_latencies():
+    hedger = Hedger(percentile=90, min_delay=0.005)
+    hedger._latencies.extend([0.001 * i for i in range(1, Hedger.min_samples)])
+    assert hedger.delay() is None
+    hedger._latencies.append(0.016)
+    assert hedger.delay() == pytest.approx(0.015)
+    hedger.min_delay = 0.1
+    assert hedger.delay() == 0.1
+
+
+def test_slow_read_is_hedged_and_loser_cancelled():
+    hedger = warmed_up(percentile=50, budget=1)
+    reader = SlowReader(5, 0)
+
+    async def main():
+        result = await HedgedReader(reader, hedger).read(0, 10)
+        # Let the cancellation reach the slow read
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == 1
+    assert reader.cancelled == 1
+    assert hedger.stats()["hedged"] == hedger.stats()["wins"] == 1
+
+
+def test_fast_read_is_not_hedged():
+    hedger = warmed_up(percentile=50, budget=1)
+    reader = SlowReader(0)
+    assert asyncio.run(HedgedReader(reader, hedger).read(0, 10)) == 0
+    assert reader.started == 1
+    assert hedger.stats()["hedged"] == 0
+
+
+def test_hedges_are_limited_by_the_budget():
+    # Each read earns half a hedge
+    hedger = warmed_up(percentile=50, budget=0.5)
+    reader = SlowReader(0.05, 0.05, 0)
+
+    async def main():
+        hedged = HedgedReader(reader, hedger)
+        return [await hedged.read(0, 10), await hedged.read(0, 10)]
+
+    # The first read waits for the slow read, the second is hedged
+    assert asyncio.run(main()) == [0, 2]
+    stats = hedger.stats()
+    assert (stats["hedged"], stats["budget_exhausted"]) == (1, 1)
+    assert stats["hedge_rate"] == 0.5
+
+
+def test_disabled_hedger_does_not_hedge():
+    hedger = warmed_up(percentile=0)
+    reader = SlowReader(0.05)
+    assert asyncio.run(HedgedReader(reader, hedger).read(0, 10)) == 0
+    assert reader.started == 1
+
+
+def test_stream_is_hedged_until_its_first_chunk():
+    hedger = warmed_up(percentile=50, budget=1)
+    reader = SlowReader(5, 0)
+
+    async def main():
+        return [chunk async for chunk in HedgedReader(reader, hedger).stream(0, 10)]
+
+    assert asyncio.run(main()) == [b"stream 1", b" end"]
+    # Both streams are closed, the slow one before its first chunk
+    assert reader.closed == 2
+    assert hedger.stats()["wins"] == 1
@@ -0,0 +1,50 @@
+import asyncio
+
+import aiohttp
+
+from httppool import HttpPool
+
+
+def get(pool, url, n, concurrent=False):
+    async def fetch(session):
+        async with session.get(url, headers={"Range": "bytes=0-9"}) as response:
+            await response.read()
+
+    async def run():
+        async with pool.session(aiohttp.ClientTimeout(total=5)) as session:
+            if concurrent:
+                await asyncio.gather(*(fetch(session) for _ in range(n)))
+            else:
+                for _ in range(n):
+                    await fetch(session)
+            return pool.stats()
+
+    return asyncio.run(run())
+
+
+def test_connections_are_reused(upstream):
+    upstream.files["a.tif"] = bytes(100)
+    stats = get(HttpPool(), f"{upstream.url}/a.tif", 3)
+    assert (stats["created"], stats["reused"], stats["queued"]) == (1, 2, 0)
+    assert (stats["open"], stats["idle"], stats["waiting"]) == (1, 1, 0)
+
+
+def test_requests_queue_at_the_host_limit(upstream):
+    upstream.files["a.tif"] = bytes(100)
+    upstream.delay = 0.05
+    stats = get(HttpPool(limit_per_host=1), f"{upstream.url}/a.tif", 3, True)
+    assert (stats["created"], stats["reused"], stats["queued"]) == (1, 2, 2)
+    assert stats["limit_per_host"] == 1
+
+
+def test_without_keepalive_connections_are_closed(upstream):
+    upstream.files["a.tif"] = bytes(100)
+    stats = get(HttpPool(keepalive_timeout=0), f"{upstream.url}/a.tif", 3)
+    assert (stats["created"], stats["reused"]) == (3, 0)
+    assert stats["idle"] == 0
+
+
+def test_stats_without_session():
+    stats = HttpPool(limit=10).stats()
+    assert stats["limit"] == 10
+    assert (stats["open"], stats["created"]) == (0, 0)
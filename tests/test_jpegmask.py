@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+turbojpeg = pytest.importorskip("turbojpeg")
+
+from aiocogdumper.cog_tiles import (  # noqa: E402
+    mask_padded_jpeg,
+    mask_padded_jpeg_dct,
+)
+
+SIZE = 256
+
+
+def encode(tj, subsample):
+    y, x = np.mgrid[0:SIZE, 0:SIZE]
+    image = np.stack([(x + y) % 256, (3 * x) % 256, 255 - y], -1).astype(np.uint8)
+    if subsample == turbojpeg.TJSAMP_GRAY:
+        return tj.encode(
+            image[:, :, :1].copy(),
+            quality=90,
+            jpeg_subsample=subsample,
+            pixel_format=turbojpeg.TJPF_GRAY,
+        )
+    return tj.encode(image, quality=90, jpeg_subsample=subsample)
+
+
+def luma(pixels):
+    pixels = pixels.astype(float)
+    if pixels.shape[-1] == 1:
+        return pixels[..., 0]
+    # BGR
+    return pixels @ [0.114, 0.587, 0.299]
+
+
+@pytest.mark.parametrize(
+    "subsample",
+    [turbojpeg.TJSAMP_GRAY, turbojpeg.TJSAMP_444, turbojpeg.TJSAMP_420],
+    ids=["gray", "444", "420"],
+)
+@pytest.mark.parametrize("offset", range(8))
+@pytest.mark.parametrize("edge", ["cols", "rows", "both"])
+def test_dct_mask_matches_pixel_mask(tj, subsample, offset, edge):
+    jpeg = encode(tj, subsample)
+    # Edges in the last block row and column of the tile, like those of edge tiles
+    from_row = SIZE - 8 + offset if edge != "cols" else SIZE
+    from_col = SIZE - 8 + offset if edge != "rows" else SIZE
+
+    dct = luma(tj.decode(mask_padded_jpeg_dct(jpeg, SIZE, SIZE, from_row, from_col)))
+    pixel = luma(tj.decode(mask_padded_jpeg(jpeg, SIZE, SIZE, from_row, from_col)))
+
+    masked = np.zeros(dct.shape, bool)
+    masked[from_row:, :] = True
+    masked[:, from_col:] = True
+    # Masked pixels are black up to the ringing of jpeg and the chroma shared with kept
+    # pixels when subsampled
+    assert dct[masked].max() < 64
+    assert np.abs(dct[masked] - pixel[masked]).mean() < 32
+    # Kept pixels are those of the image
+    assert np.abs(dct[~masked] - pixel[~masked]).mean() < 6
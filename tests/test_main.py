@@ -0,0 +1,124 @@
+import pytest
+
+from conftest import make_cog
+
+
+@pytest.mark.parametrize("url", ["s3://bkt", "s3://bkt/"])
+def test_s3_url_without_key_is_rejected(app, url):
+    response = app(s3_buckets=["bkt"]).get("/info", params={"url": url})
+    assert response.status_code == 400
+
+
+def test_s3_url_of_other_bucket_is_rejected(app):
+    response = app(s3_buckets=["bkt"]).get("/info", params={"url": "s3://other/a.tif"})
+    assert response.status_code == 403
+
+
+def multipart(response):
+    """Returns the bytes of each part of a multipart response by its Content-Location"""
+    boundary = response.headers["Content-Type"].split("boundary=")[1]
+    parts = {}
+    for part in response.content.split(f"--{boundary}".encode())[1:-1]:
+        head, body = part.split(b"\r\n\r\n", 1)
+        headers = dict(line.split(": ", 1) for line in head.decode().split("\r\n")[1:])
+        assert headers["Content-Type"] == "image/jpeg"
+        assert body.endswith(b"\r\n")
+        parts[headers["Content-Location"]] = body[:-2]
+        assert len(parts[headers["Content-Location"]]) == int(headers["Content-Length"])
+    return parts
+
+
+def test_tile_batch(app, tj, upstream):
+    upstream.files["cog.tif"], ifds = make_cog(tj)
+    client = app()
+    tiles = [
+        {"z": 2, "x": 1, "y": 1},
+        {"z": 2, "x": 2, "y": 1},
+        {"z": 0, "x": 0, "y": 0},
+    ]
+    response = client.post(
+        "/tiles/batch",
+        params={"url": f"{upstream.url}/cog.tif"},
+        json={"tiles": tiles},
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("multipart/mixed; boundary=")
+    parts = multipart(response)
+    assert set(parts) == {"tiles/2/1/1.jpg", "tiles/2/2/1.jpg", "tiles/0/0/0.jpg"}
+    assert parts["tiles/2/1/1.jpg"] == ifds[0][2][1 * 4 + 1]
+    assert parts["tiles/2/2/1.jpg"] == ifds[0][2][1 * 4 + 2]
+    # The edge tile is masked like with /tiles
+    single = client.get("/tiles/0/0/0.jpg", params={"url": f"{upstream.url}/cog.tif"})
+    assert parts["tiles/0/0/0.jpg"] == single.content
+
+
+def test_tile_batch_is_limited(app, tj, upstream):
+    upstream.files["cog.tif"], _ = make_cog(tj)
+    response = app(batch_max_tiles=2).post(
+        "/tiles/batch",
+        params={"url": f"{upstream.url}/cog.tif"},
+        json={"tiles": [{"z": 2, "x": x, "y": 0} for x in range(3)]},
+    )
+    assert response.status_code == 400
+    assert "At most 2 tiles" in response.json()["detail"]
+
+
+@pytest.mark.parametrize(
+    "tile",
+    [{"z": 3, "x": 0, "y": 0}, {"z": -1, "x": 0, "y": 0}, {"z": 2, "x": 4, "y": 0}]
+    + [{"z": 2, "x": 0, "y": 3}, {"z": 1, "x": -1, "y": 0}],
+)
+def test_tile_batch_out_of_bounds(app, tj, upstream, tile):
+    upstream.files["cog.tif"], _ = make_cog(tj)
+    response = app().post(
+        "/tiles/batch",
+        params={"url": f"{upstream.url}/cog.tif"},
+        json={"tiles": [{"z": 2, "x": 0, "y": 0}, tile]},
+    )
+    assert response.status_code == 400
+    assert f"tiles/{tile['z']}/{tile['x']}/{tile['y']}.jpg" in response.json()["detail"]
+
+
+@pytest.fixture
+def file_root(tmp_path, tj):
+    root = tmp_path / "cogs"
+    root.mkdir()
+    (root / "cog.tif").write_bytes(make_cog(tj)[0])
+    (tmp_path / "secret.tif").write_bytes(make_cog(tj)[0])
+    (root / "link.tif").symlink_to(tmp_path / "secret.tif")
+    return root
+
+
+def test_file_url_in_file_root(app, file_root):
+    response = app(file_root=str(file_root)).get(
+        "/info", params={"url": (file_root / "cog.tif").as_uri()}
+    )
+    assert response.status_code == 200
+    assert response.json()["width"] == 1000
+
+
+@pytest.mark.parametrize(
+    "path", ["../secret.tif", "link.tif", "%2E%2E/secret.tif", "missing.tif"]
+)
+def test_file_url_outside_file_root_is_rejected(app, file_root, path):
+    response = app(file_root=str(file_root)).get(
+        "/info", params={"url": f"{file_root.as_uri()}/{path}"}
+    )
+    status = 404 if path == "missing.tif" else 403
+    assert response.status_code == status
+
+
+def test_file_urls_are_rejected_without_file_root(app, file_root):
+    response = app().get("/info", params={"url": (file_root / "cog.tif").as_uri()})
+    assert response.status_code == 403
+
+
+def test_stats_are_disabled_by_default(app):
+    assert app().get("/stats").status_code == 404
+
+
+def test_stats_are_not_cached(app):
+    response = app(stats=True).get("/stats")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-store"
+    assert "tile_cache" in response.json()
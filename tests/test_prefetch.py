@@ -0,0 +1,182 @@
+import asyncio
+
+import pytest
+
+from aiocogdumper.cog_tiles import COGTiff, Overflow
+from conftest import make_cog
+from prefetch import TilePrefetcher
+from singleflight import SingleFlight
+from tilecache import TileCache
+
+
+class GatedReader:
+    """Reads a file held in memory once `gate` is set and counts the reads"""
+
+    def __init__(self, data):
+        self.data = data
+        self.reads = 0
+        self.gate = asyncio.Event()
+
+    async def read(self, offset, length):
+        self.reads += 1
+        await self.gate.wait()
+        return self.data[offset : offset + length]
+
+
+@pytest.fixture(scope="module")
+def cog_data(tj):
+    # 4x3 tiles in full resolution, 2x2 and 1x1 in the overviews
+    return make_cog(tj)
+
+
+def open_cog(data):
+    reader = GatedReader(data)
+    reader.gate.set()
+    cog = COGTiff(reader.read, source="cog.tif", max_range_gap=1024)
+    asyncio.run(cog.read_header())
+    reader.gate.clear()
+    reader.reads = 0
+    return cog, reader
+
+
+@pytest.mark.parametrize(
+    "tile, expected",
+    [
+        ((2, 0, 0), [(1, 0, 0), (1, 1, 0), (1, 0, 1), (1, 1, 1)]),
+        (
+            (1, 0, 0),
+            [(1, 1, 0), (1, 0, 1), (1, 1, 1), (0, 0, 0), (0, 1, 0), (0, 0, 1)]
+            + [(0, 1, 1)],
+        ),
+        ((1, 1, 1), [(1, 0, 0), (1, 1, 0), (1, 0, 1), (0, 2, 2), (0, 3, 2)]),
+        ((0, 3, 2), [(0, 2, 1), (0, 3, 1), (0, 2, 2)]),
+    ],
+)
+def test_neighbours_and_children(cog_data, tile, expected):
+    cog, reader = open_cog(cog_data[0])
+    reader.gate.set()
+    neighbours = asyncio.run(TilePrefetcher._neighbours(cog, *tile))
+    assert sorted(neighbours) == sorted(expected)
+
+
+def prefetch(cog, prefetcher, tile):
+    prefetcher.schedule(cog, *tile, Overflow.Pad)
+    return asyncio.gather(*prefetcher._tasks)
+
+
+def test_prefetched_tiles_are_cached_and_counted(cog_data):
+    data, ifds = cog_data
+    cog, reader = open_cog(data)
+    prefetcher = TilePrefetcher(TileCache(2**24), SingleFlight(), 1, 2**24)
+
+    async def run():
+        reader.gate.set()
+        await prefetch(cog, prefetcher, (2, 0, 0))
+
+    asyncio.run(run())
+    keys = [("cog.tif", 1, x, y, Overflow.Pad) for y in (0, 1) for x in (0, 1)]
+    assert [prefetcher.tile_cache.get(key) for key in keys] == ifds[1][2]
+    assert prefetcher.stats()["prefetched"] == 4
+    assert prefetcher.size == sum(map(len, ifds[1][2]))
+
+    prefetcher.hit(keys[0])
+    prefetcher.hit(keys[0])
+    prefetcher.hit(("cog.tif", 0, 0, 0, Overflow.Pad))
+    stats = prefetcher.stats()
+    assert (stats["hits"], stats["wasted"]) == (1, 0)
+    assert stats["hit_ratio"] == 0.25
+    assert prefetcher.size == sum(map(len, ifds[1][2][1:]))
+
+
+def test_unused_prefetched_bytes_are_limited(cog_data):
+    data, ifds = cog_data
+    cog, reader = open_cog(data)
+    # Room for two of the overview tiles
+    max_bytes = sum(map(len, ifds[1][2][:2]))
+    prefetcher = TilePrefetcher(TileCache(2**24), SingleFlight(), 1, max_bytes)
+
+    async def run():
+        reader.gate.set()
+        await prefetch(cog, prefetcher, (2, 0, 0))
+
+    asyncio.run(run())
+    stats = prefetcher.stats()
+    assert (stats["prefetched"], stats["wasted"]) == (4, 2)
+    assert prefetcher.size <= max_bytes
+    # The oldest unused tiles are forgotten, hits on them are not counted
+    for x, y in ((0, 0), (1, 0), (0, 1), (1, 1)):
+        prefetcher.hit(("cog.tif", 1, x, y, Overflow.Pad))
+    assert prefetcher.stats()["hits"] == 2
+
+
+def test_prefetches_are_skipped_at_the_limits(cog_data):
+    data, ifds = cog_data
+    cog, reader = open_cog(data)
+    prefetcher = TilePrefetcher(TileCache(2**24), SingleFlight(), 1, 2**24)
+
+    async def run():
+        prefetch_done = prefetch(cog, prefetcher, (2, 0, 0))
+        # Only one prefetch at a time
+        prefetcher.schedule(cog, 1, 0, 0, Overflow.Pad)
+        reader.gate.set()
+        await prefetch_done
+        # No room for more unused tiles
+        prefetcher.max_bytes = prefetcher.size
+        prefetcher.schedule(cog, 1, 0, 0, Overflow.Pad)
+
+    asyncio.run(run())
+    assert prefetcher.stats()["skipped"] == 2
+    assert reader.reads == 1
+
+
+def test_requests_wait_for_prefetched_tiles(cog_data):
+    data, ifds = cog_data
+    cog, reader = open_cog(data)
+    flight = SingleFlight()
+    prefetcher = TilePrefetcher(TileCache(2**24), flight, 1, 2**24)
+    key = ("cog.tif", 1, 1, 1, Overflow.Pad)
+
+    async def fetch():
+        _, tilebytes = await cog.get_tile(1, 1, 1)
+        return tilebytes
+
+    async def run():
+        prefetch_done = prefetch(cog, prefetcher, (2, 0, 0))
+        await asyncio.sleep(0)
+        assert key in flight
+        # A request for a tile being prefetched shares the read of the prefetch
+        request = asyncio.ensure_future(flight.do(key, fetch))
+        await asyncio.sleep(0.01)
+        reader.gate.set()
+        await prefetch_done
+        return await request
+
+    assert asyncio.run(run()) == ifds[1][2][1 * 2 + 1]
+    # The overview tiles are read with a single merged read
+    assert reader.reads == 1
+    assert flight.stats()["coalesced"] == 1
+
+
+def test_failed_prefetch_fails_waiting_requests(cog_data):
+    cog, reader = open_cog(cog_data[0])
+    flight = SingleFlight()
+    prefetcher = TilePrefetcher(TileCache(2**24), flight, 1, 2**24)
+    key = ("cog.tif", 1, 1, 1, Overflow.Pad)
+
+    async def fail(offset, length):
+        await asyncio.sleep(0.01)
+        raise ConnectionResetError()
+
+    cog.read = fail
+
+    async def run():
+        prefetch_done = prefetch(cog, prefetcher, (2, 0, 0))
+        await asyncio.sleep(0)
+        request = asyncio.ensure_future(flight.do(key, None))
+        await prefetch_done
+        return await request
+
+    with pytest.raises(ConnectionResetError):
+        asyncio.run(run())
+    assert key not in flight
+    assert prefetcher.in_flight == 0
@@ -0,0 +1,66 @@
+import asyncio
+
+from aiocogdumper.ranges import plan_ranges, read_ranges
+
+
+def test_ranges_within_max_gap_are_merged():
+    ranges = [(100, 10), (0, 10), (15, 5), (50, 10)]
+    assert plan_ranges(ranges) == [
+        (0, 10, [1]),
+        (15, 5, [2]),
+        (50, 10, [3]),
+        (100, 10, [0]),
+    ]
+    assert plan_ranges(ranges, max_gap=5) == [
+        (0, 20, [1, 2]),
+        (50, 10, [3]),
+        (100, 10, [0]),
+    ]
+    assert plan_ranges(ranges, max_gap=40) == [(0, 110, [1, 2, 3, 0])]
+
+
+def test_adjacent_and_overlapping_ranges_are_merged():
+    ranges = [(0, 10), (10, 10), (5, 30), (12, 2)]
+    assert plan_ranges(ranges) == [(0, 35, [0, 2, 1, 3])]
+
+
+def test_merged_reads_are_split_at_max_merged_bytes():
+    ranges = [(0, 10), (10, 10), (25, 10), (40, 10), (50, 5)]
+    assert plan_ranges(ranges, max_gap=10, max_merged_bytes=30) == [
+        (0, 20, [0, 1]),
+        (25, 30, [2, 3, 4]),
+    ]
+    assert plan_ranges(ranges, max_gap=10) == [(0, 55, [0, 1, 2, 3, 4])]
+
+
+def test_range_longer_than_max_merged_bytes_is_read_whole():
+    ranges = [(0, 10), (10, 100), (110, 10)]
+    assert plan_ranges(ranges, max_merged_bytes=50) == [
+        (0, 10, [0]),
+        (10, 100, [1]),
+        (110, 10, [2]),
+    ]
+
+
+def test_empty_ranges_are_not_read():
+    assert plan_ranges([(0, 0), (10, 5), (12, 0)]) == [(10, 5, [1])]
+    assert plan_ranges([]) == []
+
+
+def test_read_ranges_returns_ranges_in_order():
+    data = bytes(range(256))
+    reads = []
+
+    async def read(offset, length):
+        reads.append((offset, length))
+        return data[offset : offset + length]
+
+    ranges = [(200, 10), (0, 4), (8, 4), (0, 0), (6, 10)]
+    result = asyncio.run(read_ranges(read, ranges, max_gap=4))
+    assert result == [data[o : o + n] for o, n in ranges]
+    assert sorted(reads) == [(0, 16), (200, 10)]
+
+    reads.clear()
+    result = asyncio.run(read_ranges(read, ranges, max_gap=4, max_merged_bytes=12))
+    assert result == [data[o : o + n] for o, n in ranges]
+    assert sorted(reads) == [(0, 4), (6, 10), (200, 10)]
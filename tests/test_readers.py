@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from aiocogdumper.errors import UnsupportedSchemeError
+from aiocogdumper.readers import ReaderRegistry
+
+
+class MemoryReader:
+    """Reads a file held in memory, failing reads past its end"""
+
+    etag = '"memory"'
+
+    def __init__(self, url, headers, data=bytes(range(100))):
+        self.url = url
+        self.headers = headers
+        self.data = data
+
+    async def read(self, offset, length):
+        if offset + length > len(self.data):
+            raise ValueError("Read past the end")
+        return self.data[offset : offset + length]
+
+    async def read_many(self, ranges, max_gap=0, max_merged_bytes=0):
+        return [await self.read(offset, length) for offset, length in ranges]
+
+    async def stream(self, offset, length):
+        for start in range(offset, offset + length, 10):
+            yield await self.read(start, min(10, offset + length - start))
+
+
+def test_readers_by_scheme():
+    registry = ReaderRegistry()
+    registry.register(["http", "HTTPS"], MemoryReader)
+    registry.register("mem", lambda url, headers: MemoryReader(url, headers, b"mem"))
+    assert registry.schemes == ["http", "https", "mem"]
+
+    reader = registry.reader("HTTPS://host/cog.tif", {"token": "abc"})
+    # Attributes are those of the wrapped reader
+    assert reader.url == "HTTPS://host/cog.tif"
+    assert reader.headers == {"token": "abc"}
+    assert reader.etag == '"memory"'
+    assert asyncio.run(registry.reader("mem://cog.tif").read(0, 3)) == b"mem"
+    with pytest.raises(UnsupportedSchemeError):
+        registry.reader("ftp://host/cog.tif")
+
+
+def test_reads_are_counted_per_scheme():
+    registry = ReaderRegistry()
+    registry.register("http", MemoryReader)
+    registry.register("mem", MemoryReader)
+    reader = registry.reader("http://host/cog.tif")
+
+    async def read():
+        await reader.read(0, 10)
+        await reader.read_many([(0, 5), (20, 5), (40, 5)])
+        chunks = [chunk async for chunk in reader.stream(50, 25)]
+        assert b"".join(chunks) == bytes(range(50, 75))
+        with pytest.raises(ValueError):
+            await reader.read(95, 10)
+        with pytest.raises(ValueError):
+            async for _ in reader.stream(90, 20):
+                pass
+
+    asyncio.run(read())
+    registry.reader("http://host/other.tif")
+    stats = registry.stats()
+    assert stats["http"] == {
+        "readers": 2,
+        "reads": 5,
+        "ranges": 7,
+        "bytes": 10 + 15 + 25 + 10,
+        "errors": 2,
+    }
+    assert stats["mem"] == dict.fromkeys(stats["mem"], 0)
+
+
+def test_registered_scheme_is_replaced():
+    registry = ReaderRegistry()
+    registry.register("http", MemoryReader)
+    registry.reader("http://host/cog.tif")
+    registry.register("http", lambda url, headers: MemoryReader(url, headers, b"new"))
+    assert asyncio.run(registry.reader("http://host/cog.tif").read(0, 3)) == b"new"
+    # The counters of the scheme are kept
+    assert registry.stats()["http"]["readers"] == 2
@@ -0,0 +1,153 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from aiocogdumper.errors import HTTPError, UpstreamUnavailableError
+from aiocogdumper.httpdumper import Reader as HttpReader
+from retry import CircuitBreakers, Retrier, RetryingReader
+
+
+@pytest.fixture
+def cog_url(upstream):
+    upstream.files["cog.tif"] = bytes(range(256)) * 4
+    return f"{upstream.url}/cog.tif"
+
+
+def run(url, retrier, read, timeout=5.0):
+    """Runs `read(reader)` with a retrying reader of `url`"""
+
+    async def main():
+        async with aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as session:
+            return await read(RetryingReader(HttpReader(url, session), retrier))
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("retry_timeouts, attempts", [(False, 1), (True, 3)])
+def test_timeouts_are_retried_if_enabled(upstream, cog_url, retry_timeouts, attempts):
+    upstream.delay = 0.5
+    breakers = CircuitBreakers(failures=10)
+    retrier = Retrier(2, 0, breakers=breakers, retry_timeouts=retry_timeouts)
+    with pytest.raises(asyncio.TimeoutError):
+        run(cog_url, retrier, lambda reader: reader.read(0, 10), timeout=0.1)
+    assert upstream.requests["cog.tif"] == attempts
+    # Timeouts count as failures of the host
+    assert breakers._circuits[upstream.url.split("//")[1]].failures == attempts
+
+
+def read(reader):
+    return reader.read(0, 10)
+
+
+def test_transient_failures_are_retried(upstream, cog_url):
+    upstream.statuses = [503, 502]
+    retrier = Retrier(2, 0)
+    assert run(cog_url, retrier, read) == upstream.files["cog.tif"][:10]
+    assert upstream.requests["cog.tif"] == 3
+    assert retrier.stats() == {
+        "attempts": 3,
+        "retried": 2,
+        "recovered": 1,
+        "exhausted": 0,
+    }
+
+
+def test_retries_are_limited(upstream, cog_url):
+    upstream.statuses = [503] * 4
+    retrier = Retrier(2, 0)
+    with pytest.raises(HTTPError) as error:
+        run(cog_url, retrier, read)
+    assert error.value.status == 503
+    assert upstream.requests["cog.tif"] == 3
+    assert retrier.stats()["exhausted"] == 1
+
+
+def test_other_failures_are_not_retried(upstream, cog_url):
+    upstream.statuses = [404]
+    breakers = CircuitBreakers(failures=1)
+    retrier = Retrier(2, 0, breakers=breakers)
+    with pytest.raises(HTTPError) as error:
+        run(cog_url, retrier, read)
+    assert error.value.status == 404
+    assert upstream.requests["cog.tif"] == 1
+    assert retrier.stats()["retried"] == 0
+    # The host answered, so its circuit stays closed
+    assert breakers.stats()["trips"] == 0
+
+
+def test_circuit_breaker(upstream, cog_url):
+    breakers = CircuitBreakers(failures=2, reset_timeout=0.2)
+    retrier = Retrier(0, breakers=breakers)
+
+    async def reads(reader):
+        upstream.statuses = [503, 503]
+        for _ in range(2):
+            with pytest.raises(HTTPError):
+                await reader.read(0, 10)
+        # Open, so reads fail without a request
+        with pytest.raises(UpstreamUnavailableError) as error:
+            await reader.read(0, 10)
+        # Retry-After is in whole seconds
+        assert error.value.retry_after == 1
+        assert upstream.requests["cog.tif"] == 2
+
+        # A single read probes the host after the reset timeout. It fails, so the
+        # circuit opens again
+        await asyncio.sleep(0.25)
+        upstream.statuses = [503]
+        probe = asyncio.ensure_future(reader.read(0, 10))
+        await asyncio.sleep(0)
+        with pytest.raises(UpstreamUnavailableError):
+            await reader.read(0, 10)
+        with pytest.raises(HTTPError):
+            await probe
+        with pytest.raises(UpstreamUnavailableError):
+            await reader.read(0, 10)
+        assert upstream.requests["cog.tif"] == 3
+
+        # A successful probe closes the circuit
+        await asyncio.sleep(0.25)
+        assert await reader.read(0, 10) == upstream.files["cog.tif"][:10]
+        assert await reader.read(0, 10) == upstream.files["cog.tif"][:10]
+
+    run(cog_url, retrier, reads)
+    assert breakers.stats() == {"hosts": 0, "open": 0, "trips": 1, "rejected": 3}
+
+
+def test_open_circuit_answers_503_with_retry_after(app, upstream, cog_url):
+    client = app(retries=0, breaker_failures=1, breaker_reset_timeout=30)
+    upstream.statuses = [503]
+    assert client.get("/info", params={"url": cog_url}).status_code == 502
+    response = client.get("/info", params={"url": cog_url})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "30"
+    assert upstream.requests["cog.tif"] == 1
+
+
+async def stream(reader):
+    chunks = []
+    try:
+        async for chunk in reader.stream(0, 1024):
+            chunks.append(chunk)
+    except aiohttp.ClientPayloadError:
+        return b"".join(chunks), "failed"
+    return b"".join(chunks), "done"
+
+
+def test_stream_is_retried_before_the_first_bytes(upstream, cog_url):
+    upstream.statuses = [503]
+    retrier = Retrier(2, 0)
+    assert run(cog_url, retrier, stream) == (upstream.files["cog.tif"], "done")
+    assert upstream.requests["cog.tif"] == 2
+    assert retrier.stats()["recovered"] == 1
+
+
+def test_stream_is_not_retried_after_the_first_bytes(upstream, cog_url):
+    upstream.cut = 100
+    retrier = Retrier(2, 0)
+    assert run(cog_url, retrier, stream) == (upstream.files["cog.tif"][:100], "failed")
+    assert upstream.requests["cog.tif"] == 1
+    assert retrier.stats()["retried"] == 0
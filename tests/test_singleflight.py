@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return b"tile"
+
+    async def main():
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+        assert results == [b"tile"] * 5
+        assert "key" not in flight
+        # A finished call is not reused
+        assert await flight.do("key", fetch) == b"tile"
+
+    asyncio.run(main())
+    assert len(calls) == 2
+    assert flight.stats() == {"in_flight": 0, "calls": 2, "coalesced": 4}
+
+
+def test_calls_for_other_keys_are_not_shared():
+    flight = SingleFlight()
+
+    async def main():
+        return await asyncio.gather(
+            flight.do("a", lambda: asyncio.sleep(0.01, "a")),
+            flight.do("b", lambda: asyncio.sleep(0.01, "b")),
+        )
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert flight.stats()["coalesced"] == 0
+
+
+def test_exceptions_are_shared_and_not_kept():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def main():
+        results = await asyncio.gather(
+            flight.do("key", fail), flight.do("key", fail), return_exceptions=True
+        )
+        assert all(isinstance(r, ValueError) for r in results)
+        assert await flight.do("key", lambda: asyncio.sleep(0, "retried")) == "retried"
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_cancel_the_call():
+    flight = SingleFlight()
+
+    async def main():
+        first = asyncio.ensure_future(
+            flight.do("key", lambda: asyncio.sleep(0.05, "tile"))
+        )
+        second = asyncio.ensure_future(flight.do("key", lambda: asyncio.sleep(0)))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert await second == "tile"
+
+    asyncio.run(main())
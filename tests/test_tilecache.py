@@ -0,0 +1,54 @@
+from tilecache import TileCache
+
+
+def test_size_is_sum_of_cached_tiles():
+    cache = TileCache(100)
+    cache.put("a", b"x" * 30)
+    cache.put("b", b"x" * 20)
+    assert cache.size == 50
+    # Replacing a tile counts only its new size
+    cache.put("a", b"x" * 10)
+    assert cache.size == 30
+    assert len(cache) == 2
+    cache.clear()
+    assert cache.size == 0
+    assert len(cache) == 0
+
+
+def test_least_recently_used_tiles_are_evicted():
+    cache = TileCache(100)
+    cache.put("a", b"x" * 40)
+    cache.put("b", b"x" * 40)
+    assert cache.get("a") is not None
+    cache.put("c", b"x" * 40)
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+    assert cache.size == 80
+    # A tile filling the cache evicts all others
+    cache.put("d", b"x" * 100)
+    assert cache.size == 100
+    assert list(cache._tiles) == ["d"]
+    assert cache.stats()["evictions"] == 3
+
+
+def test_tiles_larger_than_the_cache_are_not_stored():
+    cache = TileCache(10)
+    cache.put("a", b"x" * 5)
+    cache.put("b", b"x" * 11)
+    assert "b" not in cache
+    assert cache.size == 5
+    assert cache.stats()["evictions"] == 0
+
+
+def test_disabled_cache_stores_nothing():
+    cache = TileCache(0)
+    cache.put("a", b"x")
+    assert cache.get("a") is None
+    assert cache.stats() == {
+        "entries": 0,
+        "bytes": 0,
+        "max_bytes": 0,
+        "hits": 0,
+        "misses": 1,
+        "evictions": 0,
+    }
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+from aiocogdumper.workerpool import WorkerPool
+
+
+def test_without_workers_runs_in_event_loop():
+    pool = WorkerPool(workers=0)
+    pool.start()
+
+    async def run():
+        return await pool.run(threading.get_ident)
+
+    assert asyncio.run(run()) == threading.get_ident()
+    assert pool.stats()["workers"] == 0
+    assert pool.stats()["completed"] == 0
+
+
+def test_full_queue_suspends_callers():
+    pool = WorkerPool(workers=1, queue_size=1)
+    release = threading.Event()
+
+    async def run():
+        pool.start()
+        try:
+            jobs = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(4)]
+            await asyncio.sleep(0.05)
+            # One job runs and one is queued in the pool, the others wait for room
+            assert (pool.in_pool, pool.waiting) == (2, 2)
+            release.set()
+            return await asyncio.gather(*jobs)
+        finally:
+            pool.stop()
+
+    assert asyncio.run(run()) == [True] * 4
+    assert (pool.in_pool, pool.waiting, pool.completed) == (0, 0, 4)
+
+
+def test_stop_while_job_is_running():
+    pool = WorkerPool(workers=1)
+    release = threading.Event()
+
+    async def run():
+        pool.start()
+        job = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+        pool.stop()
+        release.set()
+        return await job
+
+    assert asyncio.run(run()) is True
+    assert pool.stats()["workers"] == 0